@@ -0,0 +1,232 @@
+"""
+生成器规模基准测试
+
+驱动examples/中的ring、dual-ring、mesh、tree-mesh和两阶段alltoall生成器，
+分别统计Chunk操作构建、build_all_dependencies和save_xml三个阶段的耗时，
+并记录峰值RSS（以及可选的tracemalloc峰值），结果输出为JSON。
+
+每个(生成器, rank数)组合在独立子进程中运行，保证峰值内存互不影响。
+
+用法:
+    python benchmarks/bench_scaling.py                              # 全部生成器, 8..4096 ranks
+    python benchmarks/bench_scaling.py -g ring mesh -r 8 64 128 -o result.json
+    python benchmarks/bench_scaling.py --tracemalloc --timeout 600
+    python benchmarks/bench_scaling.py -g two_step_alltoall -r 1024 --storage columnar
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(REPO_ROOT, "examples")
+
+DEFAULT_RANKS = [8, 64, 128, 512, 1024, 4096]
+GPUS_PER_NODE = 8
+
+
+def _node_layout(ranks: int) -> Dict[str, int]:
+    gpus_per_node = min(GPUS_PER_NODE, ranks)
+    return {"node_num": ranks // gpus_per_node, "gpus_per_node": gpus_per_node}
+
+
+# 生成器名称 -> (示例文件, 生成函数, rank数 -> 参数)
+GENERATORS: Dict[str, Any] = {
+    "ring": ("allgather/ring.py", "generate_allgather_ring_xml",
+             lambda ranks: {"ngpus": ranks, "instances": 1, "ring_channels": 1}),
+    "dual_ring": ("allgather/inter_first/inter_first_dual_ring.py", "generate_dual_ring_allgather_xml",
+                  lambda ranks: dict(_node_layout(ranks), instances=1, data_steps=1, inter_ring_channels=1,
+                                     intra_ring_instances=1, intra_ring_channels=1)),
+    "mesh": ("allgather/inter_first/inter_first_mesh_mesh.py", "generate_inter_first_mesh_mesh_allgather_xml",
+             lambda ranks: dict(_node_layout(ranks), instances=1, ring_channels=1, p2p_channels=1)),
+    "tree_mesh": ("allgather/inter_first/inter_first_tree_mesh.py", "generate_inter_first_tree_mesh_allgather_xml",
+                  lambda ranks: dict(_node_layout(ranks), instances=1, ring_channels=1, p2pchannels=1)),
+    "two_step_alltoall": ("alltoall/two_step_alltoall.py", "generate_alltoall_2step_xml",
+                          lambda ranks: {"node_nums": _node_layout(ranks)["node_num"],
+                                         "gpus_pernode": _node_layout(ranks)["gpus_per_node"],
+                                         "instances": 1, "p2pchannels": 1}),
+}
+
+
+def _load_generator(rel_path: str, func_name: str) -> Callable:
+    """加载示例文件中的生成函数（部分示例从旧包名xml_generator_tools导入）"""
+    sys.path.insert(0, REPO_ROOT)
+    import msccl_xml_builder
+    sys.modules.setdefault("xml_generator_tools", msccl_xml_builder)
+    spec = importlib.util.spec_from_file_location(f"bench_{func_name}", os.path.join(EXAMPLES_DIR, rel_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, func_name)
+
+
+@contextlib.contextmanager
+def _capture_algo(captured: Dict[str, Any]):
+    """
+    运行生成器期间拦截build_all_dependencies和save_xml，
+    记录生成器构建的Algo及其调用参数，使三个阶段可以分别计时
+    """
+    from msccl_xml_builder import Algo
+    orig_build, orig_save = Algo.build_all_dependencies, Algo.save_xml
+
+    def build(self, *args, **kwargs):
+        captured["algo"] = self
+        captured["build_args"] = (args, kwargs)
+
+    def save(self, *args, **kwargs):
+        captured["algo"] = self
+
+    Algo.build_all_dependencies, Algo.save_xml = build, save
+    try:
+        yield
+    finally:
+        Algo.build_all_dependencies, Algo.save_xml = orig_build, orig_save
+
+
+@contextlib.contextmanager
+def _default_storage(storage: str):
+    """运行生成器期间让Algo默认使用指定的step存储方式（示例代码不传storage参数）"""
+    from msccl_xml_builder import Algo
+    orig_init = Algo.__init__
+
+    def init(self, *args, **kwargs):
+        kwargs.setdefault("storage", storage)
+        orig_init(self, *args, **kwargs)
+
+    Algo.__init__ = init
+    try:
+        yield
+    finally:
+        Algo.__init__ = orig_init
+
+
+def _measure(phase: str, result: Dict[str, Any], use_tracemalloc: bool, fn: Callable[[], Any]) -> Any:
+    if use_tracemalloc:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    value = fn()
+    result[f"{phase}_s"] = time.perf_counter() - start
+    if use_tracemalloc:
+        result.setdefault("tracemalloc_peak_bytes", {})[phase] = tracemalloc.get_traced_memory()[1]
+    return value
+
+
+def run_case(generator: str, ranks: int, workers: int, use_tracemalloc: bool, keep_xml: Optional[str],
+             storage: str = "object") -> Dict[str, Any]:
+    """在当前进程中运行单个基准测试并返回结果"""
+    rel_path, func_name, make_kwargs = GENERATORS[generator]
+    kwargs = make_kwargs(ranks)
+    result: Dict[str, Any] = {"generator": generator, "ranks": ranks, "params": kwargs,
+                              "workers": workers, "tracemalloc": use_tracemalloc, "storage": storage}
+    generate = _load_generator(rel_path, func_name)
+
+    if use_tracemalloc:
+        tracemalloc.start()
+
+    captured: Dict[str, Any] = {}
+    workdir = tempfile.mkdtemp(prefix="msccl_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with _capture_algo(captured), _default_storage(storage), contextlib.redirect_stdout(io.StringIO()):
+            _measure("construct", result, use_tracemalloc, lambda: generate(**kwargs))
+    finally:
+        os.chdir(cwd)
+
+    algo = captured["algo"]
+    args, build_kwargs = captured.get("build_args", ((), {}))
+    _measure("build", result, use_tracemalloc, lambda: algo.build_all_dependencies(*args, **build_kwargs))
+
+    xml_path = keep_xml or os.path.join(workdir, "bench.xml")
+    _measure("save", result, use_tracemalloc, lambda: algo.save_xml(xml_path, workers=workers))
+
+    if use_tracemalloc:
+        tracemalloc.stop()
+
+    result["xml_bytes"] = os.path.getsize(xml_path)
+    if not keep_xml:
+        os.remove(xml_path)
+    os.rmdir(workdir)
+    result["tbs"] = sum(len(gpu.tbs) for gpu in algo.gpus)
+    result["steps"] = sum(len(gpu.table) if gpu.table is not None else sum(len(tb.steps) for tb in gpu.tbs)
+                          for gpu in algo.gpus)
+    # Linux上ru_maxrss单位为KB，macOS上为字节
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result["peak_rss_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+    result["status"] = "ok"
+    return result
+
+
+def run_case_subprocess(generator: str, ranks: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """在独立子进程中运行单个基准测试，避免峰值内存相互干扰"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--single", generator, str(ranks),
+           "--workers", str(args.workers), "--storage", args.storage]
+    if args.tracemalloc:
+        cmd.append("--tracemalloc")
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        return {"generator": generator, "ranks": ranks, "status": "timeout", "timeout_s": args.timeout}
+    if proc.returncode != 0:
+        return {"generator": generator, "ranks": ranks, "status": "error",
+                "error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="MSCCL-XML-Builder scaling benchmarks")
+    parser.add_argument("-g", "--generators", nargs="+", choices=sorted(GENERATORS), default=list(GENERATORS))
+    parser.add_argument("-r", "--ranks", nargs="+", type=int, default=DEFAULT_RANKS)
+    parser.add_argument("-o", "--output", help="JSON结果文件，默认输出到stdout")
+    parser.add_argument("--workers", type=int, default=1, help="save_xml的并行进程数")
+    parser.add_argument("--storage", choices=("object", "columnar"), default="object", help="Algo的step存储方式")
+    parser.add_argument("--tracemalloc", action="store_true", help="记录各阶段tracemalloc峰值（会显著增加耗时）")
+    parser.add_argument("--timeout", type=float, default=None, help="单个用例的超时时间（秒）")
+    parser.add_argument("--single", nargs=2, metavar=("GENERATOR", "RANKS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        generator, ranks = args.single
+        print(json.dumps(run_case(generator, int(ranks), args.workers, args.tracemalloc, None, args.storage)))
+        return 0
+
+    results = []
+    for generator in args.generators:
+        for ranks in args.ranks:
+            result = run_case_subprocess(generator, ranks, args)
+            results.append(result)
+            summary = " ".join(f"{phase}={result[phase + '_s']:.2f}s"
+                               for phase in ("construct", "build", "save") if phase + "_s" in result)
+            print(f"{generator:>18} {ranks:>5} ranks: {result['status']} {summary}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "workers": args.workers,
+            "storage": args.storage,
+            "tracemalloc": args.tracemalloc,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
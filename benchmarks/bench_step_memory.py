@@ -0,0 +1,87 @@
+"""
+Step内存占用基准测试
+
+用tracemalloc统计单个Step对象的平均字节数，并与STEP_BYTE_BUDGET比较：
+- bare: 新建、尚未加入TB、无依赖的step（__slots__对象本身，依赖容器未分配）
+- in_tb: 加入TB后的增量（steps列表槽位 + TB的buffer范围计数）
+- with_dep: 每个step依赖另一个TB中的一个step时的增量（分配dep_list/depended_by_list）
+
+bare超出预算时以非零状态退出，可用于回归检查。
+
+用法:
+    python benchmarks/bench_step_memory.py
+    python benchmarks/bench_step_memory.py -n 200000 -o step_memory.json
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from typing import Callable, Dict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from msccl_xml_builder import Step, TB  # noqa: E402
+
+# 未分配依赖容器的Step对象的字节预算（64位CPython）
+STEP_BYTE_BUDGET = 256
+
+
+def _traced_bytes(fn: Callable[[], object]) -> int:
+    """返回fn执行期间新增且仍存活的内存字节数"""
+    before = tracemalloc.get_traced_memory()[0]
+    keep = fn()
+    after = tracemalloc.get_traced_memory()[0]
+    del keep
+    return after - before
+
+
+def measure(n: int) -> Dict[str, float]:
+    # 预先创建offset整数，避免把int对象的分配计入step
+    offsets = list(range(n))
+    tracemalloc.start()
+    try:
+        steps = []
+        bare = _traced_bytes(lambda: steps.extend(
+            Step(type="s", srcbuf="o", srcoff=off, dstbuf="o", dstoff=off, cnt=1) for off in offsets))
+
+        tb = TB(id=0, send=1, recv=1, chan=0)
+        in_tb = _traced_bytes(lambda: [tb.add_step(step) for step in steps])
+
+        local_tb = TB(id=1, send=-1, recv=-1, chan=0)
+        dep_steps = [Step(type="cpy", srcbuf="i", srcoff=off, dstbuf="o", dstoff=off, cnt=1) for off in offsets]
+        for step in dep_steps:
+            local_tb.add_step(step)
+        with_dep = _traced_bytes(lambda: [step.add_dep(dep) for step, dep in zip(steps, dep_steps)])
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "steps": n,
+        "bare_bytes_per_step": bare / n,
+        "in_tb_bytes_per_step": in_tb / n,
+        "with_dep_bytes_per_step": with_dep / n,
+        "budget_bytes_per_step": STEP_BYTE_BUDGET,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--steps", type=int, default=100000, help="step数量")
+    parser.add_argument("-o", "--output", help="结果JSON文件，默认输出到stdout")
+    args = parser.parse_args()
+
+    result = measure(args.steps)
+    result["within_budget"] = result["bare_bytes_per_step"] <= STEP_BYTE_BUDGET
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if result["within_budget"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
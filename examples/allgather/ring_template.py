@@ -0,0 +1,69 @@
+from msccl_xml_builder import Algo
+
+def generate_allgather_ring_template_xml(ngpus: int = 128, instances: int = 1, ring_channels: int = 1, filename: str = None):
+    """
+    用rank对称模板生成AllGather Ring算法的XML文件，输出与ring.py逐字节一致
+
+    只描述单个rank的程序，输出XML时逐个rank展开，内存占用与GPU数量无关
+
+    Args:
+        ngpus: GPU数量
+        instances: 实例数
+        ring_channels: 每个实例的ring通道数
+        filename: 输出文件名，如果为None则自动生成
+    """
+    if filename is None:
+        filename = f"ring_template_instances{instances}_ringchannels{ring_channels}_gpus{ngpus}.xml"
+
+    algo = Algo(
+        name="allgather_ring_oop",
+        proto="Simple",
+        nchannels=ring_channels*instances,
+        nchunksperloop=instances*ngpus,
+        ngpus=ngpus,
+        coll="allgather",
+        inplace=1,
+        outofplace=1,
+        minBytes=0,
+        maxBytes=0
+    )
+
+    def program(ctx):
+        rank = ctx.rank
+        next_rank = (rank + 1) % ngpus
+        prev_rank = (rank - 1) % ngpus
+
+        for instance in range(instances):
+            # 第一步：本地copy
+            copy_step = ctx.copy("i", instance, "o", rank*instances+instance, chan=instance)
+
+            # 第二步：创建ring TB
+            for channel in range(ring_channels):
+                ctx.add_tb(send=next_rank, recv=prev_rank, chan=ring_channels*instance + channel)
+
+            # 第三步：(ngpus-1)轮ring传输，每轮的send依赖上一轮的recv
+            prev_recv_step = copy_step
+            for round_num in range(ngpus - 1):
+                data_owner = (rank - round_num) % ngpus
+                ctx.send(next_rank, "o", data_owner*instances+instance,
+                         chan=ring_channels*instance + (data_owner%ring_channels),
+                         dep_steps=[prev_recv_step], bidirectional=False)
+
+                recv_data_owner = (prev_rank - round_num) % ngpus
+                prev_recv_step = ctx.recv(prev_rank, "o", recv_data_owner*instances+instance,
+                                          chan=instance*ring_channels + (recv_data_owner%ring_channels),
+                                          bidirectional=False)
+
+    algo.set_rank_template(program)
+
+    # 依赖在输出时逐个rank构建
+    algo.build_all_dependencies(True)
+    algo.save_xml(filename)
+    print(f"XML文件已生成: {filename}")
+
+    return algo
+
+# 主函数
+if __name__ == "__main__":
+
+    generate_allgather_ring_template_xml(ngpus=1024, instances=1, ring_channels=2)
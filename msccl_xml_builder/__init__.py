@@ -7,6 +7,7 @@ from .core.chunk import Chunk
 from .core.step import Step
 from .core.tb import TB
 from .core.gpu import GPU
+from .core.channels import ChannelGroup
 
 __version__ = "0.1.0"
-__all__ = ["Algo", "Chunk", "Step", "TB", "GPU"]
\ No newline at end of file
+__all__ = ["Algo", "Chunk", "Step", "TB", "GPU", "ChannelGroup"]
\ No newline at end of file
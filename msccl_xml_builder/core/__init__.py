@@ -1,9 +1,23 @@
 """Core components for MSCCL XML generation."""
 
-from .step import Step
+from .step import Step, StepSet
 from .tb import TB
 from .gpu import GPU
 from .algo import Algo
 from .chunk import Chunk
+from .columnar import StepTable, StepRef
+from .template import RankTemplate, RankContext
+from .simulator import CostModel, SimulationResult
+from .deadlock import DeadlockReport
+from .critical_path import CriticalPathResult
+from .channels import ChannelGroup, ChannelBalanceReport
+from .packing import PackingReport
+from .fusion import FusionReport
+from .coalesce import CoalescingReport
+from .reduction import DependencyReductionReport
 
-__all__ = ["Step", "TB", "GPU", "Algo", "Chunk"]
\ No newline at end of file
+__all__ = ["Step", "StepSet", "TB", "GPU", "Algo", "Chunk", "StepTable", "StepRef",
+           "RankTemplate", "RankContext", "CostModel", "SimulationResult", "DeadlockReport",
+           "CriticalPathResult", "ChannelGroup", "ChannelBalanceReport",
+           "PackingReport", "FusionReport", "DependencyReductionReport",
+           "CoalescingReport"]
\ No newline at end of file
@@ -1,11 +1,14 @@
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
-from typing import List
+from typing import Any, Callable, List, Optional, Sequence, TextIO, Tuple
+from .xml_writer import format_start_tag, format_end_tag
 
 class Algo:
     def __init__(self, name: str, proto: str = "Simple", nchannels: int = 1, 
                  nchunksperloop: int = 2, ngpus: int = 2, coll: str = "allgather",
-                 inplace: int = 1, outofplace: int = 1, minBytes: int = 0, maxBytes: int = 0):
+                 inplace: int = 1, outofplace: int = 1, minBytes: int = 0, maxBytes: int = 0,
+                 storage: str = "object"):
+        if storage not in ("object", "columnar"):
+            raise ValueError(f"Unknown storage '{storage}', expected 'object' or 'columnar'")
         self.name = name
         self.proto = proto
         self.nchannels = nchannels
@@ -16,56 +19,376 @@ class Algo:
         self.outofplace = outofplace
         self.minBytes = minBytes
         self.maxBytes = maxBytes
+        # "object": 每个step为一个Step对象；"columnar": step以行的形式保存在各GPU的StepTable中
+        self.storage = storage
+        # 等待分配channel的ChannelGroup操作、已由ChannelGroup使用的channel和最近一次分配的结果（见channels.py）
+        self._channel_transfers: List = []
+        self._group_channels = set()
+        self.channel_balance = None
+        self.dependency_reduction = None
+        # Chunk的index/size到XML中chunk单位的倍数，流水线切分无法整除时增大（见pipeline.py），
+        # 以及各流水线传输最后一个子recv -> 全部子recv
+        self.chunk_scale = 1
+        self._pipelines = {}
         
         # Initialize GPUs - 延迟导入避免循环导入
         from .gpu import GPU
         self.gpus: List[GPU] = []
         for i in range(ngpus):
             self.gpus.append(GPU(i))
+        if storage == "columnar":
+            from .columnar import StepTable
+            for gpu in self.gpus:
+                gpu.table = StepTable(gpu.id)
+    
+    def set_rank_template(self, program: Callable, gpus_per_node: Optional[int] = None) -> None:
+        """
+        用rank对称模板描述算法：program(ctx)只描述ctx.rank的TB和step（见template.RankContext）
+        设置后self.gpus变为按需展开的RankTemplate，只保存program本身；
+        输出XML时逐个rank展开、构建依赖、写出后丢弃，内存占用与rank数无关
+        """
+        from .template import RankTemplate
+        self.gpus = RankTemplate(program, self.ngpus, gpus_per_node)
     
     def get_gpu(self, gpu_id: int):
+        from .template import RankTemplate
+        if isinstance(self.gpus, RankTemplate):
+            # 模板每次访问都展开新的GPU，写入的step会被丢弃
+            raise ValueError("Chunk and bulk operations are not supported after set_rank_template; "
+                             "describe the steps in the rank program")
         if 0 <= gpu_id < len(self.gpus):
             return self.gpus[gpu_id]
         raise ValueError(f"GPU {gpu_id} not found")
     
-    def build_all_dependencies(self, merge_rcs: bool = False, sort: bool = True) -> None:
-        """构建所有GPU的依赖关系"""
+    @staticmethod
+    def _bulk_columns(*columns: Any) -> Tuple[int, List[Sequence]]:
+        """
+        检查批量操作的参数：序列参数必须等长，标量（int/str）广播为该长度
+        返回(元素个数, 参数列表)
+        """
+        lengths = {len(column) for column in columns if not isinstance(column, (int, str))}
+        if len(lengths) > 1:
+            raise ValueError(f"Bulk operation arguments must have equal lengths, got {sorted(lengths)}")
+        n = lengths.pop() if lengths else 1
+        return n, [[column] * n if isinstance(column, (int, str)) else column for column in columns]
+    
+    @staticmethod
+    def _check_bulk_channels(chan: Any) -> None:
+        """批量操作按给定的channel直接创建step，不支持ChannelGroup（标量或序列中的元素）"""
+        from .channels import ChannelGroup
+        channels = [chan] if isinstance(chan, (int, str, ChannelGroup)) else chan
+        if any(isinstance(channel, ChannelGroup) for channel in channels):
+            raise ValueError("ChannelGroup is not supported by bulk operations; "
+                             "use Chunk.copy_diff/copy or a fixed chan")
+    
+    @staticmethod
+    def _bulk_deps(dep_steps: Optional[Sequence], n: int) -> Sequence:
+        """dep_steps[k]为第k个元素的依赖列表（None表示无依赖）"""
+        if dep_steps is None:
+            return [()] * n
+        if len(dep_steps) != n:
+            raise ValueError(f"dep_steps must have {n} entries, got {len(dep_steps)}")
+        return [deps or () for deps in dep_steps]
+    
+    def bulk_send(self, gpu, buf, off, dest_rank, cnt, chan, dep_steps: Optional[Sequence] = None,
+                  bidirectional: bool = True) -> List:
+        """
+        批量send，等价于按顺序对每个元素调用Chunk(gpu, buf, off, cnt).send(dest_rank, chan)
+        参数为等长序列或标量（广播），返回创建的send step列表
+        """
+        from .chunk import append_step, buf_name
+        self._check_bulk_channels(chan)
+        n, (gpu, buf, off, dest_rank, cnt, chan) = self._bulk_columns(gpu, buf, off, dest_rank, cnt, chan)
+        dep_steps = self._bulk_deps(dep_steps, n)
+        scale = self.chunk_scale
+        tbs = {}  # (gpu, dest_rank, chan) -> TB，同一批次内只查找一次
+        steps = []
+        for k in range(n):
+            src = self.get_gpu(gpu[k])
+            key = (gpu[k], dest_rank[k], chan[k])
+            tb = tbs.get(key)
+            if tb is None:
+                tb = tbs[key] = src.get_send_tb(dest_rank[k], chan[k], bidirectional)
+            steps.append(append_step(self, src, tb, dep_steps[k],
+                                     type="s", srcbuf=buf_name(buf[k]), srcoff=off[k] * scale,
+                                     dstbuf="o", dstoff=-1, cnt=cnt[k] * scale))
+        return steps
+    
+    def bulk_recv(self, gpu, buf, off, src_rank, cnt, chan, dep_steps: Optional[Sequence] = None,
+                  bidirectional: bool = True) -> List:
+        """
+        批量recv，等价于按顺序对每个元素调用Chunk(gpu, buf, off, cnt).recv(src_rank, chan)
+        参数为等长序列或标量（广播），返回创建的recv step列表
+        """
+        from .chunk import append_step, buf_name
+        self._check_bulk_channels(chan)
+        n, (gpu, buf, off, src_rank, cnt, chan) = self._bulk_columns(gpu, buf, off, src_rank, cnt, chan)
+        dep_steps = self._bulk_deps(dep_steps, n)
+        scale = self.chunk_scale
+        tbs = {}  # (gpu, src_rank, chan) -> TB
+        steps = []
+        for k in range(n):
+            dst = self.get_gpu(gpu[k])
+            key = (gpu[k], src_rank[k], chan[k])
+            tb = tbs.get(key)
+            if tb is None:
+                tb = tbs[key] = dst.get_recv_tb(src_rank[k], chan[k], bidirectional)
+            steps.append(append_step(self, dst, tb, dep_steps[k],
+                                     type="r", srcbuf="i", srcoff=-1,
+                                     dstbuf=buf_name(buf[k]), dstoff=off[k] * scale, cnt=cnt[k] * scale))
+        return steps
+    
+    def bulk_copy_diff(self, src_gpu, src_buf, src_off, dst_gpu, dst_buf, dst_off, cnt, chan,
+                       dep_steps: Optional[Sequence] = None, bidirectional: bool = True) -> Tuple[List, List]:
+        """
+        批量跨GPU拷贝，等价于按顺序对每个元素k调用
+        Chunk(src_gpu[k], src_buf[k], src_off[k], cnt[k]).copy_diff(
+            Chunk(dst_gpu[k], dst_buf[k], dst_off[k], cnt[k]), chan[k], dep_steps[k])
+        
+        参数为等长序列或标量（广播）；dep_steps[k]为第k个send的依赖列表。
+        TB按(gpu, peer, chan)在批次内只查找/创建一次，send/recv直接以同步后的buffer字段创建，
+        生成的TB、step和XML与逐个调用copy_diff完全一致。
+        返回(send_steps, recv_steps)，可直接作为后续操作的依赖
+        """
+        from .chunk import append_step, buf_name
+        self._check_bulk_channels(chan)
+        n, (src_gpu, src_buf, src_off, dst_gpu, dst_buf, dst_off, cnt, chan) = self._bulk_columns(
+            src_gpu, src_buf, src_off, dst_gpu, dst_buf, dst_off, cnt, chan)
+        dep_steps = self._bulk_deps(dep_steps, n)
+        scale = self.chunk_scale
+        send_tbs = {}  # (src_gpu, dst_gpu, chan) -> 发送TB
+        recv_tbs = {}  # (dst_gpu, src_gpu, chan) -> 接收TB
+        send_steps, recv_steps = [], []
+        for k in range(n):
+            src_rank, dst_rank, channel_id = src_gpu[k], dst_gpu[k], chan[k]
+            if src_rank == dst_rank:
+                raise ValueError("copy_diff requires chunks on different GPUs")
+            src, dst = self.get_gpu(src_rank), self.get_gpu(dst_rank)
+            srcbuf, dstbuf = buf_name(src_buf[k]), buf_name(dst_buf[k])
+            srcoff, dstoff, count = src_off[k] * scale, dst_off[k] * scale, cnt[k] * scale
+            
+            send_tb = send_tbs.get((src_rank, dst_rank, channel_id))
+            if send_tb is None:
+                send_tb = send_tbs[(src_rank, dst_rank, channel_id)] = src.get_send_tb(dst_rank, channel_id, bidirectional)
+            send_step = append_step(self, src, send_tb, dep_steps[k],
+                                    type="s", srcbuf=srcbuf, srcoff=srcoff,
+                                    dstbuf=dstbuf, dstoff=dstoff, cnt=count)
+            
+            recv_tb = recv_tbs.get((dst_rank, src_rank, channel_id))
+            if recv_tb is None:
+                recv_tb = recv_tbs[(dst_rank, src_rank, channel_id)] = dst.get_recv_tb(src_rank, channel_id, bidirectional)
+            recv_step = append_step(self, dst, recv_tb, (),
+                                    type="r", srcbuf=srcbuf, srcoff=srcoff,
+                                    dstbuf=dstbuf, dstoff=dstoff, cnt=count)
+            
+            # 设置peer关系
+            send_step.peer_step = recv_step
+            recv_step.peer_step = send_step
+            
+            # 检查index一致性
+            if send_step.send_index != recv_step.recv_index:
+                raise ValueError(f"Index mismatch: send_index={send_step.send_index}, recv_index={recv_step.recv_index}")
+            
+            send_steps.append(send_step)
+            recv_steps.append(recv_step)
+        return send_steps, recv_steps
+    
+    def assign_channels(self):
+        """
+        为以ChannelGroup作为channel_id的copy/copy_diff分配具体的channel（见channels.py），
+        使各(GPU, channel)上收发的最大chunk数尽量小，并把这些step加入TB
+        返回ChannelBalanceReport：before（按每对GPU轮流使用组内channel）与after的负载、summary()
+        """
+        from .channels import assign_channels
+        self.channel_balance = assign_channels(self)
+        return self.channel_balance
+    
+    def build_all_dependencies(self, merge_rcs: bool = False, sort: bool = True,
+                               reduce_deps: bool = False) -> None:
+        """
+        构建所有GPU的依赖关系
+        列存模式下逐GPU展开为对象构建后再压缩回列，构建前返回的StepRef句柄随之失效
+        使用rank模板时只记录参数，在输出XML展开各rank时构建
+        尚未分配channel的ChannelGroup操作先由assign_channels分配
+        reduce_deps: 排序之后、构建之前删除冗余依赖（传递约简），结果保存在dependency_reduction；
+                     使用rank模板时在展开各rank时记录
+        """
+        if self._channel_transfers:
+            self.assign_channels()
+        
+        from .reduction import DependencyReductionReport
+        self.dependency_reduction = DependencyReductionReport() if reduce_deps else None
+        
+        from .template import RankTemplate
+        if isinstance(self.gpus, RankTemplate):
+            # 模板在展开每个rank时才构建依赖
+            self.gpus.build_options = (merge_rcs, sort, self.dependency_reduction)
+            return
+        
+        if self.storage == "columnar":
+            from .columnar import build_tables
+            build_tables(self.gpus, merge_rcs, sort, self.dependency_reduction)
+            return
+        
         # 第一步：对所有TB中的steps进行排序
         if sort:
             for gpu in self.gpus:
                 gpu.sort_all_tb_steps()
         
-        # 第二步：构建依赖关系
+        # 第二步：删除冗余依赖
+        if reduce_deps:
+            for gpu in self.gpus:
+                self.dependency_reduction.record(gpu.id, gpu.reduce_dependencies())
+        
+        # 第三步：构建依赖关系
         for gpu in self.gpus:
             gpu.build_dependencies(merge_rcs)
     
+    def xml_attrs(self) -> List[Tuple[str, str]]:
+        """<algo>元素的属性列表（保持输出顺序）"""
+        return [
+            ("name", self.name),
+            ("proto", self.proto),
+            ("nchannels", str(self.nchannels)),
+            ("nchunksperloop", str(self.nchunksperloop)),
+            ("ngpus", str(self.ngpus)),
+            ("coll", self.coll),
+            ("inplace", str(self.inplace)),
+            ("outofplace", str(self.outofplace)),
+            ("minBytes", str(self.minBytes)),
+            ("maxBytes", str(self.maxBytes)),
+        ]
+    
     def to_xml(self) -> ET.Element:
         algo_elem = ET.Element("algo")
-        algo_elem.set("name", self.name)
-        algo_elem.set("proto", self.proto)
-        algo_elem.set("nchannels", str(self.nchannels))
-        algo_elem.set("nchunksperloop", str(self.nchunksperloop))
-        algo_elem.set("ngpus", str(self.ngpus))
-        algo_elem.set("coll", self.coll)
-        algo_elem.set("inplace", str(self.inplace))
-        algo_elem.set("outofplace", str(self.outofplace))
-        algo_elem.set("minBytes", str(self.minBytes))
-        algo_elem.set("maxBytes", str(self.maxBytes))
+        for key, value in self.xml_attrs():
+            algo_elem.set(key, value)
         
         for gpu in self.gpus:
             algo_elem.append(gpu.to_xml())
         
         return algo_elem
     
-    def save_xml(self, filename: str) -> None:
-        xml_elem = self.to_xml()
-        rough_string = ET.tostring(xml_elem, 'unicode')
-        reparsed = minidom.parseString(rough_string)
-        pretty_string = reparsed.toprettyxml(indent="  ")
-        
-        # Remove empty lines and XML declaration for cleaner output
-        lines = [line for line in pretty_string.split('\n') if line.strip() and not line.strip().startswith('<?xml')]
-        pretty_string = '\n'.join(lines)
+    def write_xml(self, f: TextIO, workers: int = 1) -> None:
+        """
+        将整个算法以流式方式写入文件句柄
+        逐个元素输出，不构建ElementTree，内存占用与文档大小无关
+        workers > 1时并行渲染各GPU的片段，并按rank顺序写入，输出逐字节一致
+        """
+        if not self.gpus:
+            f.write(format_start_tag("algo", self.xml_attrs(), 0, empty=True))
+            return
         
+        f.write(format_start_tag("algo", self.xml_attrs(), 0))
+        if workers > 1 and len(self.gpus) > 1:
+            from .parallel import write_gpus_parallel
+            write_gpus_parallel(f, self.gpus, workers)
+        else:
+            for gpu in self.gpus:
+                gpu.write_xml(f, 1)
+        f.write(format_end_tag("algo", 0))
+    
+    def save_xml(self, filename: str, workers: int = 1) -> None:
         with open(filename, 'w') as f:
-            f.write(pretty_string)
\ No newline at end of file
+            self.write_xml(f, workers)
+
+    def simulate(self, model=None, **params):
+        """
+        用离散事件模拟估计构建后算法的执行时间（见simulator.py）
+        model: CostModel，为None时用params（如chunk_bytes、gpus_per_node、inter_bw）创建
+        返回SimulationResult：time为整个集合通信的完成时间，gpu_times为各GPU的完成时间（us）
+        """
+        from .simulator import CostModel, simulate
+        if model is None:
+            model = CostModel(**params)
+        elif params:
+            raise ValueError("Pass either a CostModel or its parameters, not both")
+        return simulate(self, model)
+
+    def check_deadlock(self, slots: Optional[int] = 8, max_cycles: int = 10):
+        """
+        静态检查构建后的算法是否会死锁（见deadlock.py），不需要运行
+        等待图包含TB内的程序顺序、depid/deps，以及按(channel, peer, index)配对的send/recv；
+        slots为每个连接可缓存的消息数，None表示不限制
+        返回DeadlockReport：ok、cycles（最短等待环）、unmatched（找不到对端的send/recv）、summary()
+        """
+        from .deadlock import check_deadlock
+        return check_deadlock(self, slots, max_cycles)
+
+    def critical_path(self, weight=None):
+        """
+        求构建后算法的关键路径和各TB的松弛（见critical_path.py），时间与step数成线性
+        DAG包含TB内的程序顺序、depid/deps和send→recv边
+        weight: None表示step权重为cnt（nop为0）；CostModel表示与simulate相同的耗时；
+                或函数weight(type, cnt) -> float
+        返回CriticalPathResult：length、path、segments、tb_slack、critical_tbs、channel_weights、summary()
+        """
+        from .critical_path import critical_path
+        return critical_path(self, weight)
+
+    def pack_tbs(self, max_tbs: Optional[int] = None, slots: Optional[int] = 8):
+        """
+        依赖构建之后合并各GPU上兼容的TB以减少TB数（见packing.py）
+        同一channel上的只发送TB与只接收TB合并，只有cpy的TB并入负载最小的TB；
+        合并后的step顺序与全局等待图的拓扑序一致，不会引入死锁（连接缓冲为slots时）
+        max_tbs: 每个GPU的目标TB数，达到即停止；None表示尽量合并
+        返回PackingReport：before/after（各GPU的TB数）、removed_nops、dropped_deps、summary()
+        """
+        from .packing import pack_tbs
+        return pack_tbs(self, max_tbs, slots)
+
+    def fuse_rcs(self, model=None):
+        """
+        依赖构建之后把同一TB中不相邻的可转发recv→send对融合为rcs（见fusion.py）
+        rcs放在recv与send之间，仅在各连接的顺序不变、send只依赖该recv且不引入死锁时融合；
+        与pack_tbs配合时先合并TB，再融合合并后交错排列的recv/send
+        model: CostModel，用于模拟融合前后的完成时间，其slots同时用于无死锁检查；None时为CostModel(overlap_forwarding=True)
+        返回FusionReport：fused、chunks、steps_before/after、time_before/after、summary()
+        """
+        from .fusion import fuse_rcs
+        return fuse_rcs(self, model)
+
+    def coalesce_transfers(self, max_cnt: Optional[int] = None):
+        """
+        依赖构建之后把各连接上src/dst连续的相邻send/recv合并为cnt更大的一对step（见coalesce.py）
+        发送和接收两侧同时合并，依赖被合并step的step改为依赖合并后的step
+        max_cnt: 合并后cnt的上限，None表示不限制
+        返回CoalescingReport：transfers、removed_steps、max_cnt、summary()
+        """
+        from .coalesce import coalesce_transfers
+        return coalesce_transfers(self, max_cnt)
+
+    @classmethod
+    def from_xml(cls, source, storage: str = "object", keep_nops: bool = True) -> 'Algo':
+        """
+        流式读取MSCCL XML文件（本工具或MSCCLang生成），重建GPU/TB/Step，见xml_reader.py
+        source: 文件路径或二进制文件对象，逐元素解析，不保留整个DOM
+        storage: "object"/"columnar"，超大文件建议使用列存
+        keep_nops: True时保留XML中的nop和depid/deps，save_xml输出与原文件一致；
+                   False时把nop链合并回各step的dep_list，得到依赖构建之前的形式，
+                   可修改后重新调用build_all_dependencies
+        dep_list由depid/deps和nop链重建，send/recv按连接和index重新配对peer
+        """
+        from .xml_reader import read_xml
+        return read_xml(source, storage, keep_nops)
+
+    def save_snapshot(self, filename: str) -> None:
+        """
+        将算法（通常是依赖构建之后）保存为二进制快照，格式见snapshot.py
+        之后可用Algo.load_snapshot直接恢复，无需重新运行生成脚本
+        尚未分配channel的ChannelGroup操作先由assign_channels分配
+        """
+        if self._channel_transfers:
+            self.assign_channels()
+        from .snapshot import save_snapshot
+        save_snapshot(self, filename)
+
+    @classmethod
+    def load_snapshot(cls, filename: str, storage: Optional[str] = None, mmap: bool = False) -> 'Algo':
+        """
+        从save_snapshot生成的快照恢复算法，依赖和peer关系与保存时相同
+        storage: "object"/"columnar"，为None时与保存时相同
+        mmap: 只读映射快照文件（要求storage="columnar"），不逐行读取列数据，加载时间和内存与TB数成正比
+        """
+        from .snapshot import load_snapshot
+        return load_snapshot(filename, storage, mmap)
@@ -0,0 +1,275 @@
+"""
+按负载自动分配channel
+
+copy/copy_diff的channel_id可以传入ChannelGroup（一组可互换的channel）代替固定的channel。
+这类操作先只创建step并记录下来（step尚未加入TB，s/send_index等为None），由
+Algo.assign_channels（build_all_dependencies时自动调用）统一选择具体的channel：
+
+- 负载为每个(GPU, channel)上收发的chunk数；copy_diff同时计入发送方和接收方，copy计入本GPU
+- 按cnt从大到小依次放到使(发送方, 接收方)在该channel上的负载最大值最小的channel（LPT贪心）；
+  相同时选择落入的TB负载较小的channel，避免同一对GPU的数据集中在一个TB中串行执行
+- 遵守GPU.check_channel_conflict的规则：同一channel上到/来自同一peer只能有一个发送/接收TB；
+  同一对GPU之间的ChannelGroup操作必须使用相同的bidirectional；有依赖关系的两个step不能落入同一个TB
+- 所有操作选定channel后按记录顺序加入TB、添加依赖，TB内的顺序与直接指定channel时相同
+
+ChannelGroup中的channel只能由ChannelGroup操作使用，不能同时作为固定的channel_id。
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .step import Step
+from .tb import TB
+
+
+class ChannelGroup:
+    """一组可互换的channel，作为copy/copy_diff的channel_id传入"""
+
+    def __init__(self, channels: Iterable[int]):
+        self.channels: Tuple[int, ...] = tuple(dict.fromkeys(channels))
+        if not self.channels:
+            raise ValueError("ChannelGroup needs at least one channel")
+        for chan in self.channels:
+            if not isinstance(chan, int) or chan < 0:
+                raise ValueError(f"Invalid channel {chan!r} in ChannelGroup")
+
+    def __repr__(self) -> str:
+        return f"ChannelGroup({list(self.channels)})"
+
+
+class _Transfer:
+    """一个等待分配channel的操作：copy_diff（send_step + recv_step）或copy（只有send_step，为cpy）"""
+    __slots__ = ("group", "src", "dst", "cnt", "send_step", "recv_step", "dep_steps", "bidirectional", "chan")
+
+    def __init__(self, group: ChannelGroup, src: int, dst: int, cnt: int, send_step: Step,
+                 recv_step: Optional[Step], dep_steps: List[Step], bidirectional: bool):
+        self.group = group
+        self.src = src
+        self.dst = dst  # copy时为-1
+        self.cnt = cnt
+        self.send_step = send_step
+        self.recv_step = recv_step
+        self.dep_steps = list(dep_steps)
+        self.bidirectional = bidirectional
+        self.chan = -1
+
+    @property
+    def gpus(self) -> Tuple[int, ...]:
+        return (self.src,) if self.dst < 0 else (self.src, self.dst)
+
+
+class ChannelBalanceReport:
+    """channel分配结果，负载单位为chunk"""
+
+    def __init__(self, ntransfers: int, before: Dict[Tuple[int, int], int], after: Dict[Tuple[int, int], int]):
+        self.ntransfers = ntransfers
+        # (gpu, chan) -> 负载；before为按记录顺序对每对(src, dst)轮流使用组内channel的结果
+        # （即手写channel_map[src][dst] % nchannels的分配方式），after为实际分配的结果
+        self.before = before
+        self.after = after
+
+    @property
+    def max_before(self) -> int:
+        return max(self.before.values(), default=0)
+
+    @property
+    def max_after(self) -> int:
+        return max(self.after.values(), default=0)
+
+    @staticmethod
+    def _by_channel(loads: Dict[Tuple[int, int], int]) -> Dict[int, int]:
+        """每个channel上负载最大的GPU的负载"""
+        result: Dict[int, int] = {}
+        for (_, chan), load in loads.items():
+            result[chan] = max(result.get(chan, 0), load)
+        return result
+
+    def summary(self) -> str:
+        lines = [f"{self.ntransfers} transfers: max per-channel load {self.max_before} -> {self.max_after} chunks "
+                 f"(round-robin -> balanced)"]
+        before, after = self._by_channel(self.before), self._by_channel(self.after)
+        for chan in sorted(set(before) | set(after)):
+            lines.append(f"chan {chan}: busiest GPU {before.get(chan, 0)} -> {after.get(chan, 0)} chunks")
+        return "\n".join(lines)
+
+
+def _check_deferrable(algo) -> None:
+    """延迟分配的step在assign_channels时才加入TB，只支持对象存储且GPU常驻的Algo"""
+    from .template import RankTemplate
+    if isinstance(algo.gpus, RankTemplate):
+        raise ValueError("ChannelGroup is not supported after set_rank_template")
+    if algo.storage != "object":
+        raise ValueError("ChannelGroup requires storage='object'")
+
+
+def defer_copy_diff(algo, src_chunk, dest_chunk, group: ChannelGroup, dep_steps: List[Step],
+                    bidirectional: bool) -> Tuple[Step, Step]:
+    """记录跨GPU拷贝，返回尚未加入TB的(send_step, recv_step)，buffer字段与copy_diff同步后相同"""
+    _check_deferrable(algo)
+    srcbuf, dstbuf = src_chunk._get_buf_name(), dest_chunk._get_buf_name()
+    send_step = Step(type="s", srcbuf=srcbuf, srcoff=src_chunk._offset(),
+                     dstbuf=dstbuf, dstoff=dest_chunk._offset(), cnt=src_chunk._count())
+    recv_step = Step(type="r", srcbuf=srcbuf, srcoff=src_chunk._offset(),
+                     dstbuf=dstbuf, dstoff=dest_chunk._offset(), cnt=src_chunk._count())
+    send_step.peer_step = recv_step
+    recv_step.peer_step = send_step
+    algo._channel_transfers.append(_Transfer(group, src_chunk.gpu_id, dest_chunk.gpu_id, src_chunk._count(),
+                                             send_step, recv_step, dep_steps, bidirectional))
+    return send_step, recv_step
+
+
+def defer_copy(algo, src_chunk, dest_chunk, group: ChannelGroup, dep_steps: List[Step]) -> Step:
+    """记录本GPU内拷贝，返回尚未加入TB的cpy step"""
+    _check_deferrable(algo)
+    step = Step(type="cpy", srcbuf=src_chunk._get_buf_name(), srcoff=src_chunk._offset(),
+                dstbuf=dest_chunk._get_buf_name(), dstoff=dest_chunk._offset(), cnt=src_chunk._count())
+    algo._channel_transfers.append(_Transfer(group, src_chunk.gpu_id, -1, src_chunk._count(),
+                                             step, None, dep_steps, False))
+    return step
+
+
+class _TBPlan:
+    """模拟get_send_tb/get_recv_tb的TB查找与创建，TB以(gpu, send, recv, chan)标识"""
+
+    def __init__(self, algo):
+        self.algo = algo
+        self.send_tbs: Dict[Tuple[int, int, int], Optional[Tuple[int, int, int, int]]] = {}
+        self.recv_tbs: Dict[Tuple[int, int, int], Optional[Tuple[int, int, int, int]]] = {}
+
+    def _find(self, tbs: Dict, gpu: int, peer: int, chan: int, sending: bool) -> Optional[Tuple[int, int, int, int]]:
+        key = (gpu, peer, chan)
+        if key not in tbs:
+            found = (self.algo.gpus[gpu].find_tb(send=peer, chan=chan) if sending
+                     else self.algo.gpus[gpu].find_tb(recv=peer, chan=chan))
+            tbs[key] = None if found is None else (gpu, found.send, found.recv, chan)
+        return tbs[key]
+
+    def send_tb(self, gpu: int, peer: int, chan: int, bidirectional: bool) -> Optional[Tuple[int, int, int, int]]:
+        """发送到peer的TB，需要创建但会与已有TB冲突时返回None"""
+        tb = self._find(self.send_tbs, gpu, peer, chan, True)
+        if tb is not None:
+            return tb
+        if not bidirectional:
+            return (gpu, peer, -1, chan)
+        if self._find(self.recv_tbs, gpu, peer, chan, False) is not None:
+            return None
+        return (gpu, peer, peer, chan)
+
+    def recv_tb(self, gpu: int, peer: int, chan: int, bidirectional: bool) -> Optional[Tuple[int, int, int, int]]:
+        tb = self._find(self.recv_tbs, gpu, peer, chan, False)
+        if tb is not None:
+            return tb
+        if not bidirectional:
+            return (gpu, -1, peer, chan)
+        if self._find(self.send_tbs, gpu, peer, chan, True) is not None:
+            return None
+        return (gpu, peer, peer, chan)
+
+    def place(self, tb: Tuple[int, int, int, int]) -> None:
+        gpu, send, recv, chan = tb
+        if send >= 0 and self.send_tbs.get((gpu, send, chan)) is None:
+            self.send_tbs[(gpu, send, chan)] = tb
+        if recv >= 0 and self.recv_tbs.get((gpu, recv, chan)) is None:
+            self.recv_tbs[(gpu, recv, chan)] = tb
+
+
+def _attach(algo, transfer: _Transfer) -> None:
+    """把transfer的step按选定的channel加入TB并添加依赖"""
+    chan = transfer.chan
+    src = algo.gpus[transfer.src]
+    if transfer.recv_step is None:
+        tb = src.find_tb(send=-1, recv=-1, chan=chan)
+        if tb is None:
+            tb = TB(send=-1, recv=-1, chan=chan)
+            src.add_tb(tb)
+    else:
+        tb = src.get_send_tb(transfer.dst, chan, transfer.bidirectional)
+    tb.add_step(transfer.send_step)
+    for dep_step in transfer.dep_steps:
+        transfer.send_step.add_dep(dep_step)
+    if transfer.recv_step is not None:
+        recv_tb = algo.gpus[transfer.dst].get_recv_tb(transfer.src, chan, transfer.bidirectional)
+        recv_tb.add_step(transfer.recv_step)
+        if transfer.send_step.send_index != transfer.recv_step.recv_index:
+            raise ValueError(f"Index mismatch: send_index={transfer.send_step.send_index}, "
+                             f"recv_index={transfer.recv_step.recv_index}")
+
+
+def assign_channels(algo) -> ChannelBalanceReport:
+    """为所有记录的ChannelGroup操作分配channel，返回分配前后的负载"""
+    transfers: List[_Transfer] = algo._channel_transfers
+    algo._channel_transfers = []
+
+    # 组内channel不能已被固定channel的操作使用
+    for chan in sorted({chan for transfer in transfers for chan in transfer.group.channels}):
+        if chan not in algo._group_channels and any(gpu.find_tb(chan=chan) for gpu in algo.gpus):
+            raise ValueError(f"Channel {chan} belongs to a ChannelGroup but is also used with a fixed channel_id")
+
+    # 同一对GPU之间的操作使用相同的bidirectional，TB的形式与创建顺序无关，可以先规划再按记录顺序创建
+    modes: Dict[Tuple[int, int], bool] = {}
+    for transfer in transfers:
+        if transfer.recv_step is not None:
+            pair = (min(transfer.src, transfer.dst), max(transfer.src, transfer.dst))
+            if modes.setdefault(pair, transfer.bidirectional) != transfer.bidirectional:
+                raise ValueError(f"ChannelGroup transfers between GPU {pair[0]} and GPU {pair[1]} "
+                                 f"mix bidirectional and unidirectional TBs")
+
+    # 基准：每对(src, dst)按记录顺序轮流使用组内的channel
+    before: Dict[Tuple[int, int], int] = {}
+    turns: Dict[Tuple[int, int, int], int] = {}
+    for transfer in transfers:
+        key = (id(transfer.group), transfer.src, transfer.dst)
+        turn = turns.get(key, 0)
+        turns[key] = turn + 1
+        chan = transfer.group.channels[turn % len(transfer.group.channels)]
+        for gpu in transfer.gpus:
+            before[(gpu, chan)] = before.get((gpu, chan), 0) + transfer.cnt
+
+    # 依赖关系：有依赖的两个step不能落入同一个TB
+    owner: Dict[Step, _Transfer] = {}
+    for transfer in transfers:
+        owner[transfer.send_step] = transfer
+        if transfer.recv_step is not None:
+            owner[transfer.recv_step] = transfer
+    related: Dict[Step, List[Step]] = {}
+    for transfer in transfers:
+        for dep_step in transfer.dep_steps:
+            if dep_step in owner:
+                related.setdefault(transfer.send_step, []).append(dep_step)
+                related.setdefault(dep_step, []).append(transfer.send_step)
+
+    plan = _TBPlan(algo)
+    placed: Dict[Step, Tuple[int, int, int, int]] = {}
+    after: Dict[Tuple[int, int], int] = {}
+    tb_loads: Dict[Tuple[int, int, int, int], int] = {}
+    for transfer in sorted(transfers, key=lambda transfer: -transfer.cnt):
+        best, best_cost, best_tbs = -1, None, None
+        for chan in transfer.group.channels:
+            if transfer.recv_step is None:
+                tbs = [(transfer.send_step, (transfer.src, -1, -1, chan))]
+            else:
+                tbs = [(transfer.send_step, plan.send_tb(transfer.src, transfer.dst, chan, transfer.bidirectional)),
+                       (transfer.recv_step, plan.recv_tb(transfer.dst, transfer.src, chan, transfer.bidirectional))]
+            if any(tb is None for _, tb in tbs):
+                continue
+            if any(placed.get(other) == tb for step, tb in tbs for other in related.get(step, ())):
+                continue
+            loads = [after.get((gpu, chan), 0) for gpu in transfer.gpus]
+            tb_load = max(tb_loads.get(tb, 0) for _, tb in tbs) + transfer.cnt
+            cost = (max(loads) + transfer.cnt, tb_load, sum(loads))
+            if best_cost is None or cost < best_cost:
+                best, best_cost, best_tbs = chan, cost, tbs
+        if best < 0:
+            raise ValueError(f"No channel in {transfer.group} can carry the transfer from GPU {transfer.src}"
+                             + (f" to GPU {transfer.dst}" if transfer.dst >= 0 else "")
+                             + " without a TB conflict or a dependency inside one TB")
+        transfer.chan = best
+        for step, tb in best_tbs:
+            plan.place(tb)
+            placed[step] = tb
+            tb_loads[tb] = tb_loads.get(tb, 0) + transfer.cnt
+        for gpu in transfer.gpus:
+            after[(gpu, best)] = after.get((gpu, best), 0) + transfer.cnt
+
+    for transfer in transfers:
+        _attach(algo, transfer)
+    algo._group_channels.update(chan for transfer in transfers for chan in transfer.group.channels)
+    return ChannelBalanceReport(len(transfers), before, after)
@@ -1,6 +1,38 @@
 from typing import List, Tuple
 from .step import Step
 from .tb import TB
+from .channels import ChannelGroup, defer_copy, defer_copy_diff
+
+def buf_name(chunk_type: str) -> str:
+    """chunk类型到XML buffer名称的映射（"input"/"output"/"scratch" -> "i"/"o"/"s"）"""
+    type_map = {"input": "i", "output": "o", "scratch": "s"}
+    return type_map.get(chunk_type, chunk_type)
+
+
+def append_step(algo, gpu, tb: TB, dep_steps: List[Step], **fields) -> Step:
+    """
+    创建step、添加依赖并加入TB
+    列存模式下作为一行追加到GPU的StepTable，返回行句柄StepRef
+    """
+    if gpu.table is not None:
+        return gpu.table.append_step(algo, gpu, tb, dep_steps, **fields)
+    
+    step = Step(**fields)
+    
+    # 添加依赖到dep_list
+    for dep_step in dep_steps:
+        step.add_dep(dep_step)
+    
+    tb.add_step(step)
+    return step
+
+
+def _check_fixed_channel(channel_id) -> None:
+    """单独的send/recv/rcs无法确定对端，不能使用ChannelGroup"""
+    if isinstance(channel_id, ChannelGroup):
+        raise ValueError("ChannelGroup is only supported by copy and copy_diff; "
+                         "send/recv/rcs need a fixed channel_id")
+
 
 class Chunk:
     def __init__(self, gpu_id: int, chunk_type: str, index: int, size: int, algo):
@@ -11,8 +43,14 @@ class Chunk:
         self.algo = algo
     
     def _get_buf_name(self) -> str:
-        type_map = {"input": "i", "output": "o", "scratch": "s"}
-        return type_map.get(self.chunk_type, self.chunk_type)
+        return buf_name(self.chunk_type)
+    
+    def _offset(self) -> int:
+        """index换算为XML中的chunk单位（流水线切分细分了chunk时Algo.chunk_scale > 1）"""
+        return self.index * self.algo.chunk_scale
+    
+    def _count(self) -> int:
+        return self.size * self.algo.chunk_scale
     
     def copy(self, dest_chunk: 'Chunk', channel_id: int, tb: 'TB' = None, dep_steps: List[Step] = None) -> Step:
         if dep_steps is None:
@@ -24,6 +62,9 @@ class Chunk:
         if self.size != dest_chunk.size:
             raise ValueError("Copy operation requires chunks of the same size")
         
+        if tb is None and isinstance(channel_id, ChannelGroup):
+            return defer_copy(self.algo, self, dest_chunk, channel_id, dep_steps)
+        
         gpu = self.algo.get_gpu(self.gpu_id)
         
         # Find or create TB with send=-1, recv=-1, channel=channel_id
@@ -35,19 +76,18 @@ class Chunk:
             gpu.add_tb(tb)
         
         # Create copy step
-        step = Step(type="cpy", srcbuf=self._get_buf_name(), srcoff=self.index,
-                   dstbuf=dest_chunk._get_buf_name(), dstoff=dest_chunk.index,
-                   cnt=self.size, depid=-1, deps=-1, hasdep=0)
-        
-        # 添加依赖到dep_list
-        for dep_step in dep_steps:
-            step.add_dep(dep_step)
-        
-        tb.add_step(step)
-        return step
+        return append_step(self.algo, gpu, tb, dep_steps,
+                           type="cpy", srcbuf=self._get_buf_name(), srcoff=self._offset(),
+                           dstbuf=dest_chunk._get_buf_name(), dstoff=dest_chunk._offset(),
+                           cnt=self._count(), depid=-1, deps=-1, hasdep=0)
     
-    def copy_diff(self, dest_chunk: 'Chunk', channel_id: int, dep_steps: List[Step] = None, bidirectional: bool = True) -> Tuple[Step, Step]:
-        """跨rank copy操作，拆解为send+recv"""
+    def copy_diff(self, dest_chunk: 'Chunk', channel_id: int, dep_steps: List[Step] = None, bidirectional: bool = True,
+                  pipeline: int = 1) -> Tuple[Step, Step]:
+        """
+        跨rank copy操作，拆解为send+recv
+        pipeline > 1时切分为pipeline个子chunk依次传输，下游同样流水线转发时按子chunk依赖，
+        返回最后一个子send/recv（见pipeline.py）
+        """
         if dep_steps is None:
             dep_steps = []
             
@@ -55,6 +95,16 @@ class Chunk:
             raise ValueError("copy_diff requires chunks on different GPUs")
         if self.size != dest_chunk.size:
             raise ValueError("copy_diff requires chunks of the same size")
+        if pipeline < 1:
+            raise ValueError(f"pipeline must be at least 1, got {pipeline}")
+        
+        if pipeline > 1:
+            from .pipeline import pipeline_copy_diff
+            return pipeline_copy_diff(self.algo, self, dest_chunk, channel_id, dep_steps, bidirectional, pipeline)
+        
+        # channel由Algo.assign_channels按负载分配
+        if isinstance(channel_id, ChannelGroup):
+            return defer_copy_diff(self.algo, self, dest_chunk, channel_id, dep_steps, bidirectional)
         
         # 创建send step
         send_step = self.send(dest_chunk.gpu_id, channel_id, dep_steps, bidirectional=bidirectional)
@@ -66,11 +116,18 @@ class Chunk:
         send_step.peer_step = recv_step
         recv_step.peer_step = send_step
 
+        # 同步buffer信息，并更新所在TB的buffer深度统计
+        send_step._tb.untrack_step_extents(send_step)
+        recv_step._tb.untrack_step_extents(recv_step)
+
         send_step.dstbuf = recv_step.dstbuf
         send_step.dstoff = recv_step.dstoff
 
         recv_step.srcbuf = send_step.srcbuf
         recv_step.srcoff = send_step.srcoff
+
+        send_step._tb.track_step_extents(send_step)
+        recv_step._tb.track_step_extents(recv_step)
         
         # 检查index一致性
         if send_step.send_index != recv_step.recv_index:
@@ -83,61 +140,33 @@ class Chunk:
         if dep_steps is None:
             dep_steps = []
             
+        _check_fixed_channel(channel_id)
         gpu = self.algo.get_gpu(self.gpu_id)
         
         # Find or create appropriate TB
-        tb = gpu.find_tb(send=dest_rank, chan=channel_id)
-        if tb is None:
-            if bidirectional:
-                # Check if recv exists for the same channel
-                if gpu.find_tb(recv=dest_rank, chan=channel_id):
-                    raise ValueError(f"Channel {channel_id} already has recv from rank {dest_rank}")
-                tb = TB(send=dest_rank, recv=dest_rank, chan=channel_id)
-            else:
-                tb = TB(send=dest_rank, recv=-1, chan=channel_id)
-            gpu.add_tb(tb)
+        tb = gpu.get_send_tb(dest_rank, channel_id, bidirectional)
         
         # Create send step
-        step = Step(type="s", srcbuf=self._get_buf_name(), srcoff=self.index,
-                   dstbuf="o", dstoff=-1, cnt=self.size, depid=-1, deps=-1, hasdep=0)
-        
-        # 添加依赖到dep_list
-        for dep_step in dep_steps:
-            step.add_dep(dep_step)
-        
-        tb.add_step(step)
-        return step
+        return append_step(self.algo, gpu, tb, dep_steps,
+                           type="s", srcbuf=self._get_buf_name(), srcoff=self._offset(),
+                           dstbuf="o", dstoff=-1, cnt=self._count(), depid=-1, deps=-1, hasdep=0)
     
     def recv(self, src_rank: int, channel_id: int, dep_steps: List[Step] = None, 
              bidirectional: bool = True) -> Step:
         if dep_steps is None:
             dep_steps = []
             
+        _check_fixed_channel(channel_id)
         gpu = self.algo.get_gpu(self.gpu_id)
         
         # Find or create appropriate TB
-        tb = gpu.find_tb(recv=src_rank, chan=channel_id)
-        if tb is None:
-            if bidirectional:
-                # Check if send exists for the same channel
-                if gpu.find_tb(send=src_rank, chan=channel_id):
-                    raise ValueError(f"Channel {channel_id} already has send to rank {src_rank}")
-                tb = TB(send=src_rank, recv=src_rank, chan=channel_id)
-            else:
-                tb = TB(send=-1, recv=src_rank, chan=channel_id)
-            gpu.add_tb(tb)
+        tb = gpu.get_recv_tb(src_rank, channel_id, bidirectional)
         
         # Create recv step
-        step = Step(type="r", srcbuf="i", srcoff=-1,
-                   dstbuf=self._get_buf_name(), dstoff=self.index,
-                   cnt=self.size, depid=-1, deps=-1, hasdep=0)
-        
-        # 添加依赖到dep_list
-        for dep_step in dep_steps:
-            step.add_dep(dep_step)
-        
-        tb.add_step(step)
-        return step
+        return append_step(self.algo, gpu, tb, dep_steps,
+                           type="r", srcbuf="i", srcoff=-1,
+                           dstbuf=self._get_buf_name(), dstoff=self._offset(),
+                           cnt=self._count(), depid=-1, deps=-1, hasdep=0)
     
     def rcs(self, dest_chunk: 'Chunk', intermediate_rank: int, channel_id: int, 
             dep_steps: List[Step] = None) -> Step:
@@ -145,6 +174,7 @@ class Chunk:
             dep_steps = []
             
         # Check constraints
+        _check_fixed_channel(channel_id)
         ranks = {self.gpu_id, dest_chunk.gpu_id, intermediate_rank}
         if len(ranks) != 3:
             raise ValueError("RCS operation requires three different GPU ranks")
@@ -166,13 +196,7 @@ class Chunk:
             gpu.add_tb(tb)
         
         # Create RCS step
-        step = Step(type="rcs", srcbuf=self._get_buf_name(), srcoff=self.index,
-                   dstbuf=dest_chunk._get_buf_name(), dstoff=dest_chunk.index,
-                   cnt=self.size, depid=-1, deps=-1, hasdep=0)
-        
-        # 添加依赖到dep_list
-        for dep_step in dep_steps:
-            step.add_dep(dep_step)
-        
-        tb.add_step(step)
-        return step
\ No newline at end of file
+        return append_step(self.algo, gpu, tb, dep_steps,
+                           type="rcs", srcbuf=self._get_buf_name(), srcoff=self._offset(),
+                           dstbuf=dest_chunk._get_buf_name(), dstoff=dest_chunk._offset(),
+                           cnt=self._count(), depid=-1, deps=-1, hasdep=0)
\ No newline at end of file
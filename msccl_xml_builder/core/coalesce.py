@@ -0,0 +1,173 @@
+"""
+连续传输合并（coalescing）
+
+生成脚本常按chunk逐个发送（如alltoallv中cnt=1的循环），同一连接上产生一串srcoff/dstoff连续的
+send/recv，而运行时每个step都有固定开销。coalesce_transfers在依赖构建之后把它们合并为cnt更大的
+一个send/recv：
+
+- 发送TB中相邻的send a、b与接收TB中相邻的对应recv ra、rb（同一连接，顺序一致），发送方的
+  src和接收方的dst都连续，合并后的cnt不超过max_cnt
+- 合并后的step位于a/ra处，b/rb（及更多后续step）不能有其他TB的依赖（depid为空或指向本TB），
+  否则需要提前满足这些依赖；之前的nop会打断相邻关系，因此也不会被越过
+- 除最后一对外，被合并的send/recv不能被其他step依赖，否则依赖者要等待整个合并后的传输；
+  依赖最后一对的step改为依赖合并后的step（完成时间与原来相同或更早）
+- 连接上的send_index/recv_index重新编号
+
+合并节省每个step的alpha，但接收方的本地处理不再与后续chunk的传输重叠，chunk较大（带宽受限）
+时用max_cnt限制合并的大小。
+"""
+from typing import Dict, List, Optional, Set
+
+from .program import check_built_steps
+from .step import Step
+from .tb import RECV_STEP_TYPES, SEND_STEP_TYPES
+
+
+class CoalescingReport:
+    """连续传输合并结果"""
+
+    def __init__(self, transfers: int, removed_steps: int, max_cnt: int):
+        # 合并得到的send/recv对数
+        self.transfers = transfers
+        # 删除的step数（发送和接收两侧之和）
+        self.removed_steps = removed_steps
+        # 合并后最大的cnt
+        self.max_cnt = max_cnt
+
+    def summary(self) -> str:
+        return (f"coalesced into {self.transfers} transfers, removed {self.removed_steps} steps, "
+                f"largest cnt {self.max_cnt}")
+
+
+def _independent(step: Step) -> bool:
+    """step没有其他TB的依赖"""
+    return step.depid < 0 or step.depid == step._tb.id
+
+
+def _contiguous(prev: Step, step: Step, buf: str, off: str) -> bool:
+    return getattr(step, buf) == getattr(prev, buf) and getattr(step, off) == getattr(prev, off) + prev.cnt
+
+
+def _find_runs(tb, max_cnt: Optional[int], referenced: Set[Step]) -> List[List[Step]]:
+    """TB中可以合并的send序列（每个至少两个step）"""
+    runs = []
+    run: List[Step] = []
+    total = 0
+    for step in tb.steps:
+        peer = step.peer_step
+        if run:
+            last = run[-1]
+            last_peer = last.peer_step
+            if (last not in referenced and last_peer not in referenced
+                    and step.type == "s" and _independent(step) and peer is not None and peer.type == "r"
+                    and _independent(peer) and peer._tb is last_peer._tb and peer.s == last_peer.s + 1
+                    and _contiguous(last, step, "srcbuf", "srcoff")
+                    and _contiguous(last_peer, peer, "dstbuf", "dstoff")
+                    and (max_cnt is None or total + step.cnt <= max_cnt)):
+                run.append(step)
+                total += step.cnt
+                continue
+            if len(run) > 1:
+                runs.append(run)
+            run = []
+        if step.type == "s" and peer is not None and peer.type == "r":
+            run = [step]
+            total = step.cnt
+    if len(run) > 1:
+        runs.append(run)
+    return runs
+
+
+def _absorb(head: Step, step: Step) -> None:
+    """把step的被依赖关系转移到head"""
+    for dep_step in list(step.dep_list):
+        dep_step.depended_by_list.discard(step)
+    for dependent in list(step.depended_by_list):
+        dependent.dep_list.discard(step)
+        if dependent is not head:
+            dependent.dep_list.append(head)
+            head.depended_by_list.append(dependent)
+
+
+def _renumber(tb) -> None:
+    """重新编号TB的step位置和连接上的send_index/recv_index"""
+    nsend = nrecv = 0
+    for s, step in enumerate(tb.steps):
+        step.s = s
+        if step.type in SEND_STEP_TYPES:
+            step.send_index = nsend
+            nsend += 1
+        if step.type in RECV_STEP_TYPES:
+            step.recv_index = nrecv
+            nrecv += 1
+    tb.send_index, tb.recv_index = nsend, nrecv
+
+
+def coalesce_transfers(algo, max_cnt: Optional[int] = None) -> CoalescingReport:
+    """合并各连接上src/dst连续的相邻send/recv，max_cnt为合并后cnt的上限（None不限制）"""
+    check_built_steps(algo, "coalesce_transfers")
+    if max_cnt is not None and max_cnt < 1:
+        raise ValueError(f"max_cnt must be at least 1, got {max_cnt}")
+    for gpu in algo.gpus:
+        for tb in gpu.tbs:
+            for step in tb.steps:
+                if step.type in SEND_STEP_TYPES + RECV_STEP_TYPES and step.peer_step is None \
+                        and step.send_peer is None and step.recv_peer is None:
+                    raise RuntimeError(f"GPU {gpu.id} TB {tb.id} step {step.s} has no peer; "
+                                       f"coalesce_transfers needs paired send/recv steps")
+
+    # depid/deps解析为step对象，合并后按新位置重新写回
+    targets: List[Dict[Step, Step]] = []
+    for gpu in algo.gpus:
+        targets.append({step: gpu.tbs[step.depid].steps[step.deps]
+                        for tb in gpu.tbs for step in tb.steps if step.depid >= 0})
+    referenced = set(dep_step for target in targets for dep_step in target.values())
+
+    merged: Dict[Step, Step] = {}  # 被合并的step -> 合并后的step
+    transfers = largest = 0
+    for gpu in algo.gpus:
+        for tb in gpu.tbs:
+            if tb.send == -1:
+                continue
+            for run in _find_runs(tb, max_cnt, referenced):
+                head, recv_head = run[0], run[0].peer_step
+                total = sum(step.cnt for step in run)
+                for send_step in run[1:]:
+                    recv_step = send_step.peer_step
+                    merged[send_step] = head
+                    merged[recv_step] = recv_head
+                    _absorb(head, send_step)
+                    _absorb(recv_head, recv_step)
+                for step in (head, recv_head):
+                    step._tb.untrack_step_extents(step)
+                    step.cnt = total
+                    step._tb.track_step_extents(step)
+                transfers += 1
+                largest = max(largest, total)
+
+    if merged:
+        heads = set(merged.values())
+        for gpu, target in zip(algo.gpus, targets):
+            touched = [tb for tb in gpu.tbs if any(step in merged for step in tb.steps)]
+            if not touched:
+                continue
+            for tb in touched:
+                for step in tb.steps:
+                    if step in merged:
+                        tb.untrack_step_extents(step)
+                tb.steps = [step for step in tb.steps if step not in merged]
+                _renumber(tb)
+            referenced = set()
+            for tb in gpu.tbs:
+                for step in tb.steps:
+                    dep_step = target.get(step)
+                    if dep_step is None:
+                        continue
+                    dep_step = merged.get(dep_step, dep_step)
+                    step.depid, step.deps = dep_step._tb.id, dep_step.s
+                    referenced.add(dep_step)
+            for tb in touched:
+                for step in tb.steps:
+                    if step in heads:
+                        step.hasdep = 1 if step in referenced else 0
+    return CoalescingReport(transfers, len(merged), largest)
@@ -0,0 +1,429 @@
+"""
+列存（struct-of-arrays）step存储
+
+Algo(storage="columnar")时，每个GPU的step不再是一个个Step对象，而是保存在
+StepTable的类型化数组（array模块）中，每行一个step。Chunk操作向表中追加行并返回
+StepRef行句柄；build_all_dependencies逐个GPU地将表临时展开为Step对象，复用
+GPU.build_dependencies完成解析后再压缩回列；XML直接由列生成。
+"""
+from array import array
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+import xml.etree.ElementTree as ET
+
+from .gpu import GPU
+from .step import Step
+from .tb import TB
+from .xml_writer import INDENT, escape_attr, format_start_tag, format_end_tag
+
+# 每行的标量列及其数组类型；type/srcbuf/dstbuf保存为字符串驻留表中的编号
+# peer: 非rcs行为peer_step，rcs行为send_peer；recv_peer: 仅rcs行使用
+# peer引用编码为(gpu_id << 32) | row，-1表示无
+_COLUMNS = (("tb", "i"), ("s", "i"), ("type", "b"),
+            ("srcbuf", "b"), ("srcoff", "i"), ("dstbuf", "b"), ("dstoff", "i"), ("cnt", "i"),
+            ("depid", "i"), ("deps", "i"), ("hasdep", "b"),
+            ("send_index", "i"), ("recv_index", "i"),
+            ("peer", "q"), ("recv_peer", "q"), ("dep_head", "i"))
+# 依赖边按添加顺序保存；edge_next把同一行的依赖串成链表（头插），用于去重
+_EDGE_COLUMNS = (("edge_src", "i"), ("edge_dep", "i"), ("edge_next", "i"))
+
+_ROW_MASK = (1 << 32) - 1
+
+
+def encode_ref(gpu_id: int, row: int) -> int:
+    return (gpu_id << 32) | row
+
+
+def decode_ref(ref: int) -> Tuple[int, int]:
+    return ref >> 32, ref & _ROW_MASK
+
+
+class StepTable:
+    """单个GPU的step列存表"""
+
+    def __init__(self, gpu_id: int):
+        self.gpu_id = gpu_id
+        # type/buffer名称驻留表
+        self.names: List[str] = []
+        self._codes: Dict[str, int] = {}
+        for name, typecode in _COLUMNS + _EDGE_COLUMNS:
+            setattr(self, name, array(typecode))
+        # tb_len[tb_id] = 该TB的step数
+        self.tb_len = array("i")
+        # 依赖构建后行按(TB, s)排列，依赖已写入depid/deps，表不再接受新行
+        self.built = False
+
+    def __len__(self) -> int:
+        return len(self.tb)
+
+    def code(self, name: str) -> int:
+        """返回字符串在驻留表中的编号"""
+        code = self._codes.get(name)
+        if code is None:
+            code = len(self.names)
+            self.names.append(name)
+            self._codes[name] = code
+        return code
+
+    def append(self, tb_id: int, type: str, srcbuf: str, srcoff: int, dstbuf: str, dstoff: int, cnt: int,
+               depid: int = -1, deps: int = -1, hasdep: int = 0,
+               send_index: Optional[int] = None, recv_index: Optional[int] = None) -> int:
+        """在tb_id的末尾追加一行，返回行号"""
+        if self.built:
+            raise RuntimeError(f"GPU {self.gpu_id}: cannot add steps after dependencies are built")
+        while len(self.tb_len) <= tb_id:
+            self.tb_len.append(0)
+        row = len(self.tb)
+        self.tb.append(tb_id)
+        self.s.append(self.tb_len[tb_id])
+        self.tb_len[tb_id] += 1
+        self.type.append(self.code(type))
+        self.srcbuf.append(self.code(srcbuf))
+        self.srcoff.append(srcoff)
+        self.dstbuf.append(self.code(dstbuf))
+        self.dstoff.append(dstoff)
+        self.cnt.append(cnt)
+        self.depid.append(depid)
+        self.deps.append(deps)
+        self.hasdep.append(hasdep)
+        self.send_index.append(-1 if send_index is None else send_index)
+        self.recv_index.append(-1 if recv_index is None else recv_index)
+        self.peer.append(-1)
+        self.recv_peer.append(-1)
+        self.dep_head.append(-1)
+        return row
+
+    def append_step(self, algo, gpu: GPU, tb: TB, dep_steps: Iterable['StepRef'], type: str,
+                    srcbuf: str, srcoff: int, dstbuf: str, dstoff: int, cnt: int,
+                    depid: int = -1, deps: int = -1, hasdep: int = 0) -> 'StepRef':
+        """Chunk操作的列存实现：追加一行并添加依赖，返回行句柄"""
+        dep_steps = list(dep_steps)
+        for dep_step in dep_steps:
+            _check_ref(dep_step)
+            if dep_step.gpu is not gpu:
+                raise ValueError("Cross-GPU dependency is not allowed")
+        send_index, recv_index = tb.claim_indices(type)
+        row = self.append(tb.id, type, srcbuf, srcoff, dstbuf, dstoff, cnt, depid, deps, hasdep,
+                          send_index, recv_index)
+        for dep_step in dep_steps:
+            self.add_dep(row, dep_step.row)
+        step = StepRef(algo, gpu, row)
+        tb.track_step_extents(step)
+        return step
+
+    def add_dep(self, row: int, dep_row: int) -> None:
+        """为row添加对dep_row的依赖（已存在时忽略）"""
+        if self.built:
+            raise RuntimeError(f"GPU {self.gpu_id}: cannot add dependencies after they are built")
+        edge = self.dep_head[row]
+        while edge >= 0:
+            if self.edge_dep[edge] == dep_row:
+                return
+            edge = self.edge_next[edge]
+        self.link_dep(row, dep_row)
+        self.hasdep[dep_row] = 1
+
+    def link_dep(self, row: int, dep_row: int) -> None:
+        """只追加一条依赖边，不去重也不修改hasdep（由对象转换时使用）"""
+        self.edge_src.append(row)
+        self.edge_dep.append(dep_row)
+        self.edge_next.append(self.dep_head[row])
+        self.dep_head[row] = len(self.edge_src) - 1
+
+    def deps_of(self, row: int) -> List[int]:
+        """按添加顺序返回row依赖的行"""
+        deps = []
+        edge = self.dep_head[row]
+        while edge >= 0:
+            deps.append(self.edge_dep[edge])
+            edge = self.edge_next[edge]
+        deps.reverse()
+        return deps
+
+    def dependents_of(self, row: int) -> List[int]:
+        """按添加顺序返回依赖row的行（扫描全部依赖边）"""
+        return [src for src, dep_row in zip(self.edge_src, self.edge_dep) if dep_row == row]
+
+    def buffer_ends(self, row: int) -> List[Tuple[str, int]]:
+        """与Step.buffer_ends相同，返回[(buf, off+cnt)]"""
+        ends = []
+        cnt = self.cnt[row]
+        srcbuf, srcoff = self.names[self.srcbuf[row]], self.srcoff[row]
+        if srcbuf in ("i", "o", "s") and srcoff >= 0:
+            ends.append((srcbuf, srcoff + cnt))
+        dstbuf, dstoff = self.names[self.dstbuf[row]], self.dstoff[row]
+        if dstbuf in ("i", "o", "s") and dstoff >= 0:
+            ends.append((dstbuf, dstoff + cnt))
+        return ends
+
+    def rows_by_tb(self, ntbs: int) -> List[array]:
+        """按TB分组的行号（组内按s排列）"""
+        groups = [array("i") for _ in range(ntbs)]
+        for row, tb_id in enumerate(self.tb):
+            groups[tb_id].append(row)
+        return groups
+
+    def to_objects(self, headers: List[Tuple[int, int, int, int]]) -> Tuple[List[TB], List[Step]]:
+        """
+        将表展开为TB和Step对象，返回(TB列表, 按行号排列的step)
+        peer引用保持为编码后的整数，由from_objects原样写回
+        """
+        names = self.names
+        tbs = [TB(id=tb_id, send=send, recv=recv, chan=chan) for tb_id, send, recv, chan in headers]
+        steps = []
+        for row in range(len(self)):
+            step = Step(self.s[row], names[self.type[row]],
+                        names[self.srcbuf[row]], self.srcoff[row],
+                        names[self.dstbuf[row]], self.dstoff[row], self.cnt[row],
+                        self.depid[row], self.deps[row], self.hasdep[row])
+            step.send_index = self.send_index[row] if self.send_index[row] >= 0 else None
+            step.recv_index = self.recv_index[row] if self.recv_index[row] >= 0 else None
+            step.original_index = step.s
+            peer, recv_peer = self.peer[row], self.recv_peer[row]
+            if step.type == "rcs":
+                step.send_peer = peer if peer >= 0 else None
+                step.recv_peer = recv_peer if recv_peer >= 0 else None
+            elif peer >= 0:
+                step.peer_step = peer
+            steps.append(step)
+        for src, dep in zip(self.edge_src, self.edge_dep):
+            steps[src].dep_list.append(steps[dep])
+            steps[dep].depended_by_list.append(steps[src])
+        for tb, rows in zip(tbs, self.rows_by_tb(len(tbs))):
+            tb.steps = [steps[row] for row in rows]
+            for step in tb.steps:
+                step._tb = tb
+            tb.refresh_extents()
+        return tbs, steps
+
+    def from_objects(self, tbs: List[TB], steps: List[Step]) -> Tuple['StepTable', array]:
+        """
+        由依赖构建后的TB重新生成列存表（行按(TB, s)排列）
+        返回(新表, remap)，remap[旧行号] = 新行号；被合并进rcs的send/recv映射到rcs所在行
+        """
+        table = StepTable(self.gpu_id)
+        table.names = list(self.names)
+        table._codes = dict(self._codes)
+        new_rows: Dict[Step, int] = {}
+        merged: Dict[int, int] = {}  # 被合并step的peer引用 -> rcs的新行号
+        for tb in tbs:
+            for step in tb.steps:
+                row = table.append(tb.id, step.type, step.srcbuf, step.srcoff, step.dstbuf, step.dstoff,
+                                   step.cnt, step.depid, step.deps, step.hasdep,
+                                   step.send_index, step.recv_index)
+                if step.type == "rcs":
+                    table.peer[row] = -1 if step.send_peer is None else step.send_peer
+                    table.recv_peer[row] = -1 if step.recv_peer is None else step.recv_peer
+                    for ref in (step.send_peer, step.recv_peer):
+                        if ref is not None:
+                            merged[ref] = row
+                elif step.peer_step is not None:
+                    table.peer[row] = step.peer_step
+                new_rows[step] = row
+
+        remap = array("i", [-1]) * len(steps)
+        for old_row, step in enumerate(steps):
+            if step in new_rows:
+                remap[old_row] = new_rows[step]
+            elif step.peer_step is not None:
+                remap[old_row] = merged.get(step.peer_step, -1)
+        table.built = True
+        return table, remap
+
+    def remap_peers(self, remaps: List[array]) -> None:
+        """所有GPU重建后，按各GPU的remap更新跨GPU的peer引用"""
+        for column in (self.peer, self.recv_peer):
+            for row, ref in enumerate(column):
+                if ref >= 0:
+                    gpu_id, old_row = decode_ref(ref)
+                    new_row = remaps[gpu_id][old_row]
+                    column[row] = encode_ref(gpu_id, new_row) if new_row >= 0 else -1
+
+    def write_tb_xml(self, f: TextIO, tb: TB, rows: array, level: int = 2) -> None:
+        """将<tb>元素及其各行step写入文件句柄，输出与TB.write_xml逐字节一致"""
+        if not rows:
+            f.write(format_start_tag("tb", tb.xml_attrs(), level, empty=True))
+            return
+
+        f.write(format_start_tag("tb", tb.xml_attrs(), level))
+        prefix = "\n" + INDENT * (level + 1)
+        names = [escape_attr(name) for name in self.names]
+        s, type, srcbuf, srcoff = self.s, self.type, self.srcbuf, self.srcoff
+        dstbuf, dstoff, cnt = self.dstbuf, self.dstoff, self.cnt
+        depid, deps, hasdep = self.depid, self.deps, self.hasdep
+        for row in rows:
+            f.write(f'{prefix}<step s="{s[row]}" type="{names[type[row]]}" '
+                    f'srcbuf="{names[srcbuf[row]]}" srcoff="{srcoff[row]}" '
+                    f'dstbuf="{names[dstbuf[row]]}" dstoff="{dstoff[row]}" cnt="{cnt[row]}" '
+                    f'depid="{depid[row]}" deps="{deps[row]}" hasdep="{hasdep[row]}"/>')
+        f.write(format_end_tag("tb", level))
+
+    def tb_to_xml(self, tb: TB, rows: array) -> ET.Element:
+        tb_elem = ET.Element("tb")
+        for key, value in tb.xml_attrs():
+            tb_elem.set(key, value)
+        for row in rows:
+            tb_elem.append(StepRef.xml_element(self, row))
+        return tb_elem
+
+
+def _column_property(name: str, coded: bool = False, optional: bool = False) -> property:
+    """StepRef上映射到StepTable某一列的属性"""
+    def getter(self):
+        table = self.gpu.table
+        value = getattr(table, name)[self.row]
+        if coded:
+            return table.names[value]
+        if optional and value < 0:
+            return None
+        return value
+
+    def setter(self, value):
+        table = self.gpu.table
+        if coded:
+            value = table.code(value)
+        elif optional and value is None:
+            value = -1
+        getattr(table, name)[self.row] = value
+
+    return property(getter, setter)
+
+
+def _check_ref(dep_step) -> None:
+    """列存模式的依赖只能是StepRef（同一个Algo中Chunk操作返回的句柄）"""
+    if not isinstance(dep_step, StepRef):
+        raise TypeError(f"storage='columnar' expects StepRef dependencies returned by this Algo, "
+                        f"got {type(dep_step).__name__}")
+
+
+class StepRef:
+    """
+    列存模式下step的行句柄，提供与Step相同的常用字段和方法
+    句柄在build_all_dependencies之前有效（构建后各行会重新排列）
+    """
+    __slots__ = ("algo", "gpu", "row")
+
+    def __init__(self, algo, gpu: GPU, row: int):
+        self.algo = algo
+        self.gpu = gpu
+        self.row = row
+
+    s = _column_property("s")
+    type = _column_property("type", coded=True)
+    srcbuf = _column_property("srcbuf", coded=True)
+    srcoff = _column_property("srcoff")
+    dstbuf = _column_property("dstbuf", coded=True)
+    dstoff = _column_property("dstoff")
+    cnt = _column_property("cnt")
+    depid = _column_property("depid")
+    deps = _column_property("deps")
+    hasdep = _column_property("hasdep")
+    send_index = _column_property("send_index", optional=True)
+    recv_index = _column_property("recv_index", optional=True)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, StepRef) and self.gpu is other.gpu and self.row == other.row
+
+    def __hash__(self) -> int:
+        return hash((self.gpu.id, self.row))
+
+    def __repr__(self) -> str:
+        return f"StepRef(gpu={self.gpu.id}, row={self.row})"
+
+    @property
+    def _tb(self) -> TB:
+        return self.gpu.tbs[self.gpu.table.tb[self.row]]
+
+    def _get_tb(self) -> TB:
+        return self._tb
+
+    def _get_gpu_id(self) -> int:
+        return self.gpu.id
+
+    @property
+    def peer_step(self) -> Optional['StepRef']:
+        return self._ref(self.gpu.table.peer[self.row])
+
+    @peer_step.setter
+    def peer_step(self, step: Optional['StepRef']) -> None:
+        self.gpu.table.peer[self.row] = -1 if step is None else encode_ref(step.gpu.id, step.row)
+
+    def _ref(self, ref: int) -> Optional['StepRef']:
+        if ref < 0:
+            return None
+        gpu_id, row = decode_ref(ref)
+        return StepRef(self.algo, self.algo.get_gpu(gpu_id), row)
+
+    @property
+    def dep_list(self) -> Tuple['StepRef', ...]:
+        """依赖的step（只读快照，添加依赖使用add_dep）"""
+        return tuple(StepRef(self.algo, self.gpu, row) for row in self.gpu.table.deps_of(self.row))
+
+    @property
+    def depended_by_list(self) -> Tuple['StepRef', ...]:
+        """依赖该step的step（只读快照）"""
+        return tuple(StepRef(self.algo, self.gpu, row) for row in self.gpu.table.dependents_of(self.row))
+
+    def add_dep(self, dep_step: 'StepRef') -> None:
+        """添加依赖关系，检查规则与Step.add_dep相同"""
+        _check_ref(dep_step)
+        if dep_step.gpu is not self.gpu:
+            raise ValueError("Cross-GPU dependency is not allowed")
+        if self._tb is dep_step._tb:
+            raise ValueError("Dependencies within the same TB should be managed by controlling step order manually")
+        self.gpu.table.add_dep(self.row, dep_step.row)
+
+    def buffer_ends(self) -> List[Tuple[str, int]]:
+        return self.gpu.table.buffer_ends(self.row)
+
+    @staticmethod
+    def xml_element(table: StepTable, row: int) -> ET.Element:
+        step_elem = ET.Element("step")
+        names = table.names
+        for key, value in (("s", table.s[row]), ("type", names[table.type[row]]),
+                           ("srcbuf", names[table.srcbuf[row]]), ("srcoff", table.srcoff[row]),
+                           ("dstbuf", names[table.dstbuf[row]]), ("dstoff", table.dstoff[row]),
+                           ("cnt", table.cnt[row]), ("depid", table.depid[row]),
+                           ("deps", table.deps[row]), ("hasdep", table.hasdep[row])):
+            step_elem.set(key, str(value))
+        return step_elem
+
+
+def _build_table(payload) -> Tuple[StepTable, array, List[tuple], Tuple[int, int]]:
+    """
+    构建单个GPU的依赖关系：展开为对象、排序、解析后压缩回列
+    返回(新表, remap, 各TB的buffer深度统计, (删除的依赖数, 减少的nop数))
+    """
+    headers, table, merge_rcs, sort, reduce_deps = payload
+    tbs, steps = table.to_objects(headers)
+    gpu = GPU(table.gpu_id)
+    gpu.tbs = tbs
+    if sort:
+        gpu.sort_all_tb_steps()
+    reduced = gpu.reduce_dependencies() if reduce_deps else (0, 0)
+    gpu.build_dependencies(merge_rcs)
+    new_table, remap = table.from_objects(gpu.tbs, steps)
+    extents = [(tb._buffer_ends, tb._buffer_max) for tb in gpu.tbs]
+    return new_table, remap, extents, reduced
+
+
+def build_tables(gpus: List[GPU], merge_rcs: bool, sort: bool, reduction=None) -> None:
+    """
+    列存模式的build_all_dependencies：逐GPU构建，再修正peer引用
+    reduction不为None时构建前删除冗余依赖，结果累计到该DependencyReductionReport
+    """
+    for gpu in gpus:
+        if gpu.table.built:
+            raise RuntimeError(f"GPU {gpu.id}: dependencies are already built")
+    tasks = (([(tb.id, tb.send, tb.recv, tb.chan) for tb in gpu.tbs], gpu.table, merge_rcs, sort,
+              reduction is not None)
+             for gpu in gpus)
+    remaps = []
+    for gpu, (table, remap, extents, reduced) in zip(gpus, map(_build_table, tasks)):
+        if reduction is not None:
+            reduction.record(gpu.id, reduced)
+        gpu.table = table
+        remaps.append(remap)
+        for tb, (buffer_ends, buffer_max) in zip(gpu.tbs, extents):
+            tb._buffer_ends, tb._buffer_max = buffer_ends, buffer_max
+    for gpu in gpus:
+        gpu.table.remap_peers(remaps)
@@ -0,0 +1,171 @@
+"""
+关键路径与松弛分析
+
+在程序视图（program.py）上把所有step组成一个DAG，边包括TB内的程序顺序、depid/deps和
+send→recv（接收类step依赖连接上序号相同的发送类step）。每个step有一个权重，默认为cnt
+（nop为0），也可以用CostModel（与模拟器相同的alpha-beta耗时）或自定义函数给出。
+
+复用deadlock.py的等待图（不限制连接槽位）和Kahn拓扑序，按拓扑序正向求最早完成时间、
+按逆序反向求最晚完成时间，两遍都是O(step数)：
+- 关键路径：最早完成时间最大的step沿取得最大值的前驱回溯得到的路径
+- step的松弛 = 最晚完成时间 - 最早完成时间，TB的松弛为其中step松弛的最小值；
+  松弛为0的TB位于关键路径上，松弛越大的TB可以推迟得越多而不影响总时间
+"""
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .deadlock import ORDER, DEP, DATA, _WaitGraph
+from .program import TBProgram, algo_programs
+from .simulator import CostModel
+
+# 关键路径上的一个step：(gpu, tb, s, type, 权重, 与下一项之间的边)
+PathEntry = Tuple[int, int, int, str, float, Optional[str]]
+# 关键路径上同一TB内连续的一段：(gpu, tb, chan, 第一个s, 最后一个s, 权重之和)
+PathSegment = Tuple[int, int, int, int, int, float]
+
+Weight = Union[None, CostModel, Callable[[str, int], float]]
+
+# 沿边的方向描述下一项：在本项之后执行/依赖本项/接收本项发送的数据
+_EDGE_NAMES = {ORDER: "then", DEP: "enables", DATA: "sends to"}
+
+
+class CriticalPathResult:
+    """关键路径分析结果，时间单位与权重相同"""
+
+    def __init__(self, coll: str, name: str, length: float, path: List[PathEntry],
+                 segments: List[PathSegment], tb_slack: List[List[float]], nsteps: int):
+        self.coll = coll
+        self.name = name
+        # 关键路径长度，即无限资源下整个集合通信的完成时间下界
+        self.length = length
+        self.path = path
+        self.segments = segments
+        # tb_slack[g][tb] = TB的松弛，没有step的TB为length
+        self.tb_slack = tb_slack
+        self.nsteps = nsteps
+
+    @property
+    def critical_tbs(self) -> List[Tuple[int, int]]:
+        """松弛为0（允许浮点误差）的(gpu, tb)"""
+        eps = 1e-9 * max(self.length, 1.0)
+        return [(g, tb) for g, slacks in enumerate(self.tb_slack)
+                for tb, slack in enumerate(slacks) if slack <= eps]
+
+    @property
+    def channel_weights(self) -> Dict[int, float]:
+        """关键路径的权重按channel汇总"""
+        weights: Dict[int, float] = {}
+        for _, _, chan, _, _, weight in self.segments:
+            weights[chan] = weights.get(chan, 0.0) + weight
+        return weights
+
+    def summary(self, limit: int = 10) -> str:
+        lines = [f"{self.coll} '{self.name}': critical path {self.length:.3f} "
+                 f"({len(self.path)} of {self.nsteps} steps, {len(self.segments)} TB segments, "
+                 f"{len(self.critical_tbs)} TBs with zero slack)"]
+        for gpu, tb, chan, first, last, weight in sorted(self.segments, key=lambda seg: -seg[5])[:limit]:
+            lines.append(f"gpu {gpu}, tb {tb}, chan {chan}: steps {first}-{last}, weight {weight:.3f}")
+        weights = sorted(self.channel_weights.items(), key=lambda item: -item[1])
+        if weights:
+            lines.append("by channel: " + ", ".join(f"chan {chan} {weight:.3f}" for chan, weight in weights))
+        return "\n".join(lines)
+
+
+def _weights(programs: List[TBProgram], n: int, weight: Weight) -> List[float]:
+    """按节点编号排列的step权重"""
+    result = [0.0] * n
+    node = 0
+    for program in programs:
+        for s in range(len(program)):
+            if weight is None:
+                result[node] = 0.0 if program.type[s] == "nop" else float(program.cnt[s])
+            elif isinstance(weight, CostModel):
+                result[node] = weight.step_time(program, s)
+            else:
+                result[node] = float(weight(program.type[s], program.cnt[s]))
+            node += 1
+    return result
+
+
+def _schedule(graph: _WaitGraph, order: List[int], first: bytearray, w: List[float]):
+    """按拓扑序求各节点的最早完成时间、取得最大值的前驱及边类型，再反向求最晚完成时间"""
+    n = graph.n
+    dep, data = graph.dep, graph.data
+    finish = [0.0] * n
+    parent = [-1] * n
+    parent_kind = bytearray(n)
+    for node in order:
+        best, best_pred, best_kind = 0.0, -1, ORDER
+        if not first[node]:
+            best, best_pred = finish[node - 1], node - 1
+        pred = dep[node]
+        if pred >= 0 and (best_pred < 0 or finish[pred] > best):
+            best, best_pred, best_kind = finish[pred], pred, DEP
+        pred = data[node]
+        if pred >= 0 and (best_pred < 0 or finish[pred] > best):
+            best, best_pred, best_kind = finish[pred], pred, DATA
+        finish[node] = best + w[node]
+        parent[node] = best_pred
+        parent_kind[node] = best_kind
+    length = max(finish, default=0.0)
+
+    latest = [length] * n
+    for node in reversed(order):
+        start = latest[node] - w[node]
+        if not first[node] and start < latest[node - 1]:
+            latest[node - 1] = start
+        for pred in (dep[node], data[node]):
+            if pred >= 0 and start < latest[pred]:
+                latest[pred] = start
+    return finish, parent, parent_kind, latest
+
+
+def critical_path_programs(gpu_programs: List[List[TBProgram]], weight: Weight = None,
+                           coll: str = "", name: str = "") -> CriticalPathResult:
+    """在程序视图上求关键路径和各TB的松弛，存在等待环或未配对的recv时抛出ValueError"""
+    graph = _WaitGraph(gpu_programs, None)
+    order, first = graph.peel()
+    n = graph.n
+    if len(order) < n:
+        raise ValueError(f"{n - len(order)} of {n} steps can never complete (wait cycle or unmatched recv); "
+                         f"run check_deadlock for details")
+    w = _weights(graph.programs, n, weight)
+    finish, parent, parent_kind, latest = _schedule(graph, order, first, w)
+    length = max(finish, default=0.0)
+
+    tb_slack: List[List[float]] = []
+    index = 0
+    for tbs in gpu_programs:
+        slacks = []
+        for program in tbs:
+            base = graph.node_base[index]
+            slacks.append(min((latest[node] - finish[node] for node in range(base, base + len(program))),
+                              default=length))
+            index += 1
+        tb_slack.append(slacks)
+
+    path: List[PathEntry] = []
+    segments: List[PathSegment] = []
+    if n:
+        node = max(range(n), key=finish.__getitem__)
+        nodes = []
+        while node >= 0:
+            nodes.append(node)
+            node = parent[node]
+        nodes.reverse()
+        for i, node in enumerate(nodes):
+            program, s = graph.locate(node)
+            kind = _EDGE_NAMES[parent_kind[nodes[i + 1]]] if i + 1 < len(nodes) else None
+            path.append((program.gpu, program.id, s, program.type[s], w[node], kind))
+            if segments and segments[-1][:2] == (program.gpu, program.id) and segments[-1][4] == s - 1:
+                gpu, tb, chan, start, _, total = segments[-1]
+                segments[-1] = (gpu, tb, chan, start, s, total + w[node])
+            else:
+                segments.append((program.gpu, program.id, program.chan, s, s, w[node]))
+    return CriticalPathResult(coll, name, length, path, segments, tb_slack, n)
+
+
+def critical_path(algo, weight: Weight = None) -> CriticalPathResult:
+    """求构建后算法（依赖取自depid/deps）的关键路径，CostModel按algo.chunk_scale换算chunk大小"""
+    if isinstance(weight, CostModel):
+        weight = weight.scaled(algo.chunk_scale)
+    return critical_path_programs(algo_programs(algo), weight, algo.coll, algo.name)
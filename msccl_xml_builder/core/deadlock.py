@@ -0,0 +1,322 @@
+"""
+静态死锁检查
+
+在程序视图（program.py）上构建全局的等待图，每个step是一个节点，等待边包括：
+- 程序顺序：TB内的step等待前一个step
+- 依赖：step等待depid/deps指向的step
+- 数据：接收类step等待连接(发送rank, 接收rank, chan)上序号相同的发送类step
+- 槽位：发送类step等待同一连接上第send_index - slots个接收完成（slots为None时不限制）
+
+用Kahn算法剥离所有能够执行完的step，剩下的step永远无法执行：其中等待不存在的
+send/recv（未配对）的部分单独报告，其余部分必然包含等待环。每个被卡住的step选择
+一个同样被卡住的等待对象，在这个出度为1的图上线性时间找出所有环，再用0-1 BFS
+（程序顺序边权为0，其他边权为1）缩短为跨TB等待最少的环，便于阅读。
+"""
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from .program import TBProgram, algo_programs
+
+# 等待边的类型，顺序即选择等待对象时的优先级
+ORDER, DEP, DATA, SLOT = range(4)
+_WAIT_NAMES = {ORDER: "after", DEP: "depends on", DATA: "receives from", SLOT: "needs a free slot from"}
+
+# (gpu, tb, s, type, 与下一项之间的等待关系)
+CycleEntry = Tuple[int, int, int, str, Optional[str]]
+
+
+class DeadlockReport:
+    """死锁检查结果"""
+
+    def __init__(self, nsteps: int, blocked: int, cycles: List[List[CycleEntry]],
+                 unmatched: List[Tuple[int, int, int, str, str]]):
+        self.nsteps = nsteps
+        # 永远无法执行的step数
+        self.blocked = blocked
+        # 每个环为首尾相同的step序列，程序顺序上连续的step已合并
+        self.cycles = cycles
+        # 找不到对端的send/recv：(gpu, tb, s, type, 说明)
+        self.unmatched = unmatched
+
+    @property
+    def ok(self) -> bool:
+        return self.blocked == 0 and not self.unmatched
+
+    def summary(self, limit: int = 10) -> str:
+        if self.ok:
+            return f"No deadlock: all {self.nsteps} steps can complete"
+        lines = [f"{self.blocked} of {self.nsteps} steps can never complete: "
+                 f"{len(self.cycles)} wait cycle(s), {len(self.unmatched)} unmatched send/recv"]
+        for cycle in self.cycles[:limit]:
+            lines.append("cycle: " + " ".join(
+                f"(gpu {gpu}, tb {tb}, step {s}, type {step_type})" + (f" {wait}" if wait else "")
+                for gpu, tb, s, step_type, wait in cycle))
+        for gpu, tb, s, step_type, reason in self.unmatched[:limit]:
+            lines.append(f"unmatched: (gpu {gpu}, tb {tb}, step {s}, type {step_type}) {reason}")
+        hidden = max(0, len(self.cycles) - limit) + max(0, len(self.unmatched) - limit)
+        if hidden:
+            lines.append(f"... {hidden} more")
+        return "\n".join(lines)
+
+
+class _WaitGraph:
+    """全局等待图：节点编号为TB的起始编号 + s，程序顺序边隐含在编号中"""
+
+    def __init__(self, gpu_programs: List[List[TBProgram]], slots: Optional[int]):
+        self.programs = [program for tbs in gpu_programs for program in tbs]
+        self.node_base: List[int] = []
+        tb_base: List[int] = []
+        n = 0
+        for tbs in gpu_programs:
+            tb_base.append(len(self.node_base))
+            for program in tbs:
+                self.node_base.append(n)
+                n += len(program)
+        self.n = n
+        # 每个节点除程序顺序外的等待对象，-1表示没有
+        self.dep = [-1] * n
+        self.data = [-1] * n
+        self.slot = [-1] * n
+        # 永远等不到的节点（对端不存在）及原因
+        self.missing: Dict[int, str] = {}
+        self.unmatched_sends: List[int] = []
+
+        sends: Dict[Tuple[int, int, int, int], int] = {}
+        recvs: Dict[Tuple[int, int, int, int], int] = {}
+        for program, base in zip(self.programs, self.node_base):
+            for s in range(len(program)):
+                if program.send_index[s] >= 0:
+                    sends[(program.gpu, program.send, program.chan, program.send_index[s])] = base + s
+                if program.recv_index[s] >= 0:
+                    recvs[(program.recv, program.gpu, program.chan, program.recv_index[s])] = base + s
+
+        for program, base in zip(self.programs, self.node_base):
+            gpu_tbs = gpu_programs[program.gpu]
+            for s in range(len(program)):
+                node = base + s
+                depid, deps = program.depid[s], program.deps[s]
+                if depid >= 0:
+                    if depid >= len(gpu_tbs) or not 0 <= deps < len(gpu_tbs[depid]):
+                        raise ValueError(f"{program.describe(s)}: depid={depid} deps={deps} does not refer to a step")
+                    self.dep[node] = self.node_base[tb_base[program.gpu] + depid] + deps
+                recv_index = program.recv_index[s]
+                if recv_index >= 0:
+                    peer = sends.get((program.recv, program.gpu, program.chan, recv_index))
+                    if peer is None:
+                        self.missing[node] = (f"receives message {recv_index} from rank {program.recv} "
+                                              f"on channel {program.chan}, which is never sent")
+                    else:
+                        self.data[node] = peer
+                send_index = program.send_index[s]
+                if send_index >= 0:
+                    key = (program.gpu, program.send, program.chan)
+                    if key + (send_index,) not in recvs:
+                        self.unmatched_sends.append(node)
+                    if slots is not None and send_index >= slots:
+                        peer = recvs.get(key + (send_index - slots,))
+                        if peer is None:
+                            self.missing.setdefault(node, f"waits for a free slot, but message {send_index - slots} "
+                                                          f"to rank {program.send} on channel {program.chan} "
+                                                          f"is never received")
+                        else:
+                            self.slot[node] = peer
+
+    def locate(self, node: int) -> Tuple[TBProgram, int]:
+        i = bisect_right(self.node_base, node) - 1
+        # 跳过没有step的TB
+        while self.node_base[i] + len(self.programs[i]) <= node:
+            i += 1
+        return self.programs[i], node - self.node_base[i]
+
+    def waits(self, node: int, first: bool) -> List[Tuple[int, int]]:
+        """node的等待对象[(节点, 类型)]；first为True表示node是所在TB的第一个step"""
+        result = [] if first else [(node - 1, ORDER)]
+        for target, kind in ((self.dep[node], DEP), (self.data[node], DATA), (self.slot[node], SLOT)):
+            if target >= 0:
+                result.append((target, kind))
+        return result
+
+    def peel(self) -> Tuple[List[int], bytearray]:
+        """Kahn算法：返回(order, first)，order为能执行完的节点的拓扑序，first[node]表示node是TB的第一个step"""
+        n = self.n
+        first = bytearray(n)
+        pending = bytearray(n)
+        waiters: Dict[int, List[int]] = {}
+        for program, base in zip(self.programs, self.node_base):
+            if len(program):
+                first[base] = 1
+        for node in range(n):
+            count = 0 if first[node] else 1
+            for target in (self.dep[node], self.data[node], self.slot[node]):
+                if target >= 0:
+                    count += 1
+                    waiters.setdefault(target, []).append(node)
+            if node in self.missing:
+                count += 1
+            pending[node] = count
+
+        order = []
+        queue = deque(node for node in range(n) if pending[node] == 0)
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            if node + 1 < n and not first[node + 1]:
+                pending[node + 1] -= 1
+                if pending[node + 1] == 0:
+                    queue.append(node + 1)
+            for waiter in waiters.get(node, ()):
+                pending[waiter] -= 1
+                if pending[waiter] == 0:
+                    queue.append(waiter)
+        return order, first
+
+    def completable(self) -> Tuple[bytearray, bytearray]:
+        """返回(done, first)，done[node]表示node能执行完"""
+        order, first = self.peel()
+        done = bytearray(self.n)
+        for node in order:
+            done[node] = 1
+        return done, first
+
+    def doomed(self, done: bytearray, first: bytearray) -> bytearray:
+        """直接或间接等待未配对send/recv的节点"""
+        n = self.n
+        waiters: Dict[int, List[int]] = {}
+        for node in range(n):
+            if not done[node]:
+                for target in (self.dep[node], self.data[node], self.slot[node]):
+                    if target >= 0 and not done[target]:
+                        waiters.setdefault(target, []).append(node)
+        doomed = bytearray(n)
+        queue = deque(self.missing)
+        for node in queue:
+            doomed[node] = 1
+        while queue:
+            node = queue.popleft()
+            released = waiters.get(node, [])
+            if node + 1 < n and not first[node + 1]:
+                released = released + [node + 1]
+            for waiter in released:
+                if not doomed[waiter]:
+                    doomed[waiter] = 1
+                    queue.append(waiter)
+        return doomed
+
+    def shortest_cycle(self, start: int, allowed: bytearray, first: bytearray) -> Optional[List[Tuple[int, int]]]:
+        """0-1 BFS求经过start、只经过allowed节点且非程序顺序边最少的环，返回[(节点, 到下一节点的等待类型)]"""
+        dist: Dict[int, int] = {}
+        parent: Dict[int, Tuple[int, int]] = {}
+        queue = deque()
+        for target, kind in self.waits(start, first[start]):
+            if allowed[target]:
+                weight = 0 if kind == ORDER else 1
+                if target not in dist or weight < dist[target]:
+                    dist[target] = weight
+                    parent[target] = (start, kind)
+                    if weight:
+                        queue.append(target)
+                    else:
+                        queue.appendleft(target)
+        visited = set()
+        while queue:
+            node = queue.popleft()
+            if node in visited:
+                continue
+            visited.add(node)
+            if node == start:
+                break
+            for target, kind in self.waits(node, first[node]):
+                if not allowed[target]:
+                    continue
+                weight = 0 if kind == ORDER else 1
+                if target not in dist or dist[node] + weight < dist[target]:
+                    dist[target] = dist[node] + weight
+                    parent[target] = (node, kind)
+                    if weight:
+                        queue.append(target)
+                    else:
+                        queue.appendleft(target)
+        if start not in visited:
+            return None
+        path = []
+        node = start
+        while True:
+            prev, kind = parent[node]
+            path.append((prev, kind))
+            node = prev
+            if node == start:
+                break
+        path.reverse()
+        return path
+
+    def describe_cycle(self, path: List[Tuple[int, int]]) -> List[CycleEntry]:
+        """把环转换为可读的step序列，合并程序顺序上连续的step"""
+        entries: List[CycleEntry] = []
+        for index, (node, kind) in enumerate(path):
+            # 一段程序顺序边只保留第一个step，中间的step省略
+            if kind == ORDER and index > 0 and path[index - 1][1] == ORDER:
+                continue
+            program, s = self.locate(node)
+            entries.append((program.gpu, program.id, s, program.type[s], _WAIT_NAMES[kind]))
+        program, s = self.locate(path[0][0])
+        entries.append((program.gpu, program.id, s, program.type[s], None))
+        return entries
+
+
+def check_programs(gpu_programs: List[List[TBProgram]], slots: Optional[int] = 8,
+                   max_cycles: int = 10, max_starts: int = 8) -> DeadlockReport:
+    """在程序视图上检查死锁，最多报告max_cycles个环，每个环最多尝试max_starts个起点求最短环"""
+    graph = _WaitGraph(gpu_programs, slots)
+    done, first = graph.completable()
+    blocked = graph.n - sum(done)
+
+    unmatched = []
+    for node in sorted(set(graph.missing) | set(graph.unmatched_sends)):
+        program, s = graph.locate(node)
+        if node in graph.missing:
+            reason = graph.missing[node]
+        else:
+            reason = (f"sends message {program.send_index[s]} to rank {program.send} on channel {program.chan}, "
+                      f"which is never received")
+        unmatched.append((program.gpu, program.id, s, program.type[s], reason))
+
+    cycles: List[List[CycleEntry]] = []
+    if blocked:
+        doomed = graph.doomed(done, first)
+        allowed = bytearray(0 if done[node] or doomed[node] else 1 for node in range(graph.n))
+        # 每个被卡住的节点选择第一个同样被卡住的等待对象，得到出度为1的图
+        state = bytearray(graph.n)  # 0: 未访问，1: 当前路径上，2: 已处理
+        for root in range(graph.n):
+            if not allowed[root] or state[root]:
+                continue
+            walk = []
+            node = root
+            while node >= 0 and allowed[node] and not state[node]:
+                state[node] = 1
+                walk.append(node)
+                node = next((target for target, _ in graph.waits(node, first[node]) if allowed[target]), -1)
+            if node >= 0 and allowed[node] and state[node] == 1 and len(cycles) < max_cycles:
+                loop = walk[walk.index(node):]
+                members = set(loop)
+                # 以环上跨TB等待的节点为起点求最短环
+                starts = [v for v in loop
+                          if graph.dep[v] in members or graph.data[v] in members or graph.slot[v] in members]
+                best = None
+                for start in (starts or loop)[:max_starts]:
+                    path = graph.shortest_cycle(start, allowed, first)
+                    if path is not None and (best is None or _cost(path) < _cost(best)):
+                        best = path
+                cycles.append(graph.describe_cycle(best))
+            for visited in walk:
+                state[visited] = 2
+    return DeadlockReport(graph.n, blocked, cycles, unmatched)
+
+
+def _cost(path: List[Tuple[int, int]]) -> Tuple[int, int]:
+    return sum(1 for _, kind in path if kind != ORDER), len(path)
+
+
+def check_deadlock(algo, slots: Optional[int] = 8, max_cycles: int = 10) -> DeadlockReport:
+    """检查algo（依赖取自depid/deps，通常在build_all_dependencies之后）是否会死锁"""
+    return check_programs(algo_programs(algo), slots, max_cycles)
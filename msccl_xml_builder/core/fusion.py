@@ -0,0 +1,237 @@
+"""
+依赖构建之后的全局rcs融合
+
+build_all_dependencies(merge_rcs=True)只合并TB中相邻、且send没有其他依赖的recv+send。
+多instance的ring、pack_tbs合并后的TB等程序中，转发的send与对应的recv之间常夹着其他step，
+无法合并。fuse_rcs在构建后的程序上查找所有可以转发的recv→send对并融合为rcs：
+
+- 同一TB（recv peer与send peer不同）中的recv r和之后发送r写入区域的send s（cnt相同），
+  r与s之间没有step写这个区域；s没有其他依赖（depid/deps为空或指向r，之前没有承载依赖的nop），
+  r只被s依赖（否则依赖r的step还要等待发送完成）
+- rcs放在r与s之间的某个位置k：r推迟到k，其间不能有接收类step或读该区域的step；s提前到k，
+  其间不能有发送类step。各连接上send/recv的顺序不变，send_index/recv_index不变
+- 无死锁：取全局等待图（含连接槽位，见deadlock.py）的一个拓扑序，把rcs放在拓扑序中k之前的
+  step之后，要求s等待的槽位在其之前、等待r的发送在其之后。接收只会后移、发送只会前移，
+  推迟的recv与提前的send通过槽位相连时舍弃后者，因此逐对检查的条件互不破坏
+- k尽量靠后：k = s的位置时其他step的时间不变；k更靠前时steps[k:s]要等待发送，
+  只在它们的松弛（关键路径分析，见critical_path.py）不小于发送耗时时提前
+
+rcs一次读入即转发，本地处理与传输重叠（CostModel的overlap_forwarding，未传入model时默认开启）；
+报告融合前后的step数和模拟完成时间。不重叠的模型中rcs没有收益，推迟的recv可能使完成时间变长。
+"""
+from typing import Callable, Dict, List, Optional
+
+from .critical_path import _schedule, _weights
+from .deadlock import _WaitGraph
+from .program import algo_programs, check_built_steps
+from .simulator import CostModel, simulate
+from .step import Step
+from .tb import RECV_STEP_TYPES, SEND_STEP_TYPES
+
+
+class FusionReport:
+    """rcs融合结果，时间为模拟得到的整个集合通信的完成时间（us）"""
+
+    def __init__(self, fused: int, chunks: int, steps_before: int, steps_after: int,
+                 time_before: float, time_after: float):
+        self.fused = fused
+        # 不再经过本地buffer中转的chunk数
+        self.chunks = chunks
+        self.steps_before = steps_before
+        self.steps_after = steps_after
+        self.time_before = time_before
+        self.time_after = time_after
+
+    def summary(self) -> str:
+        return (f"fused {self.fused} recv/send pairs into rcs ({self.chunks} chunks forwarded directly): "
+                f"steps {self.steps_before} -> {self.steps_after}, "
+                f"simulated time {self.time_before:.3f} -> {self.time_after:.3f} us")
+
+
+def _overlaps(buf: str, off: int, cnt: int, region: tuple) -> bool:
+    return buf == region[0] and off >= 0 and off < region[2] and region[1] < off + cnt
+
+
+def _find_pairs(tb, base: int, graph: _WaitGraph, position: List[int], slot_succ: List[int],
+                referenced: Dict[Step, int], slack: List[float], delay: Callable[[int], float]) -> List[tuple]:
+    """TB中可以融合的(r, s, rcs在TB中的位置k, r的节点, s的节点)，rcs放在steps[k]之前"""
+    pairs = []
+    steps = tb.steps
+    for i, recv_step in enumerate(steps):
+        if recv_step.type != "r":
+            continue
+        region = (recv_step.dstbuf, recv_step.dstoff, recv_step.dstoff + recv_step.cnt)
+        # r只能推迟到第一个接收类/读该区域的step之前，s只能提前到最后一个发送类step之后
+        first_recv = last_send = None
+        send_step = None
+        for j in range(i + 1, len(steps)):
+            step = steps[j]
+            if (step.type == "s" and step.cnt == recv_step.cnt
+                    and step.srcbuf == region[0] and step.srcoff == region[1]):
+                send_step = step
+                break
+            # s的dst和r的src是对端的buffer
+            if step.type != "s" and _overlaps(step.dstbuf, step.dstoff, step.cnt, region):
+                break
+            if step.type in SEND_STEP_TYPES:
+                last_send = j
+            if first_recv is None and (step.type in RECV_STEP_TYPES
+                                       or _overlaps(step.srcbuf, step.srcoff, step.cnt, region)):
+                first_recv = j
+            if first_recv is not None and last_send is not None and last_send >= first_recv:
+                break
+        if send_step is None:
+            continue
+        if send_step.depid >= 0 and (send_step.depid, send_step.deps) != (tb.id, i):
+            continue
+        if j > i + 1 and steps[j - 1].type == "nop":
+            continue
+        # 其他step依赖r时，融合后还要等待发送完成
+        if referenced.get(recv_step, 0) != (1 if send_step.depid >= 0 else 0):
+            continue
+        # rcs在拓扑序中紧跟steps[k - 1]：s等待的槽位须在其之前，等待r的发送须在其之后；
+        # 尽量靠后放置，k < j时steps[k:j]要等待发送，只在它们的松弛足以吸收发送耗时时提前
+        succ = slot_succ[base + i]
+        slot = graph.slot[base + j]
+        low = i + 1 if last_send is None else last_send + 1
+        high = j if first_recv is None else first_recv
+        if high < j:
+            cost = delay(send_step.cnt)
+            while high >= low and min(slack[base + high:base + j]) < cost:
+                high -= 1
+        for k in range(high, low - 1, -1):
+            prev = position[base + k - 1]
+            if (succ < 0 or position[succ] > prev) and (slot < 0 or position[slot] <= prev):
+                pairs.append((recv_step, send_step, k, base + i, base + j))
+                break
+    return pairs
+
+
+def _fuse(recv_step: Step, send_step: Step) -> None:
+    """把send_step原地改为rcs，接管recv_step的peer和依赖关系"""
+    tb = send_step._tb
+    tb.untrack_step_extents(recv_step)
+    tb.untrack_step_extents(send_step)
+    recv_peer, send_peer = recv_step.peer_step, send_step.peer_step
+    send_step.type = "rcs"
+    send_step.dstbuf, send_step.dstoff = recv_step.dstbuf, recv_step.dstoff
+    send_step.recv_index = recv_step.recv_index
+    send_step.recv_peer, send_step.send_peer = recv_peer, send_peer
+    send_step.peer_step = None
+    send_step.position_fixed = True
+    if recv_peer is not None:
+        for attr in ("peer_step", "send_peer"):
+            if getattr(recv_peer, attr) is recv_step:
+                setattr(recv_peer, attr, send_step)
+    for dep_step in list(recv_step.dep_list):
+        dep_step.depended_by_list.discard(recv_step)
+        if dep_step is not send_step:
+            send_step.dep_list.append(dep_step)
+            dep_step.depended_by_list.append(send_step)
+    for dependent in list(recv_step.depended_by_list):
+        dependent.dep_list.discard(recv_step)
+        if dependent is not send_step:
+            dependent.dep_list.append(send_step)
+            send_step.depended_by_list.append(dependent)
+    tb.track_step_extents(send_step)
+
+
+def fuse_rcs(algo, model: Optional[CostModel] = None) -> FusionReport:
+    """融合所有可转发的recv→send对，model用于估计融合前后的完成时间（slots同时用于无死锁检查）"""
+    check_built_steps(algo, "fuse_rcs")
+    if model is None:
+        model = CostModel(overlap_forwarding=True)
+
+    gpu_programs = algo_programs(algo)
+    time_before = simulate(algo, model).time
+    # simulate自行换算，这里的权重和链路耗时同样按切分后的chunk计算
+    scaled = model.scaled(algo.chunk_scale)
+    graph = _WaitGraph(gpu_programs, model.slots)
+    order, first = graph.peel()
+    if len(order) < graph.n:
+        raise ValueError(f"{graph.n - len(order)} of {graph.n} steps can never complete; "
+                         f"run check_deadlock for details")
+    position = [0] * graph.n
+    for index, node in enumerate(order):
+        position[node] = index
+    finish, _, _, latest = _schedule(graph, order, first, _weights(graph.programs, graph.n, scaled))
+    slack = [late - early for early, late in zip(finish, latest)]
+    slot_succ = [-1] * graph.n
+    for node, pred in enumerate(graph.slot):
+        if pred >= 0:
+            slot_succ[pred] = node
+
+    # depid/deps解析为step对象，融合后按新位置重新写回
+    targets: List[Dict[Step, Step]] = []
+    candidates = []
+    index = 0
+    for gpu in algo.gpus:
+        target = {}
+        for tb in gpu.tbs:
+            for step in tb.steps:
+                if step.depid >= 0:
+                    target[step] = gpu.tbs[step.depid].steps[step.deps]
+        targets.append(target)
+        referenced: Dict[Step, int] = {}
+        for dep_step in target.values():
+            referenced[dep_step] = referenced.get(dep_step, 0) + 1
+        pairs = []
+        for tb in gpu.tbs:
+            base = graph.node_base[index]
+            index += 1
+            if tb.send != -1 and tb.recv != -1 and tb.send != tb.recv:
+                pairs.extend(_find_pairs(tb, base, graph, position, slot_succ, referenced, slack,
+                                         lambda cnt: scaled.link_time(gpu.id, tb.send, cnt)))
+        candidates.append(pairs)
+    # 推迟的recv在拓扑序中后移、提前的send前移，两者通过槽位相连时不能同时移动
+    delayed = {recv_node for pairs in candidates for recv_step, _, k, recv_node, _ in pairs
+               if k > recv_step.s + 1}
+
+    fused = chunks = 0
+    for gpu, target, pairs in zip(algo.gpus, targets, candidates):
+        pairs = [(recv_step, send_step, k) for recv_step, send_step, k, _, send_node in pairs
+                 if k == send_step.s or graph.slot[send_node] not in delayed]
+        if not pairs:
+            continue
+        # 融合后的rcs即原来的send，插入到steps[k]之前
+        replaced: Dict[Step, Step] = {}
+        anchors: Dict[Step, List[Step]] = {}
+        for recv_step, send_step, k in pairs:
+            anchors.setdefault(recv_step._tb.steps[k], []).append(send_step)
+            _fuse(recv_step, send_step)
+            replaced[recv_step] = send_step
+            # rcs继承recv的依赖，send只依赖recv或没有依赖
+            if recv_step in target:
+                target[send_step] = target.pop(recv_step)
+            else:
+                target.pop(send_step, None)
+            fused += 1
+            chunks += recv_step.cnt
+        moved = set(send for sends in anchors.values() for send in sends)
+        for tb in gpu.tbs:
+            if not any(step in replaced for step in tb.steps):
+                continue
+            steps = []
+            for step in tb.steps:
+                steps.extend(anchors.get(step, ()))
+                if step not in replaced and step not in moved:
+                    steps.append(step)
+            tb.steps = steps
+            for s, step in enumerate(steps):
+                step.s = s
+        referenced_steps = set()
+        for tb in gpu.tbs:
+            for step in tb.steps:
+                dep_step = target.get(step)
+                dep_step = replaced.get(dep_step, dep_step)
+                if dep_step is None or dep_step is step:
+                    step.depid = step.deps = -1
+                else:
+                    step.depid, step.deps = dep_step._tb.id, dep_step.s
+                    referenced_steps.add(dep_step)
+        for keep in replaced.values():
+            keep.hasdep = 1 if keep in referenced_steps else 0
+
+    steps_after = sum(len(tb.steps) for gpu in algo.gpus for tb in gpu.tbs)
+    time_after = simulate(algo, model).time if fused else time_before
+    return FusionReport(fused, chunks, graph.n, steps_after, time_before, time_after)
@@ -1,14 +1,34 @@
 import xml.etree.ElementTree as ET
-from typing import List, Optional, Dict
+from collections import deque
+from typing import List, Optional, Dict, Set, TextIO, Tuple
 from .tb import TB
 from .step import Step
+from .xml_writer import format_start_tag, format_end_tag
+
+# find_tb支持的所有查询组合：(是否指定send, 是否指定recv, 是否指定chan)
+_TB_INDEX_MASKS = [(has_send, has_recv, has_chan)
+                   for has_send in (True, False)
+                   for has_recv in (True, False)
+                   for has_chan in (True, False)]
+
+
+def _tb_index_keys(send: int, recv: int, chan: int) -> Tuple[Tuple[int, ...], ...]:
+    """TB在各查询组合下的key，顺序与_TB_INDEX_MASKS一致"""
+    return ((send, recv, chan), (send, recv), (send, chan), (send,),
+            (recv, chan), (recv,), (chan,), ())
 
 class GPU:
     def __init__(self, id: int):
         self.id = id
         self.tbs: List[TB] = []
-        # 修改数据结构：channel_usage[channel_id] = {'send': [target_ranks], 'recv': [source_ranks]}
-        self.channel_usage: Dict[int, Dict[str, List[int]]] = {}
+        # 修改数据结构：channel_usage[channel_id] = {'send': {target_ranks}, 'recv': {source_ranks}}
+        self.channel_usage: Dict[int, Dict[str, Set[int]]] = {}
+        # TB索引：_tb_index[mask][key] = 第一个匹配的TB，key为mask中指定字段的取值
+        self._tb_index: Dict[Tuple[bool, bool, bool], Dict[Tuple[int, ...], TB]] = {
+            mask: {} for mask in _TB_INDEX_MASKS
+        }
+        # 列存模式下保存所有step的StepTable（见columnar.py），为None时step保存在各TB的steps中
+        self.table = None
     
     def get_next_tb_id(self) -> int:
         return len(self.tbs)
@@ -23,11 +43,11 @@ class GPU:
             existing = self.channel_usage[chan]
             
             # 检查send冲突：如果当前TB要send到某个rank，检查是否已有其他TB也send到同一个rank
-            if tb.send != -1 and 'send' in existing and tb.send in existing['send']:
+            if tb.send != -1 and tb.send in existing['send']:
                 raise ValueError(f"GPU {self.id} Channel {chan} already has a TB sending to rank {tb.send}")
             
             # 检查recv冲突：如果当前TB要从某个rank recv，检查是否已有其他TB也从同一个rank recv
-            if tb.recv != -1 and 'recv' in existing and tb.recv in existing['recv']:
+            if tb.recv != -1 and tb.recv in existing['recv']:
                 raise ValueError(f"GPU {self.id} Channel {chan} already has a TB receiving from rank {tb.recv}")
     
     def add_tb(self, tb: TB) -> None:
@@ -41,25 +61,74 @@ class GPU:
         # Update channel usage
         chan = tb.chan
         if chan not in self.channel_usage:
-            self.channel_usage[chan] = {'send': [], 'recv': []}
+            self.channel_usage[chan] = {'send': set(), 'recv': set()}
         
         if tb.send != -1:
-            self.channel_usage[chan]['send'].append(tb.send)
+            self.channel_usage[chan]['send'].add(tb.send)
         if tb.recv != -1:
-            self.channel_usage[chan]['recv'].append(tb.recv)
+            self.channel_usage[chan]['recv'].add(tb.recv)
             
         self.tbs.append(tb)
+        self._index_tb(tb)
+    
+    def _index_tb(self, tb: TB) -> None:
+        """将TB加入所有查询组合的索引，已存在的key保留先加入的TB"""
+        for index, key in zip(self._tb_index.values(), _tb_index_keys(tb.send, tb.recv, tb.chan)):
+            index.setdefault(key, tb)
+    
+    def rebuild_tb_index(self) -> None:
+        """按self.tbs的当前内容重建TB索引和channel_usage（直接修改tbs后调用）"""
+        self.channel_usage = {}
+        for index in self._tb_index.values():
+            index.clear()
+        for tb in self.tbs:
+            usage = self.channel_usage.setdefault(tb.chan, {'send': set(), 'recv': set()})
+            if tb.send != -1:
+                usage['send'].add(tb.send)
+            if tb.recv != -1:
+                usage['recv'].add(tb.recv)
+            self._index_tb(tb)
     
     def find_tb(self, send: int = None, recv: int = None, chan: int = None) -> Optional[TB]:
         """
-        查找匹配条件的TB
+        查找匹配条件的TB，多个匹配时返回最先加入的TB
         """
-        for tb in self.tbs:
-            if ((send is None or tb.send == send) and 
-                (recv is None or tb.recv == recv) and
-                (chan is None or tb.chan == chan)):
-                return tb
-        return None
+        key = (send, recv, chan)
+        mask = (send is not None, recv is not None, chan is not None)
+        if not all(mask):
+            key = tuple(value for value in key if value is not None)
+        return self._tb_index[mask].get(key)
+    
+    def get_send_tb(self, dest_rank: int, chan: int, bidirectional: bool = True) -> TB:
+        """
+        查找发送到dest_rank的TB，不存在时创建
+        bidirectional为True时创建send=recv=dest_rank的双向TB，否则创建recv=-1的单向TB
+        """
+        tb = self.find_tb(send=dest_rank, chan=chan)
+        if tb is None:
+            if bidirectional:
+                # Check if recv exists for the same channel
+                if self.find_tb(recv=dest_rank, chan=chan):
+                    raise ValueError(f"Channel {chan} already has recv from rank {dest_rank}")
+                tb = TB(send=dest_rank, recv=dest_rank, chan=chan)
+            else:
+                tb = TB(send=dest_rank, recv=-1, chan=chan)
+            self.add_tb(tb)
+        return tb
+    
+    def get_recv_tb(self, src_rank: int, chan: int, bidirectional: bool = True) -> TB:
+        """查找从src_rank接收的TB，不存在时创建（规则与get_send_tb对称）"""
+        tb = self.find_tb(recv=src_rank, chan=chan)
+        if tb is None:
+            if bidirectional:
+                # Check if send exists for the same channel
+                if self.find_tb(send=src_rank, chan=chan):
+                    raise ValueError(f"Channel {chan} already has send to rank {src_rank}")
+                tb = TB(send=src_rank, recv=src_rank, chan=chan)
+            else:
+                tb = TB(send=-1, recv=src_rank, chan=chan)
+            self.add_tb(tb)
+        return tb
     
     def sort_all_tb_steps(self) -> None:
         """对所有P2PTB中的steps进行排序"""
@@ -67,88 +136,188 @@ class GPU:
             if tb.send == tb.recv:
                 tb.sort_steps_by_index()
     
+    def reduce_dependencies(self) -> Tuple[int, int]:
+        """
+        依赖构建之前删除可由TB内顺序或其他依赖推出的依赖（传递约简，见reduction.py）
+        返回(删除的依赖数, 减少的nop数)
+        """
+        from .reduction import reduce_dependencies
+        return reduce_dependencies(self.tbs)
+    
     def build_dependencies(self, merge_rcs: bool = False) -> None:
-        """构建该GPU下所有step的依赖关系"""
+        """
+        构建该GPU下所有step的依赖关系
+        
+        按依赖图的拓扑序（Kahn算法）单遍处理：TB内的step按顺序执行，
+        因此每个TB的下一个step在其所有依赖都已固定位置后即可处理。
+        依赖被固定后其s不会再改变，因此记录的depid/deps即为最终值。
+        """
         # 设置所有step的GPU ID引用
         for tb in self.tbs:
             for step in tb.steps:
                 step._gpu_id = self.id
         
-        max_iterations = 100 # 防止无限循环
-        iteration = 0
+        # pending[step] = 尚未固定的依赖数；waiters[dep] = 等待dep固定的step
+        pending: Dict[Step, int] = {}
+        waiters: Dict[Step, List[Step]] = {}
+        for tb in self.tbs:
+            for step in tb.steps:
+                if step.position_fixed:
+                    continue
+                count = 0
+                for dep_step in step.dep_list:
+                    if not dep_step.position_fixed:
+                        count += 1
+                        waiters.setdefault(dep_step, []).append(step)
+                pending[step] = count
         
-        while iteration < max_iterations:
-            iteration += 1
-            all_fixed = True
-            
-            for tb in self.tbs:
-                i = 0  # 使用while循环，因为合并操作可能改变steps数量
-                while i < len(tb.steps):
-                    step = tb.steps[i]
-                    
-                    if step.position_fixed:
-                        i += 1
-                        continue
-                    
-                    # 检查依赖
-                    if not step.dep_list:
-                        # 无依赖，可以固定位置
-                        can_fix = True
-                    else:
-                        # 检查所有依赖是否已固定位置
-                        can_fix = all(dep.position_fixed for dep in step.dep_list)
-                    
-                    if can_fix:
-                        # 构建依赖关系
-                        if step.dep_list:
-                            if len(step.dep_list) == 1:
-                                # 单个依赖
-                                dep_step = step.dep_list[0]
-                                step.depid = dep_step._tb.id
-                                step.deps = dep_step.s
-                            else:
-                                # 多个依赖，需要插入nop step
-                                tb.insert_nop_step(i, step.dep_list)
-                                # 当前step依赖最后一个原始依赖
-                                dep_step = step.dep_list[-1]
-                                step.depid = dep_step._tb.id
-                                step.deps = dep_step.s
-                        
-                        # 在固定位置之前，检查是否可以执行rcs合并
-                        merged = False
-                        if merge_rcs and self._can_merge_rcs(tb, i):
-                            merged = self._merge_recv_send_to_rcs(tb, i)
-                            if merged:
-                                # 合并后不增加i，因为当前位置的step已经变化
-                                continue
-                        
-                        # 如果没有合并或合并失败，正常固定位置
-                        if not merged:
-                            step.position_fixed = True
-                            i += 1
+        # 解析过程中不修改tb.steps：每个TB的已解析部分（含插入的nop和合并出的rcs）
+        # 追加到resolved[tb]，step加入时的位置即为最终的s，全部解析后一次性替换tb.steps
+        cursor: Dict[TB, int] = {tb: 0 for tb in self.tbs}  # 每个TB下一个待处理step在原steps中的位置
+        resolved: Dict[TB, List[Step]] = {tb: [] for tb in self.tbs}
+        blocked_on: Dict[TB, Step] = {}  # 因依赖未固定而阻塞的TB -> 阻塞的step
+        ready = deque(self.tbs)
+        
+        def release(fixed_step: Step) -> None:
+            # fixed_step已固定位置，通知等待它的step
+            for waiter in waiters.pop(fixed_step, ()):
+                pending[waiter] -= 1
+                if pending[waiter] == 0 and blocked_on.get(waiter._tb) is waiter:
+                    del blocked_on[waiter._tb]
+                    ready.append(waiter._tb)
+        
+        while ready:
+            tb = ready.popleft()
+            steps = tb.steps
+            out = resolved[tb]
+            i = cursor[tb]
+            while i < len(steps):
+                step = steps[i]
+                
+                if step.position_fixed:
+                    step.s = len(out)
+                    out.append(step)
+                    i += 1
+                    continue
+                
+                if pending[step] > 0:
+                    # 依赖尚未全部固定，等待依赖固定后再继续该TB
+                    blocked_on[tb] = step
+                    break
+                
+                # 构建依赖关系
+                if step.dep_list:
+                    if len(step.dep_list) > 1:
+                        self._collapse_same_tb_deps(step)
+                    if len(step.dep_list) == 1:
+                        # 单个依赖
+                        dep_step = step.dep_list[0]
+                        step.depid = dep_step._tb.id
+                        step.deps = dep_step.s
                     else:
-                        all_fixed = False
+                        # 多个依赖，需要在当前step之前插入nop step
+                        for dep_step in step.dep_list[:-1]:
+                            nop_step = tb.make_nop_step(dep_step)
+                            nop_step._gpu_id = self.id
+                            nop_step.s = len(out)
+                            out.append(nop_step)
+                        # 当前step依赖最后一个原始依赖
+                        dep_step = step.dep_list[-1]
+                        step.depid = dep_step._tb.id
+                        step.deps = dep_step.s
+                
+                step.s = len(out)
+                
+                # 在固定位置之前，检查是否可以与前一个step执行rcs合并
+                if merge_rcs and out and self._can_merge_rcs_pair(tb, out[-1], step):
+                    recv_step = out[-1]
+                    rcs_step = self._build_rcs_step(tb, recv_step, step)
+                    if rcs_step is not None:
+                        rcs_step._gpu_id = self.id
+                        out[-1] = rcs_step
+                        tb.untrack_step_extents(recv_step)
+                        tb.untrack_step_extents(step)
+                        tb.track_step_extents(rcs_step)
+                        # 合并后依赖recv/send的step都改为依赖已固定的rcs
+                        release(recv_step)
+                        release(step)
                         i += 1
-            
-            if all_fixed:
-                break
+                        continue
+                
+                # 如果没有合并或合并失败，正常固定位置
+                step.position_fixed = True
+                out.append(step)
+                release(step)
+                i += 1
+            cursor[tb] = i
         
-        if iteration >= max_iterations:
-            raise RuntimeError("Failed to resolve all dependencies within maximum iterations")
+        # 一次性重建每个TB的steps；未能解析的剩余step保持原顺序接在后面
+        for tb in self.tbs:
+            out = resolved[tb]
+            if cursor[tb] < len(tb.steps):
+                out.extend(tb.steps[cursor[tb]:])
+                for j in range(len(out)):
+                    out[j].s = j
+            tb.steps = out
+        
+        if blocked_on:
+            raise RuntimeError(self._describe_unresolved(blocked_on))
+    
+    def _collapse_same_tb_deps(self, step: Step) -> None:
+        """
+        同一源TB中只保留s最大的依赖：TB内按顺序执行，较早的step必然已完成
+        在依赖全部固定位置（排序和rcs合并之后）、插入nop之前调用，s即为最终位置
+        """
+        latest: Dict[TB, Step] = {}
+        for dep_step in step.dep_list:
+            current = latest.get(dep_step._tb)
+            if current is None or dep_step.s > current.s:
+                latest[dep_step._tb] = dep_step
+        if len(latest) < len(step.dep_list):
+            for dep_step in list(step.dep_list):
+                if latest[dep_step._tb] is not dep_step:
+                    step.remove_dep(dep_step)
+    
+    def _describe_unresolved(self, blocked_on: Dict[TB, Step]) -> str:
+        """沿等待关系查找导致依赖无法解析的环，生成可读的错误信息"""
+        def describe(step: Step) -> str:
+            tb = step._get_tb()
+            tb_id = tb.id if tb is not None else None
+            return f"(gpu {step._get_gpu_id()}, tb {tb_id}, step {step.s}, type {step.type})"
+        
+        def waits_for(step: Step) -> Optional[Step]:
+            # 每个未固定的step只沿一条等待边前进：TB内的前一个未固定step，或第一个未固定的依赖
+            tb = step._get_tb()
+            if tb is not None and tb in blocked_on and blocked_on[tb] is not step:
+                if 0 < step.s < len(tb.steps) and not tb.steps[step.s - 1].position_fixed:
+                    return tb.steps[step.s - 1]
+            for dep_step in step.dep_list:
+                if not dep_step.position_fixed:
+                    return dep_step
+            return None
+        
+        step = next(iter(blocked_on.values()))
+        visited: Dict[Step, int] = {}
+        path: List[Step] = []
+        while step is not None and step not in visited:
+            visited[step] = len(path)
+            path.append(step)
+            step = waits_for(step)
+        
+        if step is None or step._get_tb() not in blocked_on:
+            return (f"GPU {self.id}: unresolvable dependency, "
+                    f"{' -> '.join(describe(s) for s in path)} depends on a step outside this GPU")
+        
+        cycle = path[visited[step]:] + [step]
+        return f"GPU {self.id}: dependency cycle detected: {' -> '.join(describe(s) for s in cycle)}"
 
-    def _can_merge_rcs(self, tb: TB, send_step_idx: int) -> bool:
+    def _can_merge_rcs_pair(self, tb: TB, recv_step: Step, send_step: Step) -> bool:
         """
-        检查是否可以将recv+send合并为rcs
+        检查TB中相邻的recv_step和send_step是否可以合并为rcs
         """
         if tb.send == tb.recv:
             return False
         
-        if send_step_idx <= 0 or send_step_idx >= len(tb.steps):
-            return False
-        
-        send_step = tb.steps[send_step_idx]
-        recv_step = tb.steps[send_step_idx - 1]
-        
         # 检查基本条件：当前是send，上一个是recv
         if not (send_step.type == "s" and recv_step.type == "r" and 
                 send_step.cnt == recv_step.cnt and 
@@ -169,14 +338,12 @@ class GPU:
         
         return False
 
-    def _merge_recv_send_to_rcs(self, tb: TB, send_step_idx: int) -> bool:
+    def _build_rcs_step(self, tb: TB, recv_step: Step, send_step: Step) -> Optional[Step]:
         """
-        将recv+send合并为rcs操作
+        由相邻的recv+send创建rcs step，并将依赖关系转移到rcs上
+        不修改tb.steps，由调用方负责替换；失败时返回None
         """
         try:
-            recv_step = tb.steps[send_step_idx - 1]
-            send_step = tb.steps[send_step_idx]
-            
             # 检查recv操作是否仅被该send操作依赖
             recv_only_depended_by_send = (
                 len(recv_step.depended_by_list) == 1 and 
@@ -239,52 +406,68 @@ class GPU:
                 if send_step in dep_step.depended_by_list:
                     dep_step.depended_by_list.remove(send_step)
             
-            # 替换steps: 移除recv和send，插入rcs
-            tb.steps.pop(send_step_idx)  # 先移除send (索引较大的)
-            tb.steps.pop(send_step_idx - 1)  # 再移除recv
-            tb.steps.insert(send_step_idx - 1, rcs_step)  # 插入rcs到recv的原位置
-            
-            # 更新后续steps的s字段
-            for j in range(send_step_idx - 1, len(tb.steps)):
-                tb.steps[j].s = j
-            
-            return True
+            return rcs_step
             
         except Exception as e:
-            return False
+            return None
     
-    def to_xml(self) -> ET.Element:
-        gpu_elem = ET.Element("gpu")
-        gpu_elem.set("id", str(self.id))
-        
-        # 计算各种buffer的最大深度
+    @property
+    def buffer_extents(self) -> Tuple[int, int, int]:
+        """
+        各种buffer的最大深度(i_chunks, o_chunks, s_chunks)
+        由各TB在添加/合并/插入step时增量维护，只需合并各TB的结果
+        """
         max_i_chunks = 0
-        max_o_chunks = 0  
+        max_o_chunks = 0
         max_s_chunks = 0
-        
         for tb in self.tbs:
-            for step in tb.steps:
-                # 检查srcbuf
-                if step.srcbuf == "i" and step.srcoff >= 0:
-                    max_i_chunks = max(max_i_chunks, step.srcoff + step.cnt)
-                elif step.srcbuf == "o" and step.srcoff >= 0:
-                    max_o_chunks = max(max_o_chunks, step.srcoff + step.cnt)
-                elif step.srcbuf == "s" and step.srcoff >= 0:
-                    max_s_chunks = max(max_s_chunks, step.srcoff + step.cnt)
-                
-                # 检查dstbuf
-                if step.dstbuf == "i" and step.dstoff >= 0:
-                    max_i_chunks = max(max_i_chunks, step.dstoff + step.cnt)
-                elif step.dstbuf == "o" and step.dstoff >= 0:
-                    max_o_chunks = max(max_o_chunks, step.dstoff + step.cnt)
-                elif step.dstbuf == "s" and step.dstoff >= 0:
-                    max_s_chunks = max(max_s_chunks, step.dstoff + step.cnt)
+            i_chunks, o_chunks, s_chunks = tb.buffer_extents
+            max_i_chunks = max(max_i_chunks, i_chunks)
+            max_o_chunks = max(max_o_chunks, o_chunks)
+            max_s_chunks = max(max_s_chunks, s_chunks)
+        return max_i_chunks, max_o_chunks, max_s_chunks
+    
+    def refresh_buffer_extents(self) -> None:
+        """直接修改steps或step的buffer字段后，重新计算所有TB的buffer深度统计"""
+        for tb in self.tbs:
+            tb.refresh_extents()
+    
+    def xml_attrs(self) -> List[Tuple[str, str]]:
+        """<gpu>元素的属性列表（保持输出顺序）"""
+        max_i_chunks, max_o_chunks, max_s_chunks = self.buffer_extents
+        return [
+            ("id", str(self.id)),
+            ("i_chunks", str(max_i_chunks)),
+            ("o_chunks", str(max_o_chunks)),
+            ("s_chunks", str(max_s_chunks)),
+        ]
+    
+    def to_xml(self) -> ET.Element:
+        gpu_elem = ET.Element("gpu")
+        for key, value in self.xml_attrs():
+            gpu_elem.set(key, value)
         
-        gpu_elem.set("i_chunks", str(max_i_chunks))
-        gpu_elem.set("o_chunks", str(max_o_chunks))
-        gpu_elem.set("s_chunks", str(max_s_chunks))
+        if self.table is not None:
+            for tb, rows in zip(self.tbs, self.table.rows_by_tb(len(self.tbs))):
+                gpu_elem.append(self.table.tb_to_xml(tb, rows))
+            return gpu_elem
         
         for tb in self.tbs:
             gpu_elem.append(tb.to_xml())
         
-        return gpu_elem
\ No newline at end of file
+        return gpu_elem
+    
+    def write_xml(self, f: TextIO, level: int = 1) -> None:
+        """将<gpu>元素及其所有TB流式写入文件句柄"""
+        if not self.tbs:
+            f.write(format_start_tag("gpu", self.xml_attrs(), level, empty=True))
+            return
+        
+        f.write(format_start_tag("gpu", self.xml_attrs(), level))
+        if self.table is not None:
+            for tb, rows in zip(self.tbs, self.table.rows_by_tb(len(self.tbs))):
+                self.table.write_tb_xml(f, tb, rows, level + 1)
+        else:
+            for tb in self.tbs:
+                tb.write_xml(f, level + 1)
+        f.write(format_end_tag("gpu", level))
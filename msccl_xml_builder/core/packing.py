@@ -0,0 +1,216 @@
+"""
+TB合并（packing）
+
+MSCCL为每个TB启动一个CUDA block，每个GPU的TB数受SM数量和运行时限制。pack_tbs在依赖构建
+之后把同一GPU上兼容的TB合并为一个TB：
+
+- 兼容关系是逐对的：两个TB冲突当且仅当都有send peer、都有recv peer，或channel不同
+  （只有cpy的TB与任何TB兼容），因此合并方案就是冲突图的一个着色
+- 同一channel上的只发送TB与只接收TB配对（按负载从大到小与从小到大配对，使合并后的负载
+  均衡），只有cpy的TB按负载从大到小放入当前负载最小的TB；合并按合并后负载从小到大进行，
+  达到max_tbs即停止，max_tbs为None时合并到无法再合并为止（即最少TB数）
+
+合并后TB内的顺序：在全局等待图（程序顺序、依赖、send→recv、连接槽位，见deadlock.py）上
+求每个step的层级，合并的TB按(层级, 拓扑序)交错排列。所有TB仍是同一拓扑序的子序列，
+因此不会引入死锁；每个连接上send/recv的顺序不变，send_index/recv_index不变。
+合并后落入同一TB的依赖由TB内顺序保证，清除对应的depid/deps并删除只承载这些依赖的nop。
+"""
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from .deadlock import _WaitGraph
+from .program import algo_programs, check_built_steps
+from .step import Step
+from .tb import TB
+
+
+class PackingReport:
+    """TB合并结果"""
+
+    def __init__(self, before: List[int], after: List[int], removed_nops: int, dropped_deps: int):
+        # 各GPU合并前后的TB数
+        self.before = before
+        self.after = after
+        self.removed_nops = removed_nops
+        # 变为TB内依赖而清除的depid/deps数
+        self.dropped_deps = dropped_deps
+
+    def summary(self) -> str:
+        return (f"TBs per GPU: max {max(self.before, default=0)} -> {max(self.after, default=0)}, "
+                f"total {sum(self.before)} -> {sum(self.after)}; "
+                f"removed {self.removed_nops} nops and {self.dropped_deps} same-TB dependencies")
+
+
+def _plan_groups(tbs: List[TB], loads: List[int], max_tbs: Optional[int]) -> List[List[int]]:
+    """选择要合并的TB，返回各合并组（TB id列表），组按最小的TB id排列"""
+    budget = 0 if max_tbs is None else max_tbs
+    members: Dict[int, List[int]] = {tb.id: [tb.id] for tb in tbs}
+    load = {tb.id: loads[tb.id] for tb in tbs}
+    count = len(tbs)
+
+    def merge(into: int, other: int) -> None:
+        members[into].extend(members.pop(other))
+        load[into] += load.pop(other)
+
+    # 同一channel上的只发送TB与只接收TB配对，较多一侧中负载最大的保持独立
+    senders: Dict[int, List[int]] = {}
+    receivers: Dict[int, List[int]] = {}
+    copies = []
+    for tb in tbs:
+        if tb.send == -1 and tb.recv == -1:
+            copies.append(tb.id)
+        elif tb.recv == -1:
+            senders.setdefault(tb.chan, []).append(tb.id)
+        elif tb.send == -1:
+            receivers.setdefault(tb.chan, []).append(tb.id)
+    pairs = []
+    for chan, send_ids in senders.items():
+        recv_ids = receivers.get(chan, [])
+        k = min(len(send_ids), len(recv_ids))
+        send_ids = sorted(send_ids, key=lambda i: (-load[i], i))[len(send_ids) - k:]
+        recv_ids = sorted(recv_ids, key=lambda i: (load[i], i))[:k]
+        pairs.extend(zip(send_ids, recv_ids))
+    for send_id, recv_id in sorted(pairs, key=lambda pair: (load[pair[0]] + load[pair[1]], min(pair))):
+        if count <= budget:
+            break
+        merge(min(send_id, recv_id), max(send_id, recv_id))
+        count -= 1
+
+    # 只有cpy的TB放入当前负载最小的组（GPU上只有cpy TB时合并为一个）
+    copy_set = set(copies)
+    heap = [(load[i], i) for i in members if i not in copy_set]
+    heapq.heapify(heap)
+    for copy_id in sorted(copies, key=lambda i: (-load[i], i)):
+        if count <= budget:
+            break
+        if not heap:
+            heapq.heappush(heap, (load[copy_id], copy_id))
+            continue
+        _, target = heapq.heappop(heap)
+        merge(target, copy_id)
+        count -= 1
+        heapq.heappush(heap, (load[target], target))
+
+    return sorted((sorted(group) for group in members.values()), key=lambda group: group[0])
+
+
+def _apply(gpu, groups: List[List[int]], keys: Dict[Step, Tuple[int, int]]) -> Tuple[int, int]:
+    """按合并组重建GPU的TB，返回(删除的nop数, 清除的依赖数)"""
+    old_tbs = gpu.tbs
+    steps_by_tb = [tb.steps for tb in old_tbs]
+    target = {}  # step -> depid/deps指向的step
+    for tb in old_tbs:
+        for step in tb.steps:
+            if step.depid >= 0:
+                target[step] = steps_by_tb[step.depid][step.deps]
+    referenced = set(target.values())
+
+    new_tbs = []
+    group_of: Dict[Step, int] = {}
+    for new_id, group in enumerate(groups):
+        first = old_tbs[group[0]]
+        if len(group) == 1:
+            steps = first.steps
+            tb = first
+        else:
+            parts = [old_tbs[i] for i in group]
+            steps = sorted((step for part in parts for step in part.steps), key=keys.__getitem__)
+            tb = TB(send=max(part.send for part in parts), recv=max(part.recv for part in parts),
+                    chan=next((part.chan for part in parts if part.send != -1 or part.recv != -1), first.chan))
+            tb.send_index = max(part.send_index for part in parts)
+            tb.recv_index = max(part.recv_index for part in parts)
+        tb.id = new_id
+        for step in steps:
+            group_of[step] = new_id
+        new_tbs.append((tb, steps, len(group) > 1))
+
+    removed_nops = dropped_deps = 0
+    dropped_targets = set()
+    for tb, steps, merged in new_tbs:
+        if merged:
+            kept = []
+            for step in steps:
+                dep_step = target.get(step)
+                if dep_step is not None and group_of[dep_step] == tb.id:
+                    # TB内的顺序已保证该依赖
+                    dropped_targets.add(dep_step)
+                    dropped_deps += 1
+                    del target[step]
+                    if step.type == "nop" and step not in referenced:
+                        removed_nops += 1
+                        continue
+                kept.append(step)
+            steps = kept
+            tb.steps = steps
+            for step in steps:
+                step._tb = tb
+            # 同一TB内的依赖关系也从dep_list中删除，与build_dependencies的结果一致
+            for step in steps:
+                for dep_step in list(step.dep_list):
+                    if dep_step._tb is tb:
+                        step.dep_list.discard(dep_step)
+                        dep_step.depended_by_list.discard(step)
+        for s, step in enumerate(steps):
+            step.s = s
+    for tb, steps, _ in new_tbs:
+        for step in steps:
+            dep_step = target.get(step)
+            if dep_step is None:
+                step.depid = step.deps = -1
+            else:
+                step.depid, step.deps = group_of[dep_step], dep_step.s
+    still_referenced = set(target.values())
+    for dep_step in dropped_targets - still_referenced:
+        dep_step.hasdep = 0
+
+    gpu.tbs = [tb for tb, _, _ in new_tbs]
+    gpu.rebuild_tb_index()
+    for tb, _, merged in new_tbs:
+        if merged:
+            tb.refresh_extents()
+    return removed_nops, dropped_deps
+
+
+def pack_tbs(algo, max_tbs: Optional[int] = None, slots: Optional[int] = 8) -> PackingReport:
+    """合并各GPU上兼容的TB，max_tbs为每个GPU的目标TB数，slots为保证无死锁时假设的连接缓冲"""
+    check_built_steps(algo, "pack_tbs")
+
+    gpu_programs = algo_programs(algo)
+    graph = _WaitGraph(gpu_programs, slots)
+    order, first = graph.peel()
+    if len(order) < graph.n:
+        raise ValueError(f"{graph.n - len(order)} of {graph.n} steps can never complete; "
+                         f"run check_deadlock for details")
+    # 层级 = 等待图上到该step的最长路径边数，与拓扑序位置一起作为合并后的排序key
+    level = [0] * graph.n
+    for node in order:
+        current = level[node - 1] + 1 if not first[node] else 0
+        for pred in (graph.dep[node], graph.data[node], graph.slot[node]):
+            if pred >= 0 and level[pred] + 1 > current:
+                current = level[pred] + 1
+        level[node] = current
+    position = [0] * graph.n
+    for index, node in enumerate(order):
+        position[node] = index
+
+    before, after = [], []
+    removed_nops = dropped_deps = 0
+    index = 0
+    for gpu in algo.gpus:
+        tbs = gpu.tbs
+        before.append(len(tbs))
+        keys: Dict[Step, Tuple[int, int]] = {}
+        loads = []
+        for tb in tbs:
+            base = graph.node_base[index]
+            index += 1
+            loads.append(sum(step.cnt for step in tb.steps))
+            for s, step in enumerate(tb.steps):
+                keys[step] = (level[base + s], position[base + s])
+        groups = _plan_groups(tbs, loads, max_tbs)
+        if len(groups) < len(tbs):
+            nops, deps = _apply(gpu, groups, keys)
+            removed_nops += nops
+            dropped_deps += deps
+        after.append(len(gpu.tbs))
+    return PackingReport(before, after, removed_nops, dropped_deps)
@@ -0,0 +1,59 @@
+"""多进程辅助：按GPU分片并行执行XML序列化"""
+import io
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, TextIO, Tuple
+
+from .gpu import GPU
+
+# 子进程中待序列化的GPU列表，由进程池的initializer在每个子进程中设置（fork时随进程内存继承，
+# 无需pickle）。每次输出使用独立的进程池，同一进程内并发的输出互不影响；主进程中不使用该变量
+_render_gpus: List[GPU] = []
+
+
+def _set_render_gpus(gpus: List[GPU]) -> None:
+    global _render_gpus
+    _render_gpus = gpus
+
+
+def _render_fragment(gpu: GPU) -> str:
+    """将GPU渲染为XML片段字符串"""
+    buf = io.StringIO()
+    gpu.write_xml(buf, 1)
+    return buf.getvalue()
+
+
+def _render_gpu(pos: int) -> str:
+    """子进程入口：渲染本进程继承的第pos个GPU"""
+    return _render_fragment(_render_gpus[pos])
+
+
+def _make_render_executor(gpus: List[GPU], workers: int) -> Tuple[Executor, Callable[[int], Future]]:
+    """
+    支持fork时使用进程池（子进程直接继承对象模型），否则退化为线程池并把GPU对象直接传给任务
+    返回(executor, submit)，submit(pos)提交第pos个GPU的渲染
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                                       initializer=_set_render_gpus, initargs=(gpus,))
+        return executor, lambda pos: executor.submit(_render_gpu, pos)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    return executor, lambda pos: executor.submit(_render_fragment, gpus[pos])
+
+
+def write_gpus_parallel(f: TextIO, gpus: List[GPU], workers: int) -> None:
+    """
+    并行渲染各GPU的XML片段并按rank顺序写入文件
+    同时在途的片段不超过2*workers个，内存占用与GPU数量无关
+    """
+    window = 2 * workers
+    executor, submit = _make_render_executor(gpus, workers)
+    with executor:
+        in_flight = deque()
+        for pos in range(len(gpus)):
+            in_flight.append(submit(pos))
+            if len(in_flight) >= window:
+                f.write(in_flight.popleft().result())
+        while in_flight:
+            f.write(in_flight.popleft().result())
@@ -0,0 +1,123 @@
+"""
+chunk流水线
+
+cnt较大的一次copy_diff在多跳调度（ring、两步alltoall）中整段串行：下一跳要等整个chunk到达
+才能转发。copy_diff(..., pipeline=N)把传输切分为N个子chunk在同一连接上依次发送：
+
+- 下游的copy_diff同样使用流水线、且读取的区域与上游流水线recv写入的区域重叠时，第i个子send
+  只依赖写入其读取范围的上游子recv，各跳的子chunk传输相互重叠；不重叠的依赖保持不变
+- 返回最后一个子send/recv。同一TB内按顺序执行，依赖它们等价于依赖整个传输，未使用流水线的
+  下游操作不需要修改
+- cnt不能被N整除时细分整个算法的chunk单位：nchunksperloop和已创建step的offset/cnt乘以
+  N / gcd(cnt, N)，之后Chunk和bulk操作的index/size按Algo.chunk_scale换算，生成脚本不需要修改
+  （rank模板的RankContext直接使用XML中的单位，不做换算）
+- rank模板每次访问都展开新的GPU，不支持流水线和chunk细分
+- 快照保存chunk_scale，但不保存子recv分组：读回的算法上新的流水线copy_diff依赖读入的recv时
+  等待整个传输，结果正确，只是不再与上游的子chunk重叠
+"""
+from math import gcd
+from typing import List, Optional, Tuple
+
+from .channels import ChannelGroup
+from .chunk import append_step
+from .step import Step
+
+
+def _scale_step(step: Step, factor: int) -> None:
+    if step.srcoff >= 0:
+        step.srcoff *= factor
+    if step.dstoff >= 0:
+        step.dstoff *= factor
+    step.cnt *= factor
+
+
+def _reject_template(algo) -> None:
+    from .template import RankTemplate
+    if isinstance(algo.gpus, RankTemplate):
+        raise ValueError("pipeline and chunk rescaling are not supported after set_rank_template")
+
+
+def rescale_chunks(algo, factor: int) -> None:
+    """把算法的chunk单位细分为原来的1/factor，已创建的step描述的数据位置不变"""
+    _reject_template(algo)
+    if factor == 1:
+        return
+    algo.nchunksperloop *= factor
+    algo.chunk_scale *= factor
+    for gpu in algo.gpus:
+        table = gpu.table
+        if table is not None:
+            for column in (table.srcoff, table.dstoff):
+                for row, off in enumerate(column):
+                    if off >= 0:
+                        column[row] = off * factor
+            for row, cnt in enumerate(table.cnt):
+                table.cnt[row] = cnt * factor
+        else:
+            for tb in gpu.tbs:
+                for step in tb.steps:
+                    _scale_step(step, factor)
+        for tb in gpu.tbs:
+            tb.scale_extents(factor)
+    # 等待分配channel的step尚未加入TB
+    for transfer in algo._channel_transfers:
+        transfer.cnt *= factor
+        _scale_step(transfer.send_step, factor)
+        if transfer.recv_step is not None:
+            _scale_step(transfer.recv_step, factor)
+
+
+def _overlaps(step, buf: str, off: int, cnt: int) -> bool:
+    return step.dstbuf == buf and step.dstoff < off + cnt and off < step.dstoff + step.cnt
+
+
+def _sub_dep(dep_step, group: Optional[List], buf: str, off: int, cnt: int):
+    """子chunk [off, off + cnt)对dep_step的依赖：写入该范围的最后一个上游子recv，没有时为None"""
+    if group is None:
+        return dep_step
+    for recv_step in reversed(group):
+        if _overlaps(recv_step, buf, off, cnt):
+            return recv_step
+    return None
+
+
+def pipeline_copy_diff(algo, src_chunk, dest_chunk, channel_id: int, dep_steps: List[Step],
+                       bidirectional: bool, pipeline: int) -> Tuple[Step, Step]:
+    """把src_chunk到dest_chunk的传输切分为pipeline个子chunk，返回最后一个子send/recv"""
+    _reject_template(algo)
+    if isinstance(channel_id, ChannelGroup):
+        raise ValueError("pipeline requires a fixed channel_id; ChannelGroup is not supported")
+    count = src_chunk._count()
+    rescale_chunks(algo, pipeline // gcd(count, pipeline))
+    srcbuf, dstbuf = src_chunk._get_buf_name(), dest_chunk._get_buf_name()
+    srcoff, dstoff, count = src_chunk._offset(), dest_chunk._offset(), src_chunk._count()
+    sub = count // pipeline
+
+    # 只有读取区域与上游流水线写入区域重叠的依赖按子chunk拆分
+    groups = []
+    for dep_step in dep_steps:
+        group = algo._pipelines.get(dep_step)
+        if group is not None and not any(_overlaps(recv_step, srcbuf, srcoff, count) for recv_step in group):
+            group = None
+        groups.append(group)
+
+    src, dst = algo.get_gpu(src_chunk.gpu_id), algo.get_gpu(dest_chunk.gpu_id)
+    send_tb = src.get_send_tb(dest_chunk.gpu_id, channel_id, bidirectional)
+    recv_tb = dst.get_recv_tb(src_chunk.gpu_id, channel_id, bidirectional)
+    recv_steps = []
+    for i in range(pipeline):
+        off = i * sub
+        deps = [_sub_dep(dep_step, group, srcbuf, srcoff + off, sub) for dep_step, group in zip(dep_steps, groups)]
+        send_step = append_step(algo, src, send_tb, [dep_step for dep_step in deps if dep_step is not None],
+                                type="s", srcbuf=srcbuf, srcoff=srcoff + off,
+                                dstbuf=dstbuf, dstoff=dstoff + off, cnt=sub)
+        recv_step = append_step(algo, dst, recv_tb, (),
+                                type="r", srcbuf=srcbuf, srcoff=srcoff + off,
+                                dstbuf=dstbuf, dstoff=dstoff + off, cnt=sub)
+        send_step.peer_step = recv_step
+        recv_step.peer_step = send_step
+        if send_step.send_index != recv_step.recv_index:
+            raise ValueError(f"Index mismatch: send_index={send_step.send_index}, recv_index={recv_step.recv_index}")
+        recv_steps.append(recv_step)
+    algo._pipelines[recv_step] = recv_steps
+    return send_step, recv_step
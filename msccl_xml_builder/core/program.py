@@ -0,0 +1,98 @@
+"""
+算法的静态程序视图
+
+模拟器、死锁检查和关键路径分析只关心每个TB按s排列的step序列及其执行相关字段
+（type、cnt、depid/deps以及在连接上的send/recv序号）。这里把对象模式、列存模式、
+rank模板和from_xml读入的算法统一提取为TBProgram，分析代码不需要区分存储方式。
+"""
+from typing import List
+
+from .tb import SEND_STEP_TYPES, RECV_STEP_TYPES
+
+
+class TBProgram:
+    """
+    单个TB的step序列，各字段为按s排列、与step等长的列表
+    send_index/recv_index为step在该TB的发送/接收连接上的序号，不涉及时为-1
+    """
+    __slots__ = ("gpu", "id", "send", "recv", "chan",
+                 "type", "cnt", "depid", "deps", "send_index", "recv_index")
+
+    def __init__(self, gpu: int, id: int, send: int, recv: int, chan: int):
+        self.gpu = gpu
+        self.id = id
+        self.send = send
+        self.recv = recv
+        self.chan = chan
+        self.type: List[str] = []
+        self.cnt: List[int] = []
+        self.depid: List[int] = []
+        self.deps: List[int] = []
+        self.send_index: List[int] = []
+        self.recv_index: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.type)
+
+    def append(self, type: str, cnt: int, depid: int, deps: int) -> None:
+        self.type.append(type)
+        self.cnt.append(cnt)
+        self.depid.append(depid)
+        self.deps.append(deps)
+
+    def assign_indices(self) -> None:
+        """按执行顺序为发送/接收类step分配连接上的序号（与TB.claim_indices相同）"""
+        nsend = nrecv = 0
+        for step_type in self.type:
+            if step_type in SEND_STEP_TYPES:
+                self.send_index.append(nsend)
+                nsend += 1
+            else:
+                self.send_index.append(-1)
+            if step_type in RECV_STEP_TYPES:
+                self.recv_index.append(nrecv)
+                nrecv += 1
+            else:
+                self.recv_index.append(-1)
+
+    def describe(self, s: int) -> str:
+        """与依赖构建的错误信息格式相同的step描述"""
+        return f"(gpu {self.gpu}, tb {self.id}, step {s}, type {self.type[s]})"
+
+
+def gpu_programs(gpu) -> List[TBProgram]:
+    """提取单个GPU各TB的程序"""
+    programs = [TBProgram(gpu.id, tb.id, tb.send, tb.recv, tb.chan) for tb in gpu.tbs]
+    table = gpu.table
+    if table is not None:
+        names = table.names
+        for program, rows in zip(programs, table.rows_by_tb(len(gpu.tbs))):
+            for row in rows:
+                program.append(names[table.type[row]], table.cnt[row], table.depid[row], table.deps[row])
+    else:
+        for program, tb in zip(programs, gpu.tbs):
+            for step in tb.steps:
+                program.append(step.type, step.cnt, step.depid, step.deps)
+    for program in programs:
+        program.assign_indices()
+    return programs
+
+
+def algo_programs(algo) -> List[List[TBProgram]]:
+    """提取所有GPU的程序（rank模板逐个展开后只保留提取结果）"""
+    return [gpu_programs(gpu) for gpu in algo.gpus]
+
+
+def check_built_steps(algo, name: str) -> None:
+    """
+    依赖构建之后的变换（pack_tbs、fuse_rcs、coalesce_transfers）直接修改TB中的Step对象，
+    要求对象存储、未使用rank模板，且带依赖的step均已由build_all_dependencies固定位置
+    """
+    from .template import RankTemplate
+    if isinstance(algo.gpus, RankTemplate) or algo.storage != "object":
+        raise ValueError(f"{name} requires storage='object' without a rank template")
+    for gpu in algo.gpus:
+        for tb in gpu.tbs:
+            for step in tb.steps:
+                if not step.position_fixed and len(step.dep_list):
+                    raise RuntimeError(f"{name} must run after build_all_dependencies")
@@ -0,0 +1,136 @@
+"""
+依赖的传递约简
+
+build_dependencies为每个有多个依赖的step插入len(dep_list) - 1个nop，每个nop在运行时都是一次
+同步。生成脚本常附加冗余依赖（step同时依赖A和B，而B已经依赖A），在依赖构建之前删除它们可以
+直接减少nop。
+
+GPU内step完成的先后关系由两类边组成：TB内的程序顺序和dep_list。每个TB是一条链，因此可以用
+向量时钟表示可达性：clock[t]为TB t中必须先完成的最后一个step的位置。按拓扑序（与
+build_dependencies相同的Kahn算法）处理每个step v：
+- v的时钟 = TB内前一个step的时钟与各依赖时钟（含依赖自身的位置）的逐项最大值
+- 依赖A（位于TB t的位置i）是冗余的，当且仅当TB内前一个step的时钟或另一个依赖B的时钟在t项
+  不小于i，即A已由程序顺序或B保证
+时钟是稀疏的：只记录实际能到达的TB，不含step自身所在的TB（其值就是step的位置）。只为被依赖
+的step保存时钟，TB的时钟在合并新的依赖之前不变，期间的step共享同一个字典。耗时为
+O(step数 + Σ被合并的时钟大小)；转发深度有限的算法（如两步alltoall）中时钟只含少数TB，
+与TB数无关。
+"""
+from collections import deque
+from typing import Dict, List, Tuple
+
+from .step import Step, StepSet
+from .tb import TB
+
+
+class DependencyReductionReport:
+    """依赖约简结果，per_gpu[g] = (删除的依赖数, 构建时不再需要插入的nop数)"""
+
+    def __init__(self):
+        self.per_gpu: Dict[int, Tuple[int, int]] = {}
+
+    def record(self, gpu_id: int, removed: Tuple[int, int]) -> None:
+        # rank模板每次展开都会重新约简，按GPU记录避免重复累计
+        self.per_gpu[gpu_id] = removed
+
+    @property
+    def removed_deps(self) -> int:
+        return sum(deps for deps, _ in self.per_gpu.values())
+
+    @property
+    def removed_nops(self) -> int:
+        return sum(nops for _, nops in self.per_gpu.values())
+
+    def summary(self) -> str:
+        return (f"removed {self.removed_deps} redundant dependencies and {self.removed_nops} nops "
+                f"on {len(self.per_gpu)} GPUs")
+
+
+def reduce_dependencies(tbs: List[TB]) -> Tuple[int, int]:
+    """
+    删除一个GPU内可由程序顺序或其他依赖推出的依赖，返回(删除的依赖数, 减少的nop数)
+    已固定位置的step（如读入的XML）不修改；存在依赖环时只处理环之前的部分，由构建报告错误
+    """
+    ntbs = len(tbs)
+    tb_pos: Dict[TB, int] = {tb: t for t, tb in enumerate(tbs)}
+    index: Dict[Step, int] = {}
+    pending: Dict[Step, int] = {}
+    waiters: Dict[Step, List[Step]] = {}
+    for tb in tbs:
+        for i, step in enumerate(tb.steps):
+            index[step] = i
+    for tb in tbs:
+        for step in tb.steps:
+            count = 0
+            for dep_step in step.dep_list:
+                if dep_step in index:
+                    count += 1
+                    waiters.setdefault(dep_step, []).append(step)
+            pending[step] = count
+
+    clocks: Dict[Step, Dict[int, int]] = {}  # 被依赖的step完成时的时钟（不含自身TB）
+    tb_clock: List[Dict[int, int]] = [{} for _ in tbs]  # 各TB最后处理的step的时钟
+    tb_shared = [False] * ntbs  # tb_clock[t]已作为某个step的时钟保存，修改前需要复制
+    cursor = [0] * ntbs
+    blocked: Dict[int, Step] = {}
+    ready = deque(range(ntbs))
+    removed_deps = removed_nops = 0
+
+    def reach(other: Step, pos: int) -> int:
+        # other完成时TB pos中必须已完成的最后一个位置
+        if tb_pos[other._tb] == pos:
+            return index[other]
+        return clocks[other].get(pos, -1)
+
+    while ready:
+        t = ready.popleft()
+        steps = tbs[t].steps
+        clock = tb_clock[t]
+        shared = tb_shared[t]
+        i = cursor[t]
+        while i < len(steps):
+            step = steps[i]
+            if pending[step] > 0:
+                blocked[t] = step
+                break
+            deps = [dep_step for dep_step in step.dep_list if dep_step in index]
+            if deps and not step.position_fixed:
+                kept = []
+                for dep_step in deps:
+                    pos, i_dep = tb_pos[dep_step._tb], index[dep_step]
+                    # 同一TB中较早的step由程序顺序保证
+                    ordered = i_dep < i if pos == t else clock.get(pos, -1) >= i_dep
+                    if ordered or any(other is not dep_step and reach(other, pos) >= i_dep for other in deps):
+                        dep_step.depended_by_list.discard(step)
+                        if not dep_step.depended_by_list:
+                            dep_step.hasdep = 0
+                        continue
+                    kept.append(dep_step)
+                if len(kept) < len(deps):
+                    removed_deps += len(deps) - len(kept)
+                    removed_nops += len(deps) - 1 - max(len(kept) - 1, 0)
+                    step.dep_list = StepSet(kept)
+                    deps = kept
+            for dep_step in deps:
+                if shared:
+                    clock = dict(clock)
+                    shared = False
+                for pos, value in clocks[dep_step].items():
+                    if value > clock.get(pos, -1):
+                        clock[pos] = value
+                pos = tb_pos[dep_step._tb]
+                if index[dep_step] > clock.get(pos, -1):
+                    clock[pos] = index[dep_step]
+            if step in waiters:
+                clocks[step] = clock
+                shared = True
+                for waiter in waiters.pop(step):
+                    pending[waiter] -= 1
+                    w = tb_pos[waiter._tb]
+                    if pending[waiter] == 0 and blocked.get(w) is waiter:
+                        del blocked[w]
+                        ready.append(w)
+            i += 1
+        tb_clock[t], tb_shared[t] = clock, shared
+        cursor[t] = i
+    return removed_deps, removed_nops
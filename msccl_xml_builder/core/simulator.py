@@ -0,0 +1,225 @@
+"""
+构建后算法的离散事件性能模拟
+
+每个TB是一个顺序执行的程序；step在满足以下条件后开始执行：
+- TB内的前一个step已完成
+- depid/deps指向的step已完成
+- 接收类step：连接(发送rank, 接收rank, chan)上序号为recv_index的数据已到达
+- 发送类step：连接上的未消费数据少于slots个（接收方已完成第send_index - slots个接收）
+
+耗时按alpha-beta模型计算：发送类step的数据传输为alpha + bytes/bw，按发送方和接收方
+是否在同一节点选择节点内/节点间参数；接收、拷贝和reduce的本地处理为local_alpha + bytes/local_bw；
+同时接收和发送的step（rcs/rrs/rrcs）为两者之和，overlap_forwarding=True时按一次读入即转发、
+本地处理与传输重叠取两者的较大值；nop不耗时。各连接独立建模，不考虑共享链路的带宽竞争。
+
+事件堆按时间顺序处理TB的唤醒事件：阻塞的TB登记在它等待的事件上，事件发生时重新入堆，
+每个step只被执行一次，可用于数千rank的算法。
+"""
+import copy
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from .program import TBProgram, algo_programs
+
+
+class CostModel:
+    """alpha-beta代价模型，时间单位为微秒(us)，带宽单位为GB/s"""
+
+    def __init__(self, chunk_bytes: int = 1 << 20, gpus_per_node: Optional[int] = None,
+                 intra_alpha: float = 1.0, intra_bw: float = 100.0,
+                 inter_alpha: float = 5.0, inter_bw: float = 12.5,
+                 local_alpha: float = 0.5, local_bw: float = 500.0, slots: int = 8,
+                 overlap_forwarding: bool = False):
+        """
+        chunk_bytes: 每个chunk的字节数，step的数据量为cnt * chunk_bytes；流水线切分后（Algo.chunk_scale > 1）
+                     指切分前的chunk，模拟时按scaled(chunk_scale)换算为XML中的chunk
+        gpus_per_node: 每个节点的GPU数，rank // gpus_per_node相同的两个GPU走节点内链路；None表示单节点
+        slots: 每个连接可缓存的未接收消息数（对应运行时每个连接的缓冲槽位）
+        overlap_forwarding: 同时接收和发送的step的本地处理与传输重叠（取较大值而非求和）
+        """
+        if slots < 1:
+            raise ValueError(f"slots must be at least 1, got {slots}")
+        self.chunk_bytes = chunk_bytes
+        self.gpus_per_node = gpus_per_node
+        self.intra_alpha = intra_alpha
+        self.intra_bw = intra_bw
+        self.inter_alpha = inter_alpha
+        self.inter_bw = inter_bw
+        self.local_alpha = local_alpha
+        self.local_bw = local_bw
+        self.slots = slots
+        self.overlap_forwarding = overlap_forwarding
+
+    def scaled(self, chunk_scale: int) -> 'CostModel':
+        """XML中的一个chunk为chunk_bytes / chunk_scale字节的模型，chunk_scale为1时返回自身"""
+        if chunk_scale == 1:
+            return self
+        model = copy.copy(self)
+        model.chunk_bytes = self.chunk_bytes / chunk_scale
+        return model
+
+    def is_intra_node(self, src: int, dst: int) -> bool:
+        if self.gpus_per_node is None:
+            return True
+        return src // self.gpus_per_node == dst // self.gpus_per_node
+
+    def link_time(self, src: int, dst: int, cnt: int) -> float:
+        """src向dst传输cnt个chunk的耗时"""
+        nbytes = cnt * self.chunk_bytes
+        if self.is_intra_node(src, dst):
+            return self.intra_alpha + nbytes / (self.intra_bw * 1e3)
+        return self.inter_alpha + nbytes / (self.inter_bw * 1e3)
+
+    def local_time(self, cnt: int) -> float:
+        """本地处理cnt个chunk（拷贝/接收/reduce）的耗时"""
+        return self.local_alpha + cnt * self.chunk_bytes / (self.local_bw * 1e3)
+
+    def step_time(self, program: TBProgram, s: int) -> float:
+        """program第s个step的耗时：发送类为链路传输，接收类与其他非nop step为本地处理，同时接收和发送时见overlap_forwarding"""
+        cnt = program.cnt[s]
+        if program.send_index[s] >= 0:
+            duration = self.link_time(program.gpu, program.send, cnt)
+            if program.recv_index[s] >= 0:
+                local = self.local_time(cnt)
+                duration = max(duration, local) if self.overlap_forwarding else duration + local
+            return duration
+        if program.type[s] == "nop":
+            return 0.0
+        return self.local_time(cnt)
+
+
+class SimulationResult:
+    """模拟结果，时间单位为微秒"""
+
+    def __init__(self, coll: str, name: str, gpu_times: List[float], tb_times: List[List[float]],
+                 nsteps: int, nevents: int):
+        self.coll = coll
+        self.name = name
+        # gpu_times[g] = GPU g最后一个step的完成时间；tb_times[g][tb] = 各TB的完成时间
+        self.gpu_times = gpu_times
+        self.tb_times = tb_times
+        self.nsteps = nsteps
+        self.nevents = nevents
+        # 整个集合通信的完成时间
+        self.time = max(gpu_times, default=0.0)
+
+    @property
+    def slowest_gpu(self) -> int:
+        return max(range(len(self.gpu_times)), key=self.gpu_times.__getitem__, default=-1)
+
+    def summary(self) -> str:
+        lines = [f"{self.coll} '{self.name}': {self.time:.3f} us "
+                 f"({len(self.gpu_times)} GPUs, {self.nsteps} steps, {self.nevents} events)"]
+        if self.gpu_times:
+            gpu = self.slowest_gpu
+            tb_times = self.tb_times[gpu]
+            tb = max(range(len(tb_times)), key=tb_times.__getitem__)
+            lines.append(f"slowest: gpu {gpu} ({self.gpu_times[gpu]:.3f} us), tb {tb}; "
+                         f"fastest gpu finishes at {min(self.gpu_times):.3f} us")
+        return "\n".join(lines)
+
+
+def _connections(programs: List[TBProgram]) -> Tuple[List[int], List[int]]:
+    """为每个TB的发送/接收端分配连接编号，连接以(发送rank, 接收rank, chan)标识"""
+    conn_ids: Dict[Tuple[int, int, int], int] = {}
+    send_conn, recv_conn = [], []
+    for program in programs:
+        send_key = (program.gpu, program.send, program.chan)
+        recv_key = (program.recv, program.gpu, program.chan)
+        send_conn.append(conn_ids.setdefault(send_key, len(conn_ids)) if program.send >= 0 else -1)
+        recv_conn.append(conn_ids.setdefault(recv_key, len(conn_ids)) if program.recv >= 0 else -1)
+    return send_conn, recv_conn
+
+
+def simulate(algo, model: Optional[CostModel] = None) -> SimulationResult:
+    """
+    模拟构建后的算法（依赖取自depid/deps），返回各GPU和整个集合通信的预计完成时间
+    存在无法继续执行的TB（死锁或依赖/配对缺失）时抛出RuntimeError
+    """
+    if model is None:
+        model = CostModel()
+    model = model.scaled(algo.chunk_scale)
+    gpu_programs = algo_programs(algo)
+    programs = [program for tbs in gpu_programs for program in tbs]
+    tb_base = []  # tb_base[g] = GPU g的第一个TB在programs中的位置
+    ntbs = 0
+    for tbs in gpu_programs:
+        tb_base.append(ntbs)
+        ntbs += len(tbs)
+    send_conn, recv_conn = _connections(programs)
+    slots = model.slots
+
+    finish: List[List[Optional[float]]] = [[None] * len(program) for program in programs]
+    pc = [0] * len(programs)       # 每个TB下一个待执行step
+    clock = [0.0] * len(programs)  # 每个TB上一个step的完成时间
+    arrival: Dict[Tuple[int, int], float] = {}   # (连接, 序号) -> 数据到达时间
+    consumed: Dict[Tuple[int, int], float] = {}  # (连接, 序号) -> 接收完成时间
+    # 等待的事件 -> 阻塞在该事件上的TB；事件为(0, tb, s)依赖完成、(1, 连接, 序号)数据到达、(2, 连接, 序号)接收完成
+    waiters: Dict[Tuple[int, int, int], List[int]] = {}
+    heap = [(0.0, i) for i, program in enumerate(programs) if len(program)]
+    heapq.heapify(heap)
+    nevents = 0
+
+    def wake(event: Tuple[int, int, int], time: float) -> None:
+        for waiter in waiters.pop(event, ()):
+            heapq.heappush(heap, (max(time, clock[waiter]), waiter))
+
+    while heap:
+        _, i = heapq.heappop(heap)
+        nevents += 1
+        program = programs[i]
+        s = pc[i]
+        ready = clock[i]
+
+        depid = program.depid[s]
+        if depid >= 0:
+            j = tb_base[program.gpu] + depid
+            deps = program.deps[s]
+            if depid >= len(gpu_programs[program.gpu]) or not 0 <= deps < len(programs[j]):
+                raise ValueError(f"{program.describe(s)}: depid={depid} deps={deps} does not refer to a step")
+            dep_time = finish[j][deps]
+            if dep_time is None:
+                waiters.setdefault((0, j, deps), []).append(i)
+                continue
+            ready = max(ready, dep_time)
+
+        recv_index, send_index = program.recv_index[s], program.send_index[s]
+        if recv_index >= 0:
+            event = (1, recv_conn[i], recv_index)
+            arrived = arrival.get(event[1:])
+            if arrived is None:
+                waiters.setdefault(event, []).append(i)
+                continue
+            ready = max(ready, arrived)
+        if send_index >= slots:
+            event = (2, send_conn[i], send_index - slots)
+            freed = consumed.get(event[1:])
+            if freed is None:
+                waiters.setdefault(event, []).append(i)
+                continue
+            ready = max(ready, freed)
+
+        done = ready + model.step_time(program, s)
+        finish[i][s] = done
+        clock[i] = done
+        pc[i] = s + 1
+        wake((0, i, s), done)
+        if recv_index >= 0:
+            consumed[(recv_conn[i], recv_index)] = done
+            wake((2, recv_conn[i], recv_index), done)
+        if send_index >= 0:
+            arrival[(send_conn[i], send_index)] = done
+            wake((1, send_conn[i], send_index), done)
+        if pc[i] < len(program):
+            heapq.heappush(heap, (done, i))
+
+    blocked = [i for i, program in enumerate(programs) if pc[i] < len(program)]
+    if blocked:
+        from .deadlock import check_programs
+        report = check_programs(gpu_programs, slots)
+        raise RuntimeError(f"Simulation stalled with {len(blocked)} blocked TBs\n{report.summary()}")
+
+    tb_times = [[clock[tb_base[g] + k] for k in range(len(tbs))] for g, tbs in enumerate(gpu_programs)]
+    gpu_times = [max(times, default=0.0) for times in tb_times]
+    return SimulationResult(algo.coll, algo.name, gpu_times, tb_times,
+                            sum(len(program) for program in programs), nevents)
@@ -0,0 +1,279 @@
+"""
+Algo的二进制快照
+
+Algo.save_snapshot把各GPU的step按StepTable的列（见columnar.py）原样写入单个文件，
+Algo.load_snapshot直接读回列，无需重新运行生成脚本和依赖构建；对象模式的Algo
+保存时先逐GPU转换为列，读取时可以还原为对象模型或列存模式。
+
+文件格式（版本1）：
+    magic(8字节) + version(uint32) + 填充至16字节
+    各GPU的列数据块，按8字节对齐，字节序与写入机器相同
+    索引：UTF-8 JSON，记录Algo属性、各GPU的TB及其最大buffer深度、字符串驻留表以及各列的(偏移, 字节数)
+    尾部：索引偏移(uint64) + 索引长度(uint64) + magic
+索引放在文件末尾，写入时可以逐个GPU流式输出（rank模板逐个展开），内存占用与单个GPU相当。
+列数据按8字节对齐，mmap=True时各列直接是映射内存上的只读memoryview，适合只读分析。
+mmap加载不能再添加step，TB只需要最大buffer深度，直接从索引恢复而不逐行访问列数据，加载时间
+与TB数成正比、与各TB的step数无关；普通读取复制各列时逐行统计完整的buffer深度。
+"""
+import json
+import struct
+import sys
+from array import array
+from mmap import mmap as MemoryMap, ACCESS_READ
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from .columnar import StepTable, StepRef, _COLUMNS, _EDGE_COLUMNS, decode_ref, encode_ref
+from .gpu import GPU
+from .step import Step
+from .tb import TB
+
+SNAPSHOT_MAGIC = b"MSCCLSNP"
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct("<8sI4x")
+_TRAILER = struct.Struct("<QQ8s")
+_ALIGN = 8
+# 快照中保存的StepTable列（tb_len也是列，便于整体映射）
+_SNAPSHOT_COLUMNS = _COLUMNS + _EDGE_COLUMNS + (("tb_len", "i"),)
+_ALGO_FIELDS = ("name", "proto", "nchannels", "nchunksperloop", "ngpus", "coll",
+                "inplace", "outofplace", "minBytes", "maxBytes", "storage")
+# 构造之后设置的Algo属性（旧快照中没有时保持构造时的默认值）
+_ALGO_STATE = ("chunk_scale",)
+
+
+class _ObjectRows:
+    """
+    对象模式下step -> 快照行号的索引，按需为各GPU建立
+    被合并进rcs的send/recv（其他GPU上的peer仍指向它们）映射到rcs所在行，与列存构建一致
+    """
+
+    def __init__(self, gpus):
+        self.gpus = gpus
+        # gpu_id -> (rows[step] = 行号, merged[被合并step的peer] = rcs行号)
+        self._index: Dict[int, Tuple[Dict[Step, int], Dict[Step, int]]] = {}
+
+    def index(self, gpu: GPU) -> Tuple[Dict[Step, int], Dict[Step, int]]:
+        index = self._index.get(gpu.id)
+        if index is None:
+            rows, merged = {}, {}
+            for tb in gpu.tbs:
+                for step in tb.steps:
+                    rows[step] = len(rows)
+                    if step.type == "rcs":
+                        for peer in (step.send_peer, step.recv_peer):
+                            if peer is not None:
+                                merged[peer] = rows[step]
+            index = self._index[gpu.id] = (rows, merged)
+        return index
+
+    def encode(self, gpu_id: int, step: Optional[Step]) -> int:
+        """peer引用编码为(gpu_id << 32) | row，找不到时为-1"""
+        if step is None:
+            return -1
+        rows, merged = self.index(self.gpus[gpu_id])
+        row = rows.get(step)
+        if row is None and step.peer_step is not None:
+            row = merged.get(step.peer_step)
+        return -1 if row is None else encode_ref(gpu_id, row)
+
+    def clear(self) -> None:
+        self._index.clear()
+
+
+def _table_from_gpu(gpu: GPU, rows: _ObjectRows) -> Tuple[StepTable, bool]:
+    """将对象模式的GPU转换为StepTable，返回(表, 是否已构建依赖)"""
+    table = StepTable(gpu.id)
+    built = False
+    for tb in gpu.tbs:
+        for step in tb.steps:
+            table.append(tb.id, step.type, step.srcbuf, step.srcoff, step.dstbuf, step.dstoff, step.cnt,
+                         step.depid, step.deps, step.hasdep, step.send_index, step.recv_index)
+            built = built or step.position_fixed
+    own_rows, _ = rows.index(gpu)
+    for step, row in own_rows.items():
+        # peer所在的GPU由所在TB的send/recv确定
+        tb = step._tb
+        if step.type == "rcs":
+            table.peer[row] = rows.encode(tb.send, step.send_peer)
+            table.recv_peer[row] = rows.encode(tb.recv, step.recv_peer)
+        elif step.peer_step is not None:
+            table.peer[row] = rows.encode(tb.send if step.type == "s" else tb.recv, step.peer_step)
+        for dep_step in step.dep_list:
+            dep_row = own_rows.get(dep_step)
+            if dep_row is not None:
+                table.link_dep(row, dep_row)
+    table.built = built
+    return table, built
+
+
+def _write_padding(f: BinaryIO, offset: int) -> int:
+    pad = -offset % _ALIGN
+    f.write(b"\0" * pad)
+    return offset + pad
+
+
+def save_snapshot(algo, filename: str) -> None:
+    """将algo写入快照文件（rank模板逐个展开写入）"""
+    from .template import RankTemplate
+    templated = isinstance(algo.gpus, RankTemplate)
+    rows = _ObjectRows(algo.gpus)
+    gpu_entries = []
+    with open(filename, "wb") as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+        offset = _HEADER.size
+        for gpu in algo.gpus:
+            if gpu.table is not None:
+                table, built = gpu.table, gpu.table.built
+            else:
+                table, built = _table_from_gpu(gpu, rows)
+                if templated:
+                    rows.clear()
+            columns = {}
+            for name, _ in _SNAPSHOT_COLUMNS:
+                data = memoryview(getattr(table, name))
+                columns[name] = [offset, data.nbytes]
+                f.write(data)
+                offset = _write_padding(f, offset + data.nbytes)
+            gpu_entries.append({
+                "id": gpu.id,
+                "built": built,
+                "names": table.names,
+                "tbs": [[tb.send, tb.recv, tb.chan, tb.send_index, tb.recv_index] for tb in gpu.tbs],
+                "extents": [list(tb.buffer_extents) for tb in gpu.tbs],
+                "columns": columns,
+            })
+
+        index = {
+            "version": SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "itemsizes": {typecode: array(typecode).itemsize for typecode in "biq"},
+            "algo": {field: getattr(algo, field) for field in _ALGO_FIELDS + _ALGO_STATE},
+            "gpus": gpu_entries,
+        }
+        data = json.dumps(index, separators=(",", ":")).encode("utf-8")
+        f.write(data)
+        f.write(_TRAILER.pack(offset, len(data), SNAPSHOT_MAGIC))
+
+
+def _read_index(buffer: memoryview, filename: str) -> dict:
+    if len(buffer) < _HEADER.size + _TRAILER.size:
+        raise ValueError(f"{filename}: file is too small to be a snapshot")
+    magic, version = _HEADER.unpack_from(buffer, 0)
+    index_offset, index_size, end_magic = _TRAILER.unpack_from(buffer, len(buffer) - _TRAILER.size)
+    if magic != SNAPSHOT_MAGIC or end_magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{filename}: not an Algo snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"{filename}: unsupported snapshot version {version}, expected {SNAPSHOT_VERSION}")
+    index = json.loads(bytes(buffer[index_offset:index_offset + index_size]).decode("utf-8"))
+    for typecode, itemsize in index["itemsizes"].items():
+        if array(typecode).itemsize != itemsize:
+            raise ValueError(f"{filename}: array typecode '{typecode}' has itemsize {itemsize} in snapshot, "
+                             f"{array(typecode).itemsize} on this platform")
+    return index
+
+
+def _load_table(entry: dict, buffer: memoryview, mapped: bool, swap: bool) -> StepTable:
+    table = StepTable(entry["id"])
+    table.names = entry["names"]
+    table._codes = {name: code for code, name in enumerate(table.names)}
+    for name, typecode in _SNAPSHOT_COLUMNS:
+        offset, nbytes = entry["columns"][name]
+        data = buffer[offset:offset + nbytes]
+        if mapped:
+            column = data.cast(typecode)
+        else:
+            column = array(typecode)
+            column.frombytes(data)
+            if swap:
+                column.byteswap()
+        setattr(table, name, column)
+    table.built = entry["built"]
+    return table
+
+
+def _restore_tbs(gpu: GPU, entry: dict) -> List[TB]:
+    for send, recv, chan, send_index, recv_index in entry["tbs"]:
+        tb = TB(send=send, recv=recv, chan=chan)
+        gpu.add_tb(tb)
+        tb.send_index, tb.recv_index = send_index, recv_index
+    return gpu.tbs
+
+
+def load_snapshot(filename: str, storage: Optional[str] = None, mmap: bool = False):
+    """
+    从快照文件恢复Algo
+    storage: "object"/"columnar"，为None时与保存时相同（rank模板保存为对象模式）
+    mmap: 以只读方式映射文件，各列为映射内存上的memoryview（要求storage为"columnar"）；
+          可以分析、输出XML或重新构建依赖，但不能再添加step
+    """
+    from .algo import Algo
+    with open(filename, "rb") as f:
+        if mmap:
+            buffer = memoryview(MemoryMap(f.fileno(), 0, access=ACCESS_READ))
+        else:
+            buffer = memoryview(f.read())
+    index = _read_index(buffer, filename)
+
+    attrs = dict(index["algo"])
+    if storage is None:
+        storage = attrs["storage"]
+    attrs["storage"] = storage
+    swap = index["byteorder"] != sys.byteorder
+    if mmap and storage != "columnar":
+        raise ValueError("mmap=True requires storage='columnar'")
+    if mmap and swap:
+        raise ValueError(f"{filename}: cannot map a {index['byteorder']}-endian snapshot on this machine")
+
+    state = {field: attrs.pop(field) for field in _ALGO_STATE if field in attrs}
+    algo = Algo(**attrs)
+    for field, value in state.items():
+        setattr(algo, field, value)
+    algo.gpus = []
+    tables = []
+    for entry in index["gpus"]:
+        gpu = GPU(entry["id"])
+        _restore_tbs(gpu, entry)
+        tables.append(_load_table(entry, buffer, mmap, swap))
+        algo.gpus.append(gpu)
+
+    if storage == "columnar":
+        for gpu, table, entry in zip(algo.gpus, tables, index["gpus"]):
+            gpu.table = table
+            if mmap and "extents" in entry:
+                # 只读映射：不再添加或修改step，不需要逐个结束位置的计数
+                for tb, extents in zip(gpu.tbs, entry["extents"]):
+                    tb._buffer_max = dict(zip("ios", extents))
+            else:
+                for row in range(len(table)):
+                    gpu.tbs[table.tb[row]].track_step_extents(StepRef(algo, gpu, row))
+        return algo
+
+    # 对象模式：先展开所有GPU，再把编码后的peer引用解析为Step对象
+    gpu_steps = []
+    for gpu, table, entry in zip(algo.gpus, tables, index["gpus"]):
+        tbs, steps = table.to_objects([(tb.id, tb.send, tb.recv, tb.chan) for tb in gpu.tbs])
+        for tb, restored in zip(gpu.tbs, tbs):
+            tb.steps = restored.steps
+            for step in tb.steps:
+                step._tb = tb
+            tb._buffer_ends, tb._buffer_max = restored._buffer_ends, restored._buffer_max
+        for step in steps:
+            step.position_fixed = entry["built"]
+            if entry["built"]:
+                step._gpu_id = gpu.id
+        gpu_steps.append(steps)
+
+    def resolve(ref: Optional[int]) -> Optional[Step]:
+        if ref is None:
+            return None
+        gpu_id, row = decode_ref(ref)
+        return gpu_steps[gpu_id][row]
+
+    for steps in gpu_steps:
+        for step in steps:
+            if step.type == "rcs":
+                step.send_peer = resolve(step.send_peer)
+                step.recv_peer = resolve(step.recv_peer)
+            else:
+                step.peer_step = resolve(step.peer_step)
+    return algo
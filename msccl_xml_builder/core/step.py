@@ -1,7 +1,111 @@
 import xml.etree.ElementTree as ET
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+from .xml_writer import format_start_tag
+
+class StepSet:
+    """
+    按插入顺序保存step的集合，用于dep_list/depended_by_list
+    提供与list相同的常用接口，但成员判断、添加、删除均为O(1)，迭代顺序确定
+    """
+    __slots__ = ("_items",)
+    
+    def __init__(self, steps: Iterable['Step'] = ()):
+        self._items = dict.fromkeys(steps)
+    
+    def append(self, step: 'Step') -> None:
+        """添加step，已存在时保持原有位置"""
+        self._items[step] = None
+    
+    def remove(self, step: 'Step') -> None:
+        try:
+            del self._items[step]
+        except KeyError:
+            raise ValueError("step not in StepSet") from None
+    
+    def discard(self, step: 'Step') -> None:
+        self._items.pop(step, None)
+    
+    def clear(self) -> None:
+        self._items.clear()
+    
+    def copy(self) -> 'StepSet':
+        return StepSet(self._items)
+    
+    def __contains__(self, step: object) -> bool:
+        return step in self._items
+    
+    def __iter__(self) -> Iterator['Step']:
+        return iter(self._items)
+    
+    def __reversed__(self) -> Iterator['Step']:
+        return reversed(self._items)
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    def __getitem__(self, index: Union[int, slice]):
+        # 首尾元素是最常用的访问方式，无需展开整个集合
+        if index == 0 and self._items:
+            return next(iter(self._items))
+        if index == -1 and self._items:
+            return next(reversed(self._items))
+        return list(self._items)[index]
+    
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, StepSet):
+            return list(self._items) == list(other._items)
+        if isinstance(other, list):
+            return list(self._items) == other
+        return NotImplemented
+    
+    def __repr__(self) -> str:
+        return f"StepSet({list(self._items)!r})"
+
+_EMPTY_ITEMS: dict = {}
+
+class _UnallocatedStepSet(StepSet):
+    """
+    尚未分配的空StepSet视图：读取时表现为空集合，不占用step的内存；
+    第一次添加元素时才为所属step分配真正的StepSet
+    """
+    __slots__ = ("_owner", "_slot")
+    
+    def __init__(self, owner: 'Step', slot: str):
+        self._items = _EMPTY_ITEMS
+        self._owner = owner
+        self._slot = slot
+    
+    def append(self, step: 'Step') -> None:
+        if self._items is _EMPTY_ITEMS:
+            allocated = getattr(self._owner, self._slot)
+            if allocated is None:  # 同一step的其他视图可能已经分配
+                allocated = StepSet()
+                setattr(self._owner, self._slot, allocated)
+            self._items = allocated._items
+        self._items[step] = None
+    
+    def discard(self, step: 'Step') -> None:
+        if self._items is not _EMPTY_ITEMS:
+            self._items.pop(step, None)
+    
+    def clear(self) -> None:
+        if self._items is not _EMPTY_ITEMS:
+            self._items.clear()
 
 class Step:
+    """
+    单个原子操作
+    
+    使用__slots__保存全部字段（不创建实例__dict__），dep_list/depended_by_list
+    在第一次添加元素前不分配容器。每个Step对象本身为一个固定大小的slot数组，
+    内存预算见benchmarks/bench_step_memory.py（STEP_BYTE_BUDGET）。
+    """
+    __slots__ = ("s", "type", "srcbuf", "srcoff", "dstbuf", "dstoff", "cnt",
+                 "depid", "deps", "hasdep",
+                 "send_index", "recv_index", "peer_step", "send_peer", "recv_peer",
+                 "_dep_list", "_depended_by_list", "position_fixed", "original_index",
+                 "_tb", "_gpu_id")
+    
     def __init__(self, s: Optional[int] = None, type: str = "nop", srcbuf: str = "i", 
                  srcoff: int = -1, dstbuf: str = "o", dstoff: int = -1, cnt: int = 0,
                  depid: int = -1, deps: int = -1, hasdep: int = 0):
@@ -23,12 +127,34 @@ class Step:
         self.send_peer: Optional['Step'] = None  # for rcs
         self.recv_peer: Optional['Step'] = None  # for rcs
         
-        # 新增依赖管理字段
-        self.dep_list: List['Step'] = []  # 依赖的step列表
-        self.depended_by_list: List['Step'] = []  # 被依赖的step列表（新添加）
+        # 新增依赖管理字段（按插入顺序的集合，见StepSet），首次添加元素时才分配
+        self._dep_list: Optional[StepSet] = None  # 依赖的step列表
+        self._depended_by_list: Optional[StepSet] = None  # 被依赖的step列表（新添加）
 
         self.position_fixed: bool = False  # 位置是否固定
         self.original_index: Optional[int] = None  # 保存原始插入顺序
+        
+        # 所属TB和GPU，由TB.add_step和GPU.build_dependencies设置
+        self._tb = None
+        self._gpu_id: int = -1
+    
+    @property
+    def dep_list(self) -> StepSet:
+        deps = self._dep_list
+        return deps if deps is not None else _UnallocatedStepSet(self, "_dep_list")
+    
+    @dep_list.setter
+    def dep_list(self, steps: Iterable['Step']) -> None:
+        self._dep_list = steps if isinstance(steps, StepSet) else StepSet(steps)
+    
+    @property
+    def depended_by_list(self) -> StepSet:
+        depended_by = self._depended_by_list
+        return depended_by if depended_by is not None else _UnallocatedStepSet(self, "_depended_by_list")
+    
+    @depended_by_list.setter
+    def depended_by_list(self, steps: Iterable['Step']) -> None:
+        self._depended_by_list = steps if isinstance(steps, StepSet) else StepSet(steps)
     
     def add_dep(self, dep_step: 'Step') -> None:
         """添加依赖关系"""
@@ -36,7 +162,9 @@ class Step:
         if self._get_gpu_id() != dep_step._get_gpu_id():
             raise ValueError("Cross-GPU dependency is not allowed")
         
-        if self._get_tb() == dep_step._get_tb():
+        # 等待assign_channels的step尚未加入TB，组内channel与固定channel不重叠，由assign_channels检查
+        tb = self._get_tb()
+        if tb is not None and tb is dep_step._get_tb():
             raise ValueError("Dependencies within the same TB should be managed by controlling step order manually")
         
         if dep_step not in self.dep_list:
@@ -58,24 +186,44 @@ class Step:
             if len(dep_step.depended_by_list) == 0:
                 dep_step.hasdep = 0
     
+    def buffer_ends(self) -> List[Tuple[str, int]]:
+        """该step访问的i/o/s buffer的结束位置列表[(buf, off+cnt)]，用于统计buffer深度"""
+        ends = []
+        if self.srcbuf in ("i", "o", "s") and self.srcoff >= 0:
+            ends.append((self.srcbuf, self.srcoff + self.cnt))
+        if self.dstbuf in ("i", "o", "s") and self.dstoff >= 0:
+            ends.append((self.dstbuf, self.dstoff + self.cnt))
+        return ends
+    
     def _get_gpu_id(self) -> int:
         """获取step所属的GPU ID"""
-        return getattr(self, '_gpu_id', -1)
+        return self._gpu_id
     
     def _get_tb(self):
         """获取step所属的TB"""
-        return getattr(self, '_tb', None)
+        return self._tb
+    
+    def xml_attrs(self) -> List[Tuple[str, str]]:
+        """<step>元素的属性列表（保持输出顺序）"""
+        return [
+            ("s", str(self.s)),
+            ("type", self.type),
+            ("srcbuf", self.srcbuf),
+            ("srcoff", str(self.srcoff)),
+            ("dstbuf", self.dstbuf),
+            ("dstoff", str(self.dstoff)),
+            ("cnt", str(self.cnt)),
+            ("depid", str(self.depid)),
+            ("deps", str(self.deps)),
+            ("hasdep", str(self.hasdep)),
+        ]
     
     def to_xml(self) -> ET.Element:
         step_elem = ET.Element("step")
-        step_elem.set("s", str(self.s))
-        step_elem.set("type", self.type)
-        step_elem.set("srcbuf", self.srcbuf)
-        step_elem.set("srcoff", str(self.srcoff))
-        step_elem.set("dstbuf", self.dstbuf)
-        step_elem.set("dstoff", str(self.dstoff))
-        step_elem.set("cnt", str(self.cnt))
-        step_elem.set("depid", str(self.depid))
-        step_elem.set("deps", str(self.deps))
-        step_elem.set("hasdep", str(self.hasdep))
-        return step_elem
\ No newline at end of file
+        for key, value in self.xml_attrs():
+            step_elem.set(key, value)
+        return step_elem
+    
+    def write_xml(self, f: TextIO, level: int = 3) -> None:
+        """将<step>元素直接写入文件句柄"""
+        f.write(format_start_tag("step", self.xml_attrs(), level, empty=True))
\ No newline at end of file
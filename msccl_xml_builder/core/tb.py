@@ -1,6 +1,11 @@
 import xml.etree.ElementTree as ET
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, TextIO, Tuple
 from .step import Step
+from .xml_writer import format_start_tag, format_end_tag
+
+# 占用send/recv index（即经过连接发送/接收数据）的step类型，包括MSCCL的reduce变体
+SEND_STEP_TYPES = ("s", "rcs", "rrs", "rrcs")
+RECV_STEP_TYPES = ("r", "rcs", "rrc", "rrs", "rrcs")
 
 class TB:
     def __init__(self, id: Optional[int] = None, send: int = -1, recv: int = -1, chan: int = 0):
@@ -13,6 +18,10 @@ class TB:
         # 索引维护
         self.send_index: int = 0
         self.recv_index: int = 0
+        
+        # buffer深度统计：_buffer_ends[buf][end] = 结束位置为end的访问次数，_buffer_max[buf] = 最大结束位置
+        self._buffer_ends: Dict[str, Dict[int, int]] = {"i": {}, "o": {}, "s": {}}
+        self._buffer_max: Dict[str, int] = {"i": 0, "o": 0, "s": 0}
     
     def get_next_step_id(self) -> int:
         return len(self.steps)
@@ -25,22 +34,65 @@ class TB:
         
         # 设置step的TB引用
         step._tb = self
-        step.original_index = len(self.steps)
+        step.original_index = step.s  # 与s共享同一个int对象
         
         # 根据step类型设置index
-        if step.type == "s":  # send
-            step.send_index = self.send_index
-            self.send_index += 1
-        elif step.type == "r":  # recv
-            step.recv_index = self.recv_index
-            self.recv_index += 1
-        elif step.type == "rcs":  # recv-copy-send
-            step.recv_index = self.recv_index
-            step.send_index = self.send_index
-            self.recv_index += 1
-            self.send_index += 1
+        send_index, recv_index = self.claim_indices(step.type)
+        if send_index is not None:
+            step.send_index = send_index
+        if recv_index is not None:
+            step.recv_index = recv_index
         
         self.steps.append(step)
+        self.track_step_extents(step)
+    
+    def claim_indices(self, step_type: str) -> Tuple[Optional[int], Optional[int]]:
+        """按step类型分配下一个(send_index, recv_index)，不涉及的index为None"""
+        send_index = recv_index = None
+        if step_type in SEND_STEP_TYPES:  # send / recv-copy-send
+            send_index = self.send_index
+            self.send_index += 1
+        if step_type in RECV_STEP_TYPES:  # recv / recv-copy-send
+            recv_index = self.recv_index
+            self.recv_index += 1
+        return send_index, recv_index
+    
+    def track_step_extents(self, step: Step) -> None:
+        """将step访问的buffer范围计入该TB的buffer深度统计"""
+        for buf, end in step.buffer_ends():
+            ends = self._buffer_ends[buf]
+            ends[end] = ends.get(end, 0) + 1
+            if end > self._buffer_max[buf]:
+                self._buffer_max[buf] = end
+    
+    def untrack_step_extents(self, step: Step) -> None:
+        """从buffer深度统计中移除step（step被移除或其buffer字段将被修改前调用）"""
+        for buf, end in step.buffer_ends():
+            ends = self._buffer_ends[buf]
+            ends[end] -= 1
+            if ends[end] == 0:
+                del ends[end]
+                if end == self._buffer_max[buf]:
+                    self._buffer_max[buf] = max(ends, default=0)
+    
+    def refresh_extents(self) -> None:
+        """按当前steps重新计算buffer深度统计（直接修改steps或step的buffer字段后调用）"""
+        for buf in self._buffer_ends:
+            self._buffer_ends[buf] = {}
+            self._buffer_max[buf] = 0
+        for step in self.steps:
+            self.track_step_extents(step)
+    
+    def scale_extents(self, factor: int) -> None:
+        """所有step的offset/cnt乘以factor后（chunk单位细分，见pipeline.py）同步缩放buffer深度统计"""
+        for buf, ends in self._buffer_ends.items():
+            self._buffer_ends[buf] = {end * factor: count for end, count in ends.items()}
+            self._buffer_max[buf] *= factor
+    
+    @property
+    def buffer_extents(self) -> Tuple[int, int, int]:
+        """该TB访问的各buffer的最大深度(i_chunks, o_chunks, s_chunks)"""
+        return self._buffer_max["i"], self._buffer_max["o"], self._buffer_max["s"]
     
     def sort_steps_by_index(self) -> None:
         """根据send/recv index对steps进行排序"""
@@ -62,59 +114,65 @@ class TB:
         for i, step in enumerate(self.steps):
             step.s = i
     
+    def make_nop_step(self, dep_step: Step) -> Step:
+        """创建一个依赖dep_step的nop step（尚未加入steps，s由调用方设置）"""
+        nop_step = Step(type="nop", srcbuf="i", srcoff=-1, dstbuf="o", dstoff=-1, cnt=0)
+        nop_step._tb = self
+        nop_step.position_fixed = True
+        nop_step.depid = dep_step._tb.id
+        nop_step.deps = dep_step.s
+        return nop_step
+    
     def insert_nop_step(self, position: int, dep_steps: List[Step]) -> Step:
         """在指定位置插入nop step(s)处理多个依赖"""
         if len(dep_steps) == 0:
             return None
         elif len(dep_steps) == 1:
             # 单个依赖，插入一个nop step
-            nop_step = Step(type="nop", srcbuf="i", srcoff=-1, dstbuf="o", dstoff=-1, cnt=0)
-            nop_step._tb = self
-            nop_step.position_fixed = True
-            nop_step.depid = dep_steps[0]._tb.id
-            nop_step.deps = dep_steps[0].s
-            
-            self.steps.insert(position, nop_step)
-            
-            # 重新设置后续steps的s字段
-            for i in range(position, len(self.steps)):
-                self.steps[i].s = i
-                
+            nop_step = self.make_nop_step(dep_steps[0])
+            self.insert_steps(position, [nop_step])
             return nop_step
         else:
             # 多个依赖，插入(len(dep_steps)-1)个nop steps
             # 最后一个依赖不插入nop，直接作为原始step的依赖
-            num_nops_to_insert = len(dep_steps) - 1
-            
-            # 插入前(len(dep_steps)-1)个nop steps
-            for i in range(num_nops_to_insert):
-                dep_step = dep_steps[i]
-                nop_step = Step(type="nop", srcbuf="i", srcoff=-1, dstbuf="o", dstoff=-1, cnt=0)
-                nop_step._tb = self
-                nop_step.position_fixed = True
-                
-                # 设置依赖关系
-                nop_step.depid = dep_step._tb.id
-                nop_step.deps = dep_step.s
-                
-                # 插入到正确位置
-                insert_pos = position + i
-                self.steps.insert(insert_pos, nop_step)
-            
-            # 重新设置所有steps的s字段
-            for i in range(len(self.steps)):
-                self.steps[i].s = i
-            
+            nop_steps = [self.make_nop_step(dep_step) for dep_step in dep_steps[:-1]]
+            self.insert_steps(position, nop_steps)
             return None
+    
+    def insert_steps(self, position: int, new_steps: List[Step]) -> None:
+        """在指定位置一次性插入多个step，并只对受影响的steps重新编号一次"""
+        self.steps[position:position] = new_steps
+        for i in range(position, len(self.steps)):
+            self.steps[i].s = i
+        for step in new_steps:
+            self.track_step_extents(step)
+    
+    def xml_attrs(self) -> List[Tuple[str, str]]:
+        """<tb>元素的属性列表（保持输出顺序）"""
+        return [
+            ("id", str(self.id)),
+            ("send", str(self.send)),
+            ("recv", str(self.recv)),
+            ("chan", str(self.chan)),
+        ]
         
     def to_xml(self) -> ET.Element:
         tb_elem = ET.Element("tb")
-        tb_elem.set("id", str(self.id))
-        tb_elem.set("send", str(self.send))
-        tb_elem.set("recv", str(self.recv))
-        tb_elem.set("chan", str(self.chan))
+        for key, value in self.xml_attrs():
+            tb_elem.set(key, value)
         
         for step in self.steps:
             tb_elem.append(step.to_xml())
         
-        return tb_elem
\ No newline at end of file
+        return tb_elem
+    
+    def write_xml(self, f: TextIO, level: int = 2) -> None:
+        """将<tb>元素及其所有step流式写入文件句柄"""
+        if not self.steps:
+            f.write(format_start_tag("tb", self.xml_attrs(), level, empty=True))
+            return
+        
+        f.write(format_start_tag("tb", self.xml_attrs(), level))
+        for step in self.steps:
+            step.write_xml(f, level + 1)
+        f.write(format_end_tag("tb", level))
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""
+rank对称的程序模板
+
+ring/mesh/tree allgather、两阶段alltoall等算法中，每个rank的程序只在rank置换和
+offset计算上不同。Algo.set_rank_template(program)只保存描述单个rank的函数
+program(ctx)，在输出XML时逐个rank展开为GPU、构建依赖、写出后即丢弃，
+内存占用与单个rank的程序大小相当，与rank数无关。
+"""
+from collections.abc import Sequence
+from typing import Callable, List, Optional, Tuple
+
+from .chunk import append_step, buf_name
+from .gpu import GPU
+from .step import Step
+from .tb import TB
+
+
+class RankContext:
+    """
+    展开模板时传给program的上下文，描述当前rank并提供只作用于该rank的操作
+    send/recv分别描述通信的一侧，对端rank的模板需要描述与之匹配的另一侧
+    """
+
+    def __init__(self, template: 'RankTemplate', gpu: GPU):
+        self.template = template
+        self.gpu = gpu
+        self.rank = gpu.id
+        self.ngpus = template.ngpus
+        self.gpus_per_node = template.gpus_per_node
+        self.node = self.rank // self.gpus_per_node
+        self.local_rank = self.rank % self.gpus_per_node
+        self.nnodes = self.ngpus // self.gpus_per_node
+
+    def global_rank(self, node: int, local_rank: int) -> int:
+        return node * self.gpus_per_node + local_rank
+
+    def add_tb(self, send: int = -1, recv: int = -1, chan: int = 0) -> TB:
+        """显式创建TB（用于控制TB的编号顺序）"""
+        tb = TB(send=send, recv=recv, chan=chan)
+        self.gpu.add_tb(tb)
+        return tb
+
+    def copy(self, srcbuf: str, srcoff: int, dstbuf: str, dstoff: int, cnt: int = 1, chan: int = 0,
+             dep_steps: Optional[List[Step]] = None, tb: Optional[TB] = None) -> Step:
+        """本rank内拷贝，对应Chunk.copy"""
+        if tb is None:
+            tb = self.gpu.find_tb(send=-1, recv=-1, chan=chan)
+        if tb is None:
+            tb = self.add_tb(-1, -1, chan)
+        return append_step(None, self.gpu, tb, dep_steps or [],
+                           type="cpy", srcbuf=buf_name(srcbuf), srcoff=srcoff,
+                           dstbuf=buf_name(dstbuf), dstoff=dstoff, cnt=cnt)
+
+    def send(self, dest_rank: int, srcbuf: str, srcoff: int, cnt: int = 1, chan: int = 0,
+             dep_steps: Optional[List[Step]] = None, bidirectional: bool = True,
+             dstbuf: str = "o", dstoff: int = -1) -> Step:
+        """
+        向dest_rank发送，对应Chunk.send
+        dstbuf/dstoff默认与Chunk.send相同；与copy_diff等价时传入接收方的buffer位置
+        """
+        tb = self.gpu.get_send_tb(dest_rank, chan, bidirectional)
+        return append_step(None, self.gpu, tb, dep_steps or [],
+                           type="s", srcbuf=buf_name(srcbuf), srcoff=srcoff,
+                           dstbuf=buf_name(dstbuf), dstoff=dstoff, cnt=cnt)
+
+    def recv(self, src_rank: int, dstbuf: str, dstoff: int, cnt: int = 1, chan: int = 0,
+             dep_steps: Optional[List[Step]] = None, bidirectional: bool = True,
+             srcbuf: str = "i", srcoff: int = -1) -> Step:
+        """
+        从src_rank接收，对应Chunk.recv
+        srcbuf/srcoff默认与Chunk.recv相同；与copy_diff等价时传入发送方的buffer位置
+        """
+        tb = self.gpu.get_recv_tb(src_rank, chan, bidirectional)
+        return append_step(None, self.gpu, tb, dep_steps or [],
+                           type="r", srcbuf=buf_name(srcbuf), srcoff=srcoff,
+                           dstbuf=buf_name(dstbuf), dstoff=dstoff, cnt=cnt)
+
+    def rcs(self, src_rank: int, dest_rank: int, srcbuf: str, srcoff: int, dstbuf: str, dstoff: int,
+            cnt: int = 1, chan: int = 0, dep_steps: Optional[List[Step]] = None) -> Step:
+        """本rank作为中转：从src_rank接收并发送到dest_rank，对应Chunk.rcs"""
+        if len({src_rank, dest_rank, self.rank}) != 3:
+            raise ValueError("RCS operation requires three different GPU ranks")
+        tb = self.gpu.find_tb(send=dest_rank, recv=src_rank, chan=chan)
+        if tb is None:
+            if self.gpu.find_tb(send=dest_rank, chan=chan):
+                raise ValueError(f"Channel {chan} already has send to rank {dest_rank}")
+            if self.gpu.find_tb(recv=src_rank, chan=chan):
+                raise ValueError(f"Channel {chan} already has recv from rank {src_rank}")
+            tb = self.add_tb(dest_rank, src_rank, chan)
+        return append_step(None, self.gpu, tb, dep_steps or [],
+                           type="rcs", srcbuf=buf_name(srcbuf), srcoff=srcoff,
+                           dstbuf=buf_name(dstbuf), dstoff=dstoff, cnt=cnt)
+
+
+class RankTemplate(Sequence):
+    """
+    按需展开的GPU序列：template[rank]每次调用program生成该rank的GPU，
+    若已调用build_all_dependencies则同时构建依赖。展开结果不缓存。
+    """
+
+    def __init__(self, program: Callable[[RankContext], None], ngpus: int, gpus_per_node: Optional[int] = None):
+        if gpus_per_node is None:
+            gpus_per_node = ngpus
+        if gpus_per_node <= 0 or ngpus % gpus_per_node != 0:
+            raise ValueError(f"ngpus={ngpus} is not a multiple of gpus_per_node={gpus_per_node}")
+        self.program = program
+        self.ngpus = ngpus
+        self.gpus_per_node = gpus_per_node
+        # (merge_rcs, sort, 依赖约简的报告或None)，为None时展开后不构建依赖
+        self.build_options: Optional[Tuple[bool, bool, object]] = None
+
+    def __len__(self) -> int:
+        return self.ngpus
+
+    def __getitem__(self, rank: int) -> GPU:
+        if isinstance(rank, slice):
+            return [self[r] for r in range(*rank.indices(self.ngpus))]
+        if rank < 0:
+            rank += self.ngpus
+        if not 0 <= rank < self.ngpus:
+            raise IndexError(f"GPU {rank} out of range")
+        return self.expand(rank)
+
+    def expand(self, rank: int) -> GPU:
+        """调用program生成rank的GPU，并按build_options构建依赖"""
+        gpu = GPU(rank)
+        self.program(RankContext(self, gpu))
+        if self.build_options is not None:
+            merge_rcs, sort, reduction = self.build_options
+            if sort:
+                gpu.sort_all_tb_steps()
+            if reduction is not None:
+                reduction.record(rank, gpu.reduce_dependencies())
+            gpu.build_dependencies(merge_rcs)
+        return gpu
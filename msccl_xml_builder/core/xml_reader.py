@@ -0,0 +1,249 @@
+"""
+流式读取MSCCL XML，重建Algo/GPU/TB/Step
+
+用ET.iterparse逐元素解析，每个step处理完即从树中清除，每个GPU解析完成后清空根元素，
+内存占用与重建出的对象相当，不保留DOM（storage="columnar"时每个GPU解析完即压缩为StepTable）。
+
+- depid/deps解析为同一GPU中的step；nop链（step之前连续的nop）上的依赖与step自身的
+  依赖一起合并为该step的dep_list，与build_all_dependencies展开nop前的形式一致
+- send/recv按连接配对：GPU g上send=d、chan=c的TB中第k个发送类step，与GPU d上recv=g、
+  chan=c的TB中第k个接收类step互为peer（rcs分别设置send_peer/recv_peer）
+"""
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple, Union
+
+from .columnar import encode_ref
+from .gpu import GPU
+from .step import Step
+from .tb import TB, SEND_STEP_TYPES, RECV_STEP_TYPES
+
+_INT_ALGO_ATTRS = ("nchannels", "nchunksperloop", "ngpus", "inplace", "outofplace", "minBytes", "maxBytes")
+_STR_ALGO_ATTRS = ("name", "proto", "coll")
+
+# 配对时step的句柄：对象模式为Step，列存模式为(gpu_id, row, 是否同时收发)
+_Handle = Union[Step, Tuple[int, int, bool]]
+
+
+def _is_relay(step_type: str) -> bool:
+    """同时接收和发送的step（rcs及其reduce变体），peer分别记录在recv_peer/send_peer"""
+    return step_type in SEND_STEP_TYPES and step_type in RECV_STEP_TYPES
+
+
+class _PeerMatcher:
+    """按(发送rank, 接收rank, chan, index)配对send/recv，未配对的一侧暂存到对端GPU解析完成"""
+
+    def __init__(self, algo):
+        self.algo = algo
+        self.pending: Dict[Tuple[int, int, int, int, bool], _Handle] = {}
+
+    def add(self, key: Tuple[int, int, int, int], handle: _Handle, sending: bool) -> None:
+        other = self.pending.pop(key + (not sending,), None)
+        if other is None:
+            self.pending[key + (sending,)] = handle
+            return
+        self._set_peer(handle, other, sending)
+        self._set_peer(other, handle, not sending)
+
+    def _set_peer(self, handle: _Handle, other: _Handle, sending: bool) -> None:
+        if isinstance(handle, Step):
+            if _is_relay(handle.type):
+                if sending:
+                    handle.send_peer = other
+                else:
+                    handle.recv_peer = other
+            else:
+                handle.peer_step = other
+            return
+        gpu_id, row, relay = handle
+        table = self.algo.gpus[gpu_id].table
+        column = table.recv_peer if relay and not sending else table.peer
+        column[row] = encode_ref(other[0], other[1])
+
+
+def _int_attr(elem: ET.Element, name: str, default: int = -1) -> int:
+    value = elem.get(name)
+    return default if value is None else int(value)
+
+
+def _new_algo(elem: ET.Element, storage: str):
+    from .algo import Algo
+    if "name" not in elem.attrib:
+        raise ValueError("<algo> element has no name attribute")
+    kwargs = {key: elem.get(key) for key in _STR_ALGO_ATTRS if key in elem.attrib}
+    kwargs.update((key, int(elem.get(key))) for key in _INT_ALGO_ATTRS if key in elem.attrib)
+    return Algo(storage=storage, **kwargs)
+
+
+def _new_step(elem: ET.Element) -> Step:
+    return Step(s=_int_attr(elem, "s", None), type=elem.get("type"),
+                srcbuf=elem.get("srcbuf"), srcoff=_int_attr(elem, "srcoff"),
+                dstbuf=elem.get("dstbuf"), dstoff=_int_attr(elem, "dstoff"),
+                cnt=_int_attr(elem, "cnt", 0), depid=_int_attr(elem, "depid"),
+                deps=_int_attr(elem, "deps"), hasdep=_int_attr(elem, "hasdep", 0))
+
+
+def _link(step: Step, dep_step: Step) -> None:
+    """添加依赖边（不修改hasdep，保留XML中的值）"""
+    if dep_step not in step.dep_list:
+        step.dep_list.append(dep_step)
+        dep_step.depended_by_list.append(step)
+
+
+def _dep_target(gpu: GPU, tb: TB, step: Step) -> Optional[Step]:
+    """depid/deps指向的step，无依赖时为None"""
+    if step.depid < 0:
+        return None
+    if step.depid < len(gpu.tbs) and 0 <= step.deps < len(gpu.tbs[step.depid].steps):
+        return gpu.tbs[step.depid].steps[step.deps]
+    raise ValueError(f"GPU {gpu.id} tb {tb.id} step {step.s}: depid={step.depid} deps={step.deps} "
+                     f"does not refer to a step")
+
+
+def _resolve_gpu(gpu: GPU, keep_nops: bool) -> None:
+    """
+    由depid/deps和nop链重建dep_list
+    keep_nops=True: 保留所有step及其depid/deps，step固定在原位置（与XML完全一致）
+    keep_nops=False: 去掉已合并进后续step的nop，清除depid/deps，得到依赖构建之前的形式
+    """
+    targets: Dict[Step, Step] = {}
+    folded = set()  # 已合并进后续step的nop
+    for tb in gpu.tbs:
+        chain: List[Step] = []
+        for step in tb.steps:
+            target = _dep_target(gpu, tb, step)
+            if target is not None:
+                targets[step] = target
+            if step.type == "nop":
+                chain.append(step)
+                continue
+            for nop_step in chain:
+                folded.add(nop_step)
+            chain.append(step)
+            for owner in chain:
+                dep_step = targets.get(owner)
+                if dep_step is not None:
+                    _link(step, dep_step)
+            chain = []
+        # TB末尾没有后续step的nop单独保留自己的依赖
+        for nop_step in chain:
+            dep_step = targets.get(nop_step)
+            if dep_step is not None:
+                _link(nop_step, dep_step)
+
+    if keep_nops:
+        for tb in gpu.tbs:
+            for step in tb.steps:
+                step.position_fixed = True
+                step._gpu_id = gpu.id
+        return
+
+    # 依赖于被去掉的nop等价于依赖nop的目标及其在TB内的前一个step
+    def effective(dep_step: Step) -> List[Step]:
+        if dep_step not in folded:
+            return [dep_step]
+        result = []
+        if dep_step in targets:
+            result.extend(effective(targets[dep_step]))
+        if dep_step.s > 0:
+            result.extend(effective(dep_step._tb.steps[dep_step.s - 1]))
+        return result
+
+    for tb in gpu.tbs:
+        for step in tb.steps:
+            if step not in folded and any(dep_step in folded for dep_step in step.dep_list):
+                dep_steps = [dep for dep_step in step.dep_list for dep in effective(dep_step)]
+                for dep_step in list(step.dep_list):
+                    step.remove_dep(dep_step)
+                for dep_step in dep_steps:
+                    _link(step, dep_step)
+    for tb in gpu.tbs:
+        tb.steps = [step for step in tb.steps if step not in folded]
+        for i, step in enumerate(tb.steps):
+            step.s = step.original_index = i
+            step.depid = step.deps = -1
+    for tb in gpu.tbs:
+        for step in tb.steps:
+            step.hasdep = 1 if step.depended_by_list else 0
+
+
+def _finish_gpu(algo, gpu: GPU, keep_nops: bool, matcher: _PeerMatcher) -> None:
+    """GPU解析完成：重建依赖，登记send/recv配对，列存模式下压缩为StepTable"""
+    _resolve_gpu(gpu, keep_nops)
+    table = gpu.table
+    rows: Dict[Step, int] = {}
+    for tb in gpu.tbs:
+        for step in tb.steps:
+            if table is not None:
+                rows[step] = table.append(tb.id, step.type, step.srcbuf, step.srcoff, step.dstbuf, step.dstoff,
+                                          step.cnt, step.depid, step.deps, step.hasdep,
+                                          step.send_index, step.recv_index)
+                handle = (gpu.id, rows[step], _is_relay(step.type))
+            else:
+                handle = step
+            if step.type in SEND_STEP_TYPES:
+                matcher.add((gpu.id, tb.send, tb.chan, step.send_index), handle, True)
+            if step.type in RECV_STEP_TYPES:
+                matcher.add((tb.recv, gpu.id, tb.chan, step.recv_index), handle, False)
+
+    if table is not None:
+        for step, row in rows.items():
+            for dep_step in step.dep_list:
+                table.link_dep(row, rows[dep_step])
+        table.built = keep_nops
+        for tb in gpu.tbs:
+            tb.steps = []
+
+
+def read_xml(source, storage: str = "object", keep_nops: bool = True):
+    """
+    流式读取MSCCL XML文件（路径或二进制文件对象），返回Algo
+    storage: "object"或"columnar"
+    keep_nops: 见_resolve_gpu；为False时可以修改后重新调用build_all_dependencies
+    """
+    algo = None
+    root = gpu = tb = None
+    gpu_elem = tb_elem = None
+    matcher = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == "step":
+                if tb is None:
+                    raise ValueError("<step> element outside of <tb>")
+                tb.add_step(_new_step(elem))
+            elif tag == "tb":
+                tb_elem = elem
+                if gpu is None:
+                    raise ValueError("<tb> element outside of <gpu>")
+                tb = TB(id=_int_attr(elem, "id", None), send=_int_attr(elem, "send"),
+                        recv=_int_attr(elem, "recv"), chan=_int_attr(elem, "chan", 0))
+                gpu.add_tb(tb)
+            elif tag == "gpu":
+                if algo is None:
+                    raise ValueError("<gpu> element outside of <algo>")
+                gpu_id = _int_attr(elem, "id")
+                if not 0 <= gpu_id < algo.ngpus:
+                    raise ValueError(f"GPU id {gpu_id} out of range for ngpus={algo.ngpus}")
+                gpu = algo.gpus[gpu_id]
+                gpu_elem = elem
+                if gpu.tbs:
+                    raise ValueError(f"Duplicate <gpu id=\"{gpu_id}\">")
+            elif tag == "algo":
+                algo = _new_algo(elem, storage)
+                matcher = _PeerMatcher(algo)
+                root = elem
+            continue
+
+        # end事件：已处理的元素立即从树中移除
+        if tag == "step":
+            tb_elem.clear()
+        elif tag == "tb":
+            tb = None
+            gpu_elem.clear()
+        elif tag == "gpu":
+            _finish_gpu(algo, gpu, keep_nops, matcher)
+            gpu = None
+            root.clear()
+    if algo is None:
+        raise ValueError("No <algo> element found")
+    return algo
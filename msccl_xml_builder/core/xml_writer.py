@@ -0,0 +1,24 @@
+"""流式XML输出的辅助函数，输出格式与ElementTree+minidom的pretty-print结果逐字节一致"""
+from typing import List, Tuple
+
+INDENT = "  "
+
+
+def escape_attr(value: str) -> str:
+    """按minidom的规则转义属性值"""
+    return (value.replace("&", "&amp;").replace("<", "&lt;")
+            .replace("\"", "&quot;").replace(">", "&gt;"))
+
+
+def format_start_tag(name: str, attrs: List[Tuple[str, str]], level: int, empty: bool = False) -> str:
+    """
+    生成一行开始标签（empty=True时为自闭合标签）
+    除根元素外，每行以换行符开头，这样文档末尾不会多出换行
+    """
+    attr_str = "".join(f' {k}="{escape_attr(v)}"' for k, v in attrs)
+    prefix = "\n" + INDENT * level if level > 0 else ""
+    return f"{prefix}<{name}{attr_str}{'/' if empty else ''}>"
+
+
+def format_end_tag(name: str, level: int) -> str:
+    return f"\n{INDENT * level}</{name}>"
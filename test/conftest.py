@@ -0,0 +1,58 @@
+import contextlib
+import glob
+import importlib.util
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import msccl_xml_builder  # noqa: E402
+
+# examples中的脚本以xml_generator_tools的名字导入本包
+sys.modules.setdefault("xml_generator_tools", msccl_xml_builder)
+
+EXAMPLES = os.path.join(ROOT, "examples")
+DATA = os.path.join(ROOT, "test", "data")
+
+# 与test/data中的XML对应的示例配置：(脚本, 函数, 参数)
+EXAMPLE_CASES = {
+    "ring_8gpus": ("allgather/ring.py", "generate_allgather_ring_xml",
+                   dict(ngpus=8, instances=2, ring_channels=2)),
+    "inter_first_ring_mesh_2nodes": ("allgather/inter_first/inter_first_ring_mesh.py",
+                                     "generate_inter_first_ring_mesh_allgather_xml",
+                                     dict(node_num=2, gpus_per_node=4)),
+    "two_step_alltoall_2nodes": ("alltoall/two_step_alltoall.py", "generate_alltoall_2step_xml",
+                                 dict(node_nums=2, gpus_pernode=4, instances=1, p2pchannels=2)),
+    "basic_alltoall_2nodes": ("alltoall/basic_alltoall.py", "generate_alltoall_xml",
+                              dict(node_nus=2, gpus_pernode=2, instances=2)),
+    "two_step_alltoall_dep_4nodes": ("alltoall/two_step_alltoall_dep.py", "generate_alltoall_2step_xml",
+                                     dict(node_nums=4, gpus_pernode=2, instances=2)),
+}
+
+
+def read_data(name: str) -> str:
+    with open(os.path.join(DATA, name + ".xml")) as f:
+        return f.read()
+
+
+@pytest.fixture
+def run_example(tmp_path, monkeypatch):
+    """在临时目录中运行示例脚本（部分脚本忽略filename参数，直接写入当前目录），返回生成的XML文本"""
+    def run(name: str) -> str:
+        rel, func, kwargs = EXAMPLE_CASES[name]
+        spec = importlib.util.spec_from_file_location(name, os.path.join(EXAMPLES, rel))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        workdir = tmp_path / name
+        workdir.mkdir()
+        monkeypatch.chdir(workdir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            getattr(module, func)(**kwargs)
+        (path,) = glob.glob(str(workdir / "*.xml"))
+        with open(path) as f:
+            return f.read()
+    return run
@@ -0,0 +1,97 @@
+"""依赖构建：与重写前（baseline）的输出逐字节一致，以及修正后的depid/deps"""
+import pytest
+
+from conftest import read_data
+from msccl_xml_builder import Algo, ChannelGroup, Chunk
+
+
+def stale_dependencies(algo: Algo) -> int:
+    """depid/deps指向的step不在所属step（nop之后的第一个非nop step）的dep_list中的个数"""
+    stale = 0
+    for gpu in algo.gpus:
+        for tb in gpu.tbs:
+            targets = []
+            for step in tb.steps:
+                if step.depid >= 0:
+                    targets.append(gpu.tbs[step.depid].steps[step.deps])
+                if step.type != "nop":
+                    stale += sum(target not in step.dep_list for target in targets)
+                    targets = []
+    return stale
+
+
+@pytest.mark.parametrize("name", ["ring_8gpus", "inter_first_ring_mesh_2nodes",
+                                  "two_step_alltoall_2nodes", "basic_alltoall_2nodes"])
+def test_examples_match_baseline(run_example, name):
+    assert run_example(name) == read_data(name)
+
+
+def test_two_step_alltoall_dep_deps_follow_nop_insertion(run_example, monkeypatch):
+    # 旧实现在插入nop之前记录deps，之后目标step后移，deps指向了前一个step
+    built = []
+    save_xml = Algo.save_xml
+
+    def capture(self, *args, **kwargs):
+        built.append(self)
+        return save_xml(self, *args, **kwargs)
+
+    monkeypatch.setattr(Algo, "save_xml", capture)
+    assert run_example("two_step_alltoall_dep_4nodes") == read_data("two_step_alltoall_dep_4nodes")
+    assert stale_dependencies(built[0]) == 0
+
+
+def test_same_tb_dependencies_collapse_to_latest():
+    algo = Algo(name="fan_in", nchunksperloop=4, ngpus=2)
+    first = Chunk(0, "input", 0, 1, algo).copy(Chunk(0, "output", 0, 1, algo), 0)
+    second = Chunk(0, "input", 1, 1, algo).copy(Chunk(0, "output", 1, 1, algo), 0)
+    step = Chunk(0, "output", 0, 2, algo).copy(Chunk(0, "scratch", 0, 2, algo), 1, dep_steps=[first, second])
+    algo.build_all_dependencies()
+    # 同一TB中second在first之后，只需依赖second，不插入nop
+    assert list(step.dep_list) == [second]
+    assert (step.depid, step.deps) == (second._tb.id, second.s)
+    assert [s.type for s in step._tb.steps] == ["cpy"]
+    assert first.hasdep == 0 and second.hasdep == 1
+    assert stale_dependencies(algo) == 0
+
+
+def test_fixed_channel_ops_depend_on_channel_group_ops():
+    algo = Algo(name="mixed", nchunksperloop=4, ngpus=3)
+    group = ChannelGroup([1, 2])
+    _, grouped_recv = Chunk(0, "input", 0, 1, algo).copy_diff(Chunk(1, "scratch", 0, 1, algo), group)
+    # 固定channel的操作依赖尚未分配channel的recv
+    fixed_send, fixed_recv = Chunk(1, "scratch", 0, 1, algo).copy_diff(Chunk(2, "output", 0, 1, algo), 0,
+                                                                       dep_steps=[grouped_recv])
+    # ChannelGroup操作依赖固定channel的recv
+    grouped_send, _ = Chunk(2, "output", 0, 1, algo).copy_diff(Chunk(0, "output", 0, 1, algo), group,
+                                                              dep_steps=[fixed_recv])
+    assert [tb.chan for tb in algo.gpus[1].tbs] == [0]
+    algo.build_all_dependencies()
+    assert grouped_recv._tb.chan in group.channels and grouped_send._tb.chan in group.channels
+    assert list(fixed_send.dep_list) == [grouped_recv]
+    assert (fixed_send.depid, fixed_send.deps) == (grouped_recv._tb.id, grouped_recv.s)
+    assert list(grouped_send.dep_list) == [fixed_recv]
+    assert stale_dependencies(algo) == 0
+    assert algo.check_deadlock().ok
+
+
+def _fan_out(group_or_map) -> Algo:
+    """GPU 0向GPU 1发送cnt为3、1、1、1的四个chunk"""
+    algo = Algo(name="fan_out", nchunksperloop=6, ngpus=2)
+    index = 0
+    for k, cnt in enumerate([3, 1, 1, 1]):
+        chan = group_or_map if isinstance(group_or_map, ChannelGroup) else group_or_map[k]
+        Chunk(0, "input", index, cnt, algo).copy_diff(Chunk(1, "output", index, cnt, algo), chan)
+        index += cnt
+    algo.build_all_dependencies()
+    return algo
+
+
+def test_channel_group_balances_makespan():
+    algo = _fan_out(ChannelGroup([0, 1]))
+    report = algo.channel_balance
+    # 轮流分配：chan 0为3+1，chan 1为1+1；按cnt从大到小分配：chan 0为3，chan 1为1+1+1
+    assert (report.max_before, report.max_after) == (4, 3)
+    assert report.after == {(0, 0): 3, (1, 0): 3, (0, 1): 3, (1, 1): 3}
+    assert [[step.cnt for step in tb.steps] for tb in algo.gpus[0].tbs] == [[3], [1, 1, 1]]
+    round_robin = _fan_out([0, 1, 0, 1])
+    assert algo.simulate().time < round_robin.simulate().time
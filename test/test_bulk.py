@@ -0,0 +1,71 @@
+"""批量操作：与逐个调用Chunk的结果一致，不支持ChannelGroup"""
+import io
+
+import pytest
+
+from msccl_xml_builder import Algo, ChannelGroup, Chunk
+
+NGPUS = 4
+
+
+def _xml(algo: Algo) -> str:
+    algo.build_all_dependencies()
+    f = io.StringIO()
+    algo.write_xml(f)
+    return f.getvalue()
+
+
+def _hop(hop: int):
+    """(src, dst, off, cnt, chan)：每个rank向后第hop个rank发送，cnt和channel各不相同"""
+    return [(src, (src + hop) % NGPUS, 2 * src + hop - 1, hop, (src + hop) % 2) for src in range(NGPUS)]
+
+
+@pytest.mark.parametrize("storage", ["object", "columnar"])
+def test_bulk_copy_diff_matches_chunk_loop(storage):
+    looped = Algo(name="bulk", nchunksperloop=2 * NGPUS + 2, ngpus=NGPUS, storage=storage)
+    recvs = {}
+    for src, dst, off, cnt, chan in _hop(1):
+        _, recvs[dst] = Chunk(src, "input", off, cnt, looped).copy_diff(Chunk(dst, "output", off, cnt, looped), chan)
+    # 第二跳的发送依赖本GPU在第一跳的接收
+    for src, dst, off, cnt, chan in _hop(2):
+        Chunk(src, "input", off, cnt, looped).copy_diff(Chunk(dst, "output", off, cnt, looped), chan,
+                                                        dep_steps=[recvs[src]])
+
+    bulk = Algo(name="bulk", nchunksperloop=2 * NGPUS + 2, ngpus=NGPUS, storage=storage)
+    src, dst, off, cnt, chan = map(list, zip(*_hop(1)))
+    _, first_recvs = bulk.bulk_copy_diff(src, "input", off, dst, "output", off, cnt, chan)
+    recvs = dict(zip(dst, first_recvs))
+    src, dst, off, cnt, chan = map(list, zip(*_hop(2)))
+    sends, _ = bulk.bulk_copy_diff(src, "input", off, dst, "output", off, cnt, chan,
+                                   dep_steps=[[recvs[rank]] for rank in src])
+    assert [list(send.dep_list) for send in sends] == [[recvs[rank]] for rank in src]
+    assert _xml(bulk) == _xml(looped)
+
+
+def test_bulk_send_recv_match_chunk_loop():
+    looped = Algo(name="bulk", nchunksperloop=NGPUS, ngpus=NGPUS)
+    for rank in range(NGPUS):
+        nxt, prev = (rank + 1) % NGPUS, (rank - 1) % NGPUS
+        Chunk(rank, "input", 0, 1, looped).send(nxt, 0, bidirectional=False)
+        Chunk(rank, "output", prev, 1, looped).recv(prev, 0, bidirectional=False)
+
+    bulk = Algo(name="bulk", nchunksperloop=NGPUS, ngpus=NGPUS)
+    ranks = list(range(NGPUS))
+    # 标量参数广播到所有元素
+    bulk.bulk_send(ranks, "input", 0, [(rank + 1) % NGPUS for rank in ranks], 1, 0, bidirectional=False)
+    prevs = [(rank - 1) % NGPUS for rank in ranks]
+    bulk.bulk_recv(ranks, "output", prevs, prevs, 1, 0, bidirectional=False)
+    assert _xml(bulk) == _xml(looped)
+
+
+@pytest.mark.parametrize("chan", [ChannelGroup([0, 1]), [0, ChannelGroup([0, 1])]])
+def test_bulk_operations_reject_channel_group(chan):
+    algo = Algo(name="bulk", nchunksperloop=2, ngpus=3)
+    with pytest.raises(ValueError, match="ChannelGroup is not supported by bulk operations"):
+        algo.bulk_copy_diff([0, 1], "input", 0, [1, 2], "output", 0, 1, chan)
+    with pytest.raises(ValueError, match="ChannelGroup is not supported by bulk operations"):
+        algo.bulk_send([0, 1], "input", 0, [1, 2], 1, chan)
+    with pytest.raises(ValueError, match="ChannelGroup is not supported by bulk operations"):
+        algo.bulk_recv([1, 2], "output", 0, [0, 1], 1, chan)
+    assert all(not gpu.tbs for gpu in algo.gpus)
+    assert algo._channel_transfers == []
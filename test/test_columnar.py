@@ -0,0 +1,27 @@
+"""列存模式的StepRef句柄"""
+import pytest
+
+from msccl_xml_builder import Algo, Chunk
+
+
+def _pair(storage: str):
+    algo = Algo(name="pair", nchunksperloop=2, ngpus=2, storage=storage)
+    send_step, recv_step = Chunk(0, "input", 0, 1, algo).copy_diff(Chunk(1, "output", 0, 1, algo), 0)
+    step = Chunk(1, "output", 0, 1, algo).copy(Chunk(1, "scratch", 0, 1, algo), 1, dep_steps=[recv_step])
+    return algo, recv_step, step
+
+
+def test_stepref_dependency_views_are_read_only():
+    _, recv_step, step = _pair("columnar")
+    assert step.dep_list == (recv_step,)
+    assert recv_step.depended_by_list == (step,)
+    assert step.depended_by_list == ()
+    with pytest.raises(AttributeError):
+        step.dep_list.append(recv_step)
+
+
+def test_stepref_add_dep_rejects_object_steps():
+    _, _, ref = _pair("columnar")
+    _, _, step = _pair("object")
+    with pytest.raises(TypeError, match="got Step"):
+        ref.add_dep(step)
@@ -0,0 +1,55 @@
+"""关键路径：三种step权重下手工计算的长度、路径和TB松弛"""
+import pytest
+
+from msccl_xml_builder import Algo, Chunk
+from msccl_xml_builder.core import CostModel
+
+CHAIN = [(0, 0, 0, "cpy"), (0, 1, 0, "s"), (1, 0, 0, "r")]
+
+
+def _dag() -> Algo:
+    """GPU 0拷贝cnt=2的chunk后发送给GPU 1；GPU 1上另有一个独立的cnt=4的拷贝（TB 1）"""
+    algo = Algo(name="dag", nchunksperloop=4, ngpus=2)
+    copy_step = Chunk(0, "input", 0, 2, algo).copy(Chunk(0, "scratch", 0, 2, algo), 0)
+    Chunk(0, "scratch", 0, 2, algo).copy_diff(Chunk(1, "output", 0, 2, algo), 0, dep_steps=[copy_step],
+                                              bidirectional=False)
+    Chunk(1, "input", 0, 4, algo).copy(Chunk(1, "scratch", 0, 4, algo), 0)
+    algo.build_all_dependencies()
+    return algo
+
+
+def _check(result, length, path, tb_slack):
+    assert result.length == pytest.approx(length)
+    assert [entry[:4] for entry in result.path] == [step for step, _ in path]
+    assert [entry[4] for entry in result.path] == pytest.approx([weight for _, weight in path])
+    assert [len(slacks) for slacks in result.tb_slack] == [len(slacks) for slacks in tb_slack]
+    for slacks, expected in zip(result.tb_slack, tb_slack):
+        assert slacks == pytest.approx(expected)
+
+
+def test_cnt_weights():
+    result = _dag().critical_path()
+    _check(result, 6, [(step, 2) for step in CHAIN], [[0, 0], [0, 6 - 4]])
+    assert [entry[5] for entry in result.path] == ["enables", "sends to", None]
+    assert result.critical_tbs == [(0, 0), (0, 1), (1, 0)]
+
+
+def test_cost_model_weights():
+    model = CostModel()
+    algo = _dag()
+    local, link = model.local_time(2), model.link_time(0, 1, 2)
+    length = local + link + local
+    result = algo.critical_path(model)
+    _check(result, length, list(zip(CHAIN, [local, link, local])), [[0, 0], [0, length - model.local_time(4)]])
+    # slots不受限时与模拟结果一致
+    assert result.length == pytest.approx(algo.simulate(CostModel(slots=1 << 20)).time)
+
+
+def test_function_weights():
+    # 拷贝代价为传输的10倍时，GPU 1上独立的拷贝成为关键路径
+    weights = {"cpy": 10, "s": 1, "r": 1}
+    result = _dag().critical_path(lambda step_type, cnt: weights[step_type] * cnt)
+    chain = 10 * 2 + 2 + 2
+    _check(result, 40, [((1, 1, 0, "cpy"), 40)], [[40 - chain, 40 - chain], [40 - chain, 0]])
+    assert result.critical_tbs == [(1, 1)]
+    assert result.segments == [(1, 1, 0, 0, 0, 40.0)]
@@ -0,0 +1,71 @@
+"""静态死锁检查：等待环、连接槽位和未配对的send/recv"""
+import os
+
+import pytest
+
+from conftest import DATA
+from msccl_xml_builder import Algo, Chunk
+
+
+def _crossed_recvs() -> Algo:
+    """两个GPU都先接收对方的数据，发送依赖自己的接收"""
+    algo = Algo(name="crossed", nchunksperloop=2, ngpus=2)
+    for rank in range(2):
+        peer = 1 - rank
+        recv_step = Chunk(rank, "output", peer, 1, algo).recv(peer, 0, bidirectional=False)
+        Chunk(rank, "input", 0, 1, algo).send(peer, 0, [recv_step], bidirectional=False)
+    algo.build_all_dependencies()
+    return algo
+
+
+def test_reports_cross_gpu_wait_cycle():
+    report = _crossed_recvs().check_deadlock()
+    assert not report.ok
+    assert (report.nsteps, report.blocked, report.unmatched) == (4, 4, [])
+    # 每个GPU上TB 0为接收TB，TB 1为发送TB
+    assert report.cycles == [[(0, 0, 0, "r", "receives from"), (1, 1, 0, "s", "depends on"),
+                              (1, 0, 0, "r", "receives from"), (0, 1, 0, "s", "depends on"),
+                              (0, 0, 0, "r", None)]]
+    assert "1 wait cycle(s)" in report.summary()
+
+
+def _slot_bound() -> Algo:
+    """GPU 1先在chan 1上接收，GPU 0在chan 0上连续发送两次后才在chan 1上发送"""
+    algo = Algo(name="slots", nchunksperloop=3, ngpus=2)
+    first = Chunk(1, "output", 2, 1, algo).recv(0, 1, bidirectional=False)
+    Chunk(1, "output", 0, 1, algo).recv(0, 0, [first], bidirectional=False)
+    Chunk(1, "output", 1, 1, algo).recv(0, 0, bidirectional=False)
+    Chunk(0, "input", 0, 1, algo).send(1, 0, bidirectional=False)
+    second = Chunk(0, "input", 1, 1, algo).send(1, 0, bidirectional=False)
+    Chunk(0, "input", 2, 1, algo).send(1, 1, [second], bidirectional=False)
+    algo.build_all_dependencies()
+    return algo
+
+
+def test_single_slot_blocks_second_send():
+    algo = _slot_bound()
+    report = algo.check_deadlock(slots=1)
+    assert not report.ok
+    # GPU 0的第二个send要等GPU 1接收第一个，而该接收依赖chan 1上最后才发送的数据
+    assert report.cycles == [[(0, 0, 1, "s", "needs a free slot from"), (1, 1, 0, "r", "depends on"),
+                              (1, 0, 0, "r", "receives from"), (0, 1, 0, "s", "depends on"),
+                              (0, 0, 1, "s", None)]]
+    assert algo.check_deadlock(slots=2).ok
+    assert algo.check_deadlock(slots=None).ok
+
+
+def test_reports_unmatched_send():
+    algo = Algo(name="unmatched", nchunksperloop=1, ngpus=2)
+    Chunk(0, "input", 0, 1, algo).send(1, 0)
+    algo.build_all_dependencies()
+    report = algo.check_deadlock()
+    assert not report.ok
+    assert (report.blocked, report.cycles) == (0, [])
+    assert report.unmatched == [(0, 0, 0, "s", "sends message 0 to rank 1 on channel 0, which is never received")]
+
+
+@pytest.mark.parametrize("name", sorted(name[:-4] for name in os.listdir(DATA) if name.endswith(".xml")))
+def test_examples_are_deadlock_free(name):
+    report = Algo.from_xml(os.path.join(DATA, name + ".xml")).check_deadlock()
+    assert report.ok, report.summary()
+    assert report.summary() == f"No deadlock: all {report.nsteps} steps can complete"
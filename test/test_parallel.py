@@ -0,0 +1,45 @@
+"""workers > 1的XML输出与串行结果一致"""
+import pytest
+
+from msccl_xml_builder import Algo, Chunk
+
+
+def _ring(ngpus: int) -> Algo:
+    algo = Algo(name=f"ring{ngpus}", nchunksperloop=ngpus, ngpus=ngpus)
+    for step in range(ngpus - 1):
+        for rank in range(ngpus):
+            owner = (rank - step) % ngpus
+            Chunk(rank, "output", owner, 1, algo).copy_diff(Chunk((rank + 1) % ngpus, "output", owner, 1, algo), 0)
+    algo.build_all_dependencies()
+    return algo
+
+
+@pytest.mark.parametrize("fork", [True, False])
+def test_concurrent_parallel_saves_do_not_mix(tmp_path, monkeypatch, fork):
+    import threading
+    from msccl_xml_builder.core import parallel
+    if not fork:
+        # 没有fork时使用线程池
+        monkeypatch.setattr(parallel.multiprocessing, "get_all_start_methods", lambda: ["spawn"])
+    algos = [_ring(6), _ring(9)]
+    expected = []
+    for k, algo in enumerate(algos):
+        algo.save_xml(str(tmp_path / f"serial{k}.xml"))
+        expected.append((tmp_path / f"serial{k}.xml").read_text())
+    barrier = threading.Barrier(len(algos))
+    outputs = [[] for _ in algos]
+
+    def save(k: int) -> None:
+        barrier.wait()
+        for attempt in range(5):
+            path = tmp_path / f"parallel{k}_{attempt}.xml"
+            algos[k].save_xml(str(path), workers=2)
+            outputs[k].append(path.read_text())
+
+    threads = [threading.Thread(target=save, args=(k,)) for k in range(len(algos))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for k in range(len(algos)):
+        assert outputs[k] == [expected[k]] * 5
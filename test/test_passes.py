@@ -0,0 +1,126 @@
+"""依赖构建之后的变换：pack_tbs、fuse_rcs、coalesce_transfers"""
+import pytest
+
+from conftest import read_data
+from msccl_xml_builder import Algo, Chunk
+
+
+def _ring_allgather(ngpus: int = 4, build: bool = True) -> Algo:
+    """单向TB的ring allgather：转发的send依赖上一跳的recv，合并TB后变为TB内依赖"""
+    algo = Algo(name="ring", nchunksperloop=ngpus, ngpus=ngpus)
+    for rank in range(ngpus):
+        Chunk(rank, "input", 0, 1, algo).copy(Chunk(rank, "output", rank, 1, algo), 0)
+        recv_step = None
+        for hop in range(ngpus - 1):
+            src, dst = (rank + hop) % ngpus, (rank + hop + 1) % ngpus
+            _, recv_step = Chunk(src, "output", rank, 1, algo).copy_diff(
+                Chunk(dst, "output", rank, 1, algo), 0,
+                dep_steps=[recv_step] if recv_step is not None else None, bidirectional=False)
+    if build:
+        algo.build_all_dependencies()
+    return algo
+
+
+def test_pack_tbs_can_run_twice():
+    algo = _ring_allgather()
+    first = algo.pack_tbs(max_tbs=2)
+    assert first.dropped_deps > 0
+    # 清除的依赖也从dep_list中删除，第二次合并不会把算法当作尚未构建依赖
+    for gpu in algo.gpus:
+        for tb in gpu.tbs:
+            assert all(dep._tb is not tb for step in tb.steps for dep in step.dep_list)
+    second = algo.pack_tbs()
+    assert first.after == [2] * algo.ngpus
+    assert second.before == first.after and second.after == [1] * algo.ngpus
+
+
+@pytest.mark.parametrize("name", ["pack_tbs", "fuse_rcs", "coalesce_transfers"])
+def test_passes_require_built_object_algo(name):
+    with pytest.raises(RuntimeError, match=f"{name} must run after build_all_dependencies"):
+        getattr(_ring_allgather(build=False), name)()
+    algo = Algo(name="ring", nchunksperloop=2, ngpus=2, storage="columnar")
+    with pytest.raises(ValueError, match=f"{name} requires storage='object'"):
+        getattr(algo, name)()
+
+
+def test_fuse_rcs_matches_merge_rcs_on_ring(run_example, monkeypatch):
+    # 示例以merge_rcs=True构建，改为不合并后再融合
+    built = []
+    build = Algo.build_all_dependencies
+
+    def build_unmerged(self, merge_rcs=False, *args, **kwargs):
+        built.append(self)
+        build(self, False, *args, **kwargs)
+        report = self.fuse_rcs()
+        # 每个GPU上的2个instance各转发ngpus - 2个chunk，每次融合减少一个step
+        assert report.fused == 8 * 2 * 6
+        assert (report.steps_before, report.steps_after) == (240, 240 - report.fused)
+        assert report.time_after < report.time_before
+
+    monkeypatch.setattr(Algo, "build_all_dependencies", build_unmerged)
+    # ring中转发的recv与send相邻，融合结果与构建时合并相同
+    assert run_example("ring_8gpus") == read_data("ring_8gpus")
+    assert built[0].check_deadlock().ok
+    assert sum(len(tb.steps) for gpu in built[0].gpus for tb in gpu.tbs) == 144
+
+
+def _send_loop(n: int, dep_on=None):
+    """GPU 0逐个发送n个cnt=1的连续chunk；dep_on不为None时GPU 1上的拷贝依赖该chunk的recv"""
+    algo = Algo(name="loop", nchunksperloop=n, ngpus=2)
+    dependent = None
+    for k in range(n):
+        _, recv_step = Chunk(0, "input", k, 1, algo).copy_diff(Chunk(1, "output", k, 1, algo), 0)
+        if k == dep_on:
+            dependent = Chunk(1, "output", k, 1, algo).copy(Chunk(1, "scratch", 0, 1, algo), 1,
+                                                            dep_steps=[recv_step])
+    algo.build_all_dependencies()
+    return algo, dependent
+
+
+def _transfers(algo: Algo):
+    """GPU 0的send和GPU 1的recv：(srcoff, dstoff, cnt, index)"""
+    sends = [(step.srcoff, step.dstoff, step.cnt, step.send_index) for step in algo.gpus[0].tbs[0].steps]
+    recvs = [(step.srcoff, step.dstoff, step.cnt, step.recv_index) for step in algo.gpus[1].tbs[0].steps]
+    assert sends == recvs
+    return sends
+
+
+def test_coalesce_contiguous_loop():
+    algo, _ = _send_loop(4)
+    report = algo.coalesce_transfers()
+    assert (report.transfers, report.removed_steps, report.max_cnt) == (1, 6, 4)
+    assert _transfers(algo) == [(0, 0, 4, 0)]
+    assert algo.check_deadlock().ok
+
+
+def test_coalesce_splits_at_max_cnt():
+    algo, _ = _send_loop(4)
+    report = algo.coalesce_transfers(max_cnt=3)
+    assert (report.transfers, report.removed_steps, report.max_cnt) == (1, 4, 3)
+    # 连接上的index重新编号
+    assert _transfers(algo) == [(0, 0, 3, 0), (3, 3, 1, 1)]
+    assert algo.check_deadlock().ok
+
+
+def test_coalesce_stops_after_referenced_step():
+    # 被依赖的recv只能是合并序列的最后一个，否则依赖者要等待整个合并后的传输
+    algo, dependent = _send_loop(4, dep_on=1)
+    report = algo.coalesce_transfers()
+    assert (report.transfers, report.removed_steps) == (2, 4)
+    assert _transfers(algo) == [(0, 0, 2, 0), (2, 2, 2, 1)]
+    head = algo.gpus[1].tbs[0].steps[0]
+    assert (dependent.depid, dependent.deps) == (0, 0) and head.hasdep == 1
+    assert algo.gpus[1].tbs[0].steps[1].hasdep == 0
+    assert algo.check_deadlock().ok
+
+
+def test_coalesce_remaps_deps_to_merged_step():
+    algo, dependent = _send_loop(4, dep_on=3)
+    assert (dependent.depid, dependent.deps) == (0, 3)
+    algo.coalesce_transfers()
+    assert _transfers(algo) == [(0, 0, 4, 0)]
+    # 依赖最后一个recv的拷贝改为依赖合并后位于原第一个recv处的step
+    head = algo.gpus[1].tbs[0].steps[0]
+    assert (dependent.depid, dependent.deps) == (0, 0) and head.hasdep == 1
+    assert list(dependent.dep_list) == [head]
+    assert algo.check_deadlock().ok
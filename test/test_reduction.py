@@ -0,0 +1,51 @@
+"""依赖的传递约简"""
+import time
+
+from msccl_xml_builder import GPU, TB, Step
+
+
+def _gpu(ntbs: int) -> GPU:
+    gpu = GPU(0)
+    for t in range(ntbs):
+        tb = TB(send=-1, recv=-1, chan=t)
+        tb.id = t
+        gpu.tbs.append(tb)
+    return gpu
+
+
+def _append(tb: TB, *deps: Step) -> Step:
+    step = Step(s=len(tb.steps), type="cpy", srcbuf="i", srcoff=0, dstbuf="o", dstoff=0, cnt=1)
+    step._tb, step._gpu_id = tb, 0
+    for dep_step in deps:
+        step.add_dep(dep_step)
+    tb.steps.append(step)
+    return step
+
+
+def test_redundant_dependencies_are_removed():
+    gpu = _gpu(3)
+    a0, a1 = _append(gpu.tbs[0]), _append(gpu.tbs[0])
+    b0 = _append(gpu.tbs[1], a1)
+    # a0由b0经a1推出，a1由b0推出；b0需要保留
+    c0 = _append(gpu.tbs[2], a0, b0, a1)
+    assert gpu.reduce_dependencies() == (2, 2)
+    assert list(c0.dep_list) == [b0]
+    assert a0.hasdep == 0 and a1.hasdep == 1
+
+
+def test_reduction_time_is_independent_of_tb_count():
+    # 两步alltoall式的GPU：一半TB只接收，另一半的每个step依赖某个接收TB中的step，
+    # 时钟只含少数TB；稠密向量时钟的耗时随TB数平方增长
+    def run(ntbs: int) -> float:
+        gpu = _gpu(ntbs)
+        half = ntbs // 2
+        for t in range(ntbs):
+            for k in range(4):
+                deps = [gpu.tbs[(t * 7 + k) % half].steps[k]] if t >= half else []
+                _append(gpu.tbs[t], *deps)
+        start = time.perf_counter()
+        gpu.reduce_dependencies()
+        return time.perf_counter() - start
+
+    small, large = run(1000), run(8000)
+    assert large < 32 * max(small, 1e-3)
@@ -0,0 +1,71 @@
+"""离散事件模拟的代价模型"""
+import pytest
+
+from msccl_xml_builder import Algo, Chunk
+from msccl_xml_builder.core import CostModel
+
+
+def _forwarding_chain() -> Algo:
+    """0 -> 1 -> 2的转发链，合并TB并融合后GPU 1只有一个rcs"""
+    algo = Algo(name="chain", nchunksperloop=1, ngpus=3)
+    _, recv_step = Chunk(0, "input", 0, 1, algo).copy_diff(Chunk(1, "output", 0, 1, algo), 0, bidirectional=False)
+    Chunk(1, "output", 0, 1, algo).copy_diff(Chunk(2, "output", 0, 1, algo), 0, dep_steps=[recv_step],
+                                             bidirectional=False)
+    algo.build_all_dependencies()
+    algo.pack_tbs()
+    assert algo.fuse_rcs().fused == 1
+    return algo
+
+
+def test_forwarding_steps_add_local_time_by_default():
+    algo = _forwarding_chain()
+    model = CostModel()
+    link, local = model.link_time(0, 1, 1), model.local_time(1)
+    # send、rcs（本地处理 + 发送）、recv
+    assert algo.simulate(model).time == pytest.approx(link + (local + link) + local)
+    # 一次读入即转发：rcs的本地处理与发送重叠
+    overlapped = CostModel(overlap_forwarding=True)
+    assert algo.simulate(overlapped).time == pytest.approx(link + max(local, link) + local)
+
+
+def _two_hop(pipeline: int):
+    """0 -> 1 -> 2转发cnt=2的chunk，另有一个流水线之前创建的拷贝"""
+    algo = Algo(name="chain", nchunksperloop=4, ngpus=3)
+    copy_step = Chunk(0, "input", 2, 1, algo).copy(Chunk(0, "output", 2, 1, algo), 1)
+    _, first_recv = Chunk(0, "input", 0, 2, algo).copy_diff(Chunk(1, "scratch", 0, 2, algo), 0, pipeline=pipeline)
+    last_send, _ = Chunk(1, "scratch", 0, 2, algo).copy_diff(Chunk(2, "output", 0, 2, algo), 0,
+                                                             dep_steps=[first_recv], pipeline=pipeline)
+    return algo, copy_step, first_recv, last_send
+
+
+def _simulated(pipeline: int) -> float:
+    algo = _two_hop(pipeline)[0]
+    algo.build_all_dependencies()
+    return algo.simulate().time
+
+
+def test_pipelined_hops_keep_data_size():
+    algo, copy_step, first_recv, last_send = _two_hop(3)
+    # cnt=2不能被3整除，chunk单位细分为1/3
+    assert (algo.chunk_scale, algo.nchunksperloop) == (3, 12)
+    assert (copy_step.srcoff, copy_step.dstoff, copy_step.cnt) == (6, 6, 3)
+    recvs = first_recv._tb.steps
+    sends = last_send._tb.steps
+    assert [(step.dstoff, step.cnt) for step in recvs] == [(0, 2), (2, 2), (4, 2)]
+    # 第i个子send只依赖第i个上游子recv
+    assert [list(step.dep_list) for step in sends] == [[recv] for recv in recvs]
+    algo.build_all_dependencies()
+    assert algo.check_deadlock().ok
+    assert [(step.depid, step.deps) for step in sends] == [(first_recv._tb.id, s) for s in range(3)]
+
+    # 模拟按切分前的chunk计算数据量：细分不增加传输的字节数，流水线越深各跳重叠越多
+    model = CostModel()
+    link = model.link_time(0, 1, 2)
+    times = [_simulated(pipeline) for pipeline in (1, 2, 3)]
+    assert times[0] == pytest.approx(2 * (link + model.local_time(2)))
+    assert times[0] > times[1] > times[2]
+    assert algo.simulate(model).time == pytest.approx(times[2])
+    assert algo.critical_path(model).length == pytest.approx(times[2])
+    scaled = model.scaled(algo.chunk_scale)
+    assert sum(scaled.link_time(0, 1, step.cnt) - scaled.intra_alpha for step in sends) == pytest.approx(
+        link - model.intra_alpha)
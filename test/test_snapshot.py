@@ -0,0 +1,46 @@
+"""二进制快照"""
+import io
+
+from msccl_xml_builder import Algo, Chunk, TB
+
+
+def _ring(nchunks: int, ngpus: int = 4) -> Algo:
+    algo = Algo(name="ring", nchunksperloop=nchunks, ngpus=ngpus, storage="columnar")
+    src = [gpu for chunk in range(nchunks) for gpu in range(ngpus)]
+    dst = [(gpu + 1) % ngpus for chunk in range(nchunks) for gpu in range(ngpus)]
+    off = [chunk for chunk in range(nchunks) for gpu in range(ngpus)]
+    algo.bulk_copy_diff(src, "output", off, dst, "output", off, 1, 0)
+    algo.build_all_dependencies()
+    return algo
+
+
+def test_mmap_load_restores_extents_without_visiting_rows(tmp_path, monkeypatch):
+    algo = _ring(16)
+    path = str(tmp_path / "ring.snap")
+    algo.save_snapshot(path)
+
+    def visit(self, step):
+        raise AssertionError("mmap load visited a row")
+
+    monkeypatch.setattr(TB, "track_step_extents", visit)
+    loaded = Algo.load_snapshot(path, storage="columnar", mmap=True)
+    assert [[tb.buffer_extents for tb in gpu.tbs] for gpu in loaded.gpus] == \
+        [[tb.buffer_extents for tb in gpu.tbs] for gpu in algo.gpus]
+    monkeypatch.undo()
+    expected, actual = io.StringIO(), io.StringIO()
+    algo.write_xml(expected)
+    loaded.write_xml(actual)
+    assert actual.getvalue() == expected.getvalue()
+
+
+def test_snapshot_keeps_chunk_scale(tmp_path):
+    algo = Algo(name="chain", nchunksperloop=2, ngpus=3)
+    _, recv_step = Chunk(0, "input", 0, 1, algo).copy_diff(Chunk(1, "output", 0, 1, algo), 0, pipeline=3)
+    assert (algo.nchunksperloop, algo.chunk_scale) == (6, 3)
+    path = str(tmp_path / "chain.snap")
+    algo.save_snapshot(path)
+    loaded = Algo.load_snapshot(path)
+    assert (loaded.nchunksperloop, loaded.chunk_scale) == (6, 3)
+    # 之后的Chunk操作与保存前一样按chunk_scale换算
+    step = Chunk(1, "output", 1, 1, loaded).copy(Chunk(1, "scratch", 0, 1, loaded), 0)
+    assert (step.srcoff, step.dstoff, step.cnt) == (3, 0, 3)
@@ -0,0 +1,50 @@
+"""rank模板：只能在program中描述step"""
+import pytest
+
+from msccl_xml_builder import Algo, ChannelGroup, Chunk
+from msccl_xml_builder.core.pipeline import rescale_chunks
+
+
+def _ring_template(ngpus: int = 4) -> Algo:
+    algo = Algo(name="ring", nchunksperloop=ngpus, ngpus=ngpus)
+
+    def program(ctx):
+        nxt, prev = (ctx.rank + 1) % ctx.ngpus, (ctx.rank - 1) % ctx.ngpus
+        ctx.send(nxt, "i", 0, dstbuf="o", dstoff=ctx.rank)
+        ctx.recv(prev, "o", prev, srcbuf="i", srcoff=0)
+
+    algo.set_rank_template(program)
+    return algo
+
+
+def test_chunk_and_bulk_operations_reject_template():
+    algo = _ring_template()
+    with pytest.raises(ValueError, match="set_rank_template"):
+        Chunk(0, "input", 0, 1, algo).copy_diff(Chunk(1, "output", 0, 1, algo), 0)
+    with pytest.raises(ValueError, match="set_rank_template"):
+        Chunk(0, "input", 0, 1, algo).copy(Chunk(0, "output", 0, 1, algo), 0)
+    with pytest.raises(ValueError, match="set_rank_template"):
+        algo.bulk_copy_diff([0, 1], "input", 0, [1, 2], "output", 0, 1, 0)
+    with pytest.raises(ValueError, match="set_rank_template"):
+        algo.get_gpu(0)
+    # 展开的rank不受影响
+    assert [len(tb.steps) for tb in algo.gpus[0].tbs] == [1, 1]
+
+
+def test_channel_group_rejects_template():
+    algo = _ring_template()
+    group = ChannelGroup([0, 1])
+    with pytest.raises(ValueError, match="set_rank_template"):
+        Chunk(0, "input", 0, 1, algo).copy_diff(Chunk(1, "output", 0, 1, algo), group)
+    with pytest.raises(ValueError, match="set_rank_template"):
+        Chunk(0, "input", 0, 1, algo).copy(Chunk(0, "output", 0, 1, algo), group)
+    assert algo._channel_transfers == []
+
+
+def test_pipeline_rejects_template():
+    algo = _ring_template()
+    with pytest.raises(ValueError, match="set_rank_template"):
+        Chunk(0, "input", 0, 1, algo).copy_diff(Chunk(1, "output", 0, 1, algo), 0, pipeline=4)
+    with pytest.raises(ValueError, match="set_rank_template"):
+        rescale_chunks(algo, 4)
+    assert (algo.nchunksperloop, algo.chunk_scale) == (4, 1)
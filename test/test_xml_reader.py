@@ -0,0 +1,99 @@
+"""from_xml：读回的算法重新输出与原文件逐字节一致，send/recv按连接和index配对"""
+import os
+
+import pytest
+
+from conftest import DATA
+from msccl_xml_builder import Algo
+from msccl_xml_builder.core.columnar import decode_ref
+from msccl_xml_builder.core.tb import RECV_STEP_TYPES, SEND_STEP_TYPES
+
+NAMES = sorted(name[:-4] for name in os.listdir(DATA) if name.endswith(".xml"))
+
+
+def _step_types(algo: Algo) -> list:
+    types = []
+    for gpu in algo.gpus:
+        if gpu.table is None:
+            types.extend(step.type for tb in gpu.tbs for step in tb.steps)
+        else:
+            types.extend(gpu.table.names[code] for code in gpu.table.type)
+    return types
+
+
+@pytest.mark.parametrize("storage", ["object", "columnar"])
+@pytest.mark.parametrize("keep_nops", [True, False])
+@pytest.mark.parametrize("name", NAMES)
+def test_from_xml_round_trip(name, keep_nops, storage, tmp_path):
+    path = os.path.join(DATA, name + ".xml")
+    algo = Algo.from_xml(path, storage=storage, keep_nops=keep_nops)
+    assert algo.storage == storage
+    if not keep_nops:
+        # nop链合并回dep_list，重新构建得到相同的nop和depid/deps
+        assert "nop" not in _step_types(algo)
+        algo.build_all_dependencies()
+    output = tmp_path / "out.xml"
+    algo.save_xml(str(output))
+    with open(path, "rb") as f:
+        assert output.read_bytes() == f.read()
+
+
+def _object_peers(algo: Algo) -> dict:
+    """(gpu, tb, s, 是否为发送侧) -> 对端的(gpu, tb, s)"""
+    peers = {}
+    for gpu in algo.gpus:
+        for tb in gpu.tbs:
+            for step in tb.steps:
+                if step.type in ("s", "r"):
+                    sides = [(step.type == "s", step.peer_step)]
+                else:
+                    sides = [(True, step.send_peer), (False, step.recv_peer)]
+                for sending, peer in sides:
+                    if peer is not None:
+                        peers[(gpu.id, tb.id, step.s, sending)] = (peer._get_gpu_id(), peer._tb.id, peer.s)
+    return peers
+
+
+@pytest.mark.parametrize("name", ["ring_8gpus", "two_step_alltoall_2nodes", "inter_first_ring_mesh_2nodes"])
+def test_from_xml_pairs_peers(name):
+    path = os.path.join(DATA, name + ".xml")
+    algo = Algo.from_xml(path)
+    peers = _object_peers(algo)
+    nsends = nrecvs = 0
+    for (gpu_id, tb_id, s, sending), (peer_gpu, peer_tb, peer_s) in peers.items():
+        tb = algo.gpus[gpu_id].tbs[tb_id]
+        step = tb.steps[s]
+        other_tb = algo.gpus[peer_gpu].tbs[peer_tb]
+        other = other_tb.steps[peer_s]
+        assert other_tb.chan == tb.chan
+        # 同一连接上序号相同的发送和接收互为peer
+        if sending:
+            nsends += 1
+            assert (peer_gpu, other_tb.recv) == (tb.send, gpu_id)
+            assert other.recv_index == step.send_index
+        else:
+            nrecvs += 1
+            assert (peer_gpu, other_tb.send) == (tb.recv, gpu_id)
+            assert other.send_index == step.recv_index
+        assert peers[(peer_gpu, peer_tb, peer_s, not sending)] == (gpu_id, tb_id, s)
+    # 所有发送类和接收类step都已配对
+    steps = [step for gpu in algo.gpus for tb in gpu.tbs for step in tb.steps]
+    assert nsends == sum(step.type in SEND_STEP_TYPES for step in steps) > 0
+    assert nrecvs == sum(step.type in RECV_STEP_TYPES for step in steps)
+
+    # 列存的peer列引用相同位置的step
+    columnar = Algo.from_xml(path, storage="columnar")
+    column_peers = {}
+    for gpu in columnar.gpus:
+        table = gpu.table
+        for row in range(len(table)):
+            relay = table.send_index[row] >= 0 and table.recv_index[row] >= 0
+            sides = [(True, table.peer[row]), (False, table.recv_peer[row])] if relay else \
+                [(table.send_index[row] >= 0, table.peer[row])]
+            for sending, ref in sides:
+                if ref >= 0:
+                    peer_gpu, peer_row = decode_ref(ref)
+                    peer_table = columnar.gpus[peer_gpu].table
+                    column_peers[(gpu.id, table.tb[row], table.s[row], sending)] = (
+                        peer_gpu, peer_table.tb[peer_row], peer_table.s[peer_row])
+    assert column_peers == peers